@@ -1,12 +1,12 @@
 import os
+import math
+import asyncio
 import logging
-import uuid
-import pika
 import json
-from datetime import datetime
-import requests
-from fastapi import FastAPI, Depends, HTTPException, status
-from pydantic import BaseModel, Field
+import anyio
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, status
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
@@ -24,30 +24,50 @@ from database import (
 )
 from models.clients import Cliente, SmsIncoming
 from setupLog import setup_logging
-from productorRabbitmq import (
-    connect_to_rabbitmq,
-    close_rabbitmq_connection,
-    publish_to_resend_queue,
-    RABBITMQ_HOST,
-    rabbitmq_channel,
-)
+from productorRabbitmq import DLR_INGEST_QUEUE, close_publisher, get_publisher
+from utils.group_commit import GroupCommitWriter
+from utils.outbox import enqueue_rows
+from utils.dlr import apply_dlr
+from utils.adaptive_rate import get_provider_limiter
+from utils.circuit_breaker import get_provider_breaker
 
 # Importaciones relacionadas con la autenticación y usuarios
 from models.users import User, UserRole
 import utils.auth as auth
-from utils import crud
+from utils import crud, client_crud, sms_crud, idempotency, rate_limit
+from utils.cache import MISSING
 from schemas.user import UserCreate
+from schemas.dlr import DLRWebhookPayload
 from controllers.users import router as router_users
 from controllers.clients import router as router_clients
 
-# productor worker pdf
-from worker_resend import CERTIFICACION_PDF_QUEUE
-
 load_dotenv()
 # --- Configuración de Logs ---
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Máximo de mensajes aceptados en una sola petición a /receive_sms/batch
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", 1000))
+
+# --- Pool de hilos acotado para la ingesta ---
+# El trabajo bloqueante de /receive_sms (SQLAlchemy síncrono y pika) se
+# ejecuta fuera del event loop, limitado a INGRESS_MAX_THREADS hilos para
+# que una ráfaga del proveedor no agote el pool por defecto de la aplicación.
+INGRESS_MAX_THREADS = int(os.getenv("INGRESS_MAX_THREADS", 16))
+ingress_limiter = anyio.CapacityLimiter(INGRESS_MAX_THREADS)
+
+# --- Group commit opcional para las inserciones de SMS ---
+# Agrupa las inserciones concurrentes en una transacción (un fsync) cada
+# GROUP_COMMIT_MAX_ROWS filas o GROUP_COMMIT_MAX_DELAY_MS milisegundos.
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", 200))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", 10))
+group_commit_writer = None
+
+# --- Ingesta de DLR "ack-first" ---
+# El webhook solo encola el DLR y responde; worker_dlr_ingest.py lo aplica.
+DLR_ACK_FIRST = os.getenv("DLR_ACK_FIRST", "true").lower() in ("1", "true", "yes")
+
 
 # --- Inicialización de la Base de Datos ---
 # Crea las tablas si no existen al iniciar la aplicación
@@ -74,7 +94,37 @@ async def lifespan(app: FastAPI):
         logger.error(f"Error al crear el usuario administrador: {e}")
     finally:
         db.close()
+
+    global group_commit_writer
+    if GROUP_COMMIT_ENABLED:
+        group_commit_writer = GroupCommitWriter(
+            SessionLocal,
+            max_rows=GROUP_COMMIT_MAX_ROWS,
+            max_delay_ms=GROUP_COMMIT_MAX_DELAY_MS,
+        )
+        group_commit_writer.start()
+    purga = asyncio.create_task(purgar_claves_idempotencia())
     yield
+    purga.cancel()
+    if group_commit_writer is not None:
+        group_commit_writer.stop()
+        group_commit_writer = None
+    close_publisher()
+
+
+async def purgar_claves_idempotencia():
+    """Elimina periódicamente las claves de idempotencia fuera de la ventana."""
+    while True:
+        await asyncio.sleep(60)
+        db = SessionLocal()
+        try:
+            borradas = await anyio.to_thread.run_sync(idempotency.purge_expired, db)
+            if borradas:
+                logger.info(f"{borradas} claves de idempotencia caducadas eliminadas.")
+        except Exception as e:
+            logger.error(f"Error al purgar las claves de idempotencia: {e}")
+        finally:
+            db.close()
 
 
 # --- Creación de la Aplicación FastAPI ---
@@ -94,61 +144,15 @@ app.include_router(router_clients)
 class SmsInput(BaseModel):
     """
     Modelo de datos para la validación de la carga útil del POST.
+    Mismos campos que los parámetros de `GET /receive_sms`.
     """
 
     sender_id: str
     recipients: str
     message: str
-
-
-# --- Modelo para la respuesta dlr ---
-class DLRWebhookPayload(BaseModel):
-    msgId: str = Field(
-        ...,
-        description="ID del mensaje del proveedor. Clave para la conciliación.",
-    )
-    event: str = Field(
-        ..., description="Estado de entrega (ej: DELIVERED, UNDELIVERED)"
-    )
-    errorCode: Optional[int] = Field(
-        None, description="Código de error, 0 si no hay error."
-    )
-    errorMessage: Optional[str] = Field(
-        None, description="Mensaje de error asociado, si aplica."
-    )
-    numParts: int
-    partNum: int
-
-
-def publish_to_pdf_queue(db_message_id: int):
-    """
-    Publica un mensaje en la cola Certificacion_PDF.
-    """
-    if not rabbitmq_channel or not rabbitmq_channel.is_open:
-        logger.error(
-            "El canal de RabbitMQ no está disponible para publicar en la cola PDF."
-        )
-        # Esto es un error crítico, el estado se actualizó pero la siguiente tarea no se encoló.
-        # Requiere monitoreo y posible intervención manual o un proceso de conciliación.
-        return
-
-    message_body = {"db_message_id": db_message_id}
-    try:
-        rabbitmq_channel.basic_publish(
-            exchange="",
-            routing_key=CERTIFICACION_PDF_QUEUE,
-            body=json.dumps(message_body).encode("utf-8"),
-            properties=pika.BasicProperties(
-                delivery_mode=2
-            ),  # Mensaje persistente
-        )
-        logger.info(
-            f"Tarea para db_message_id '{db_message_id}' encolada en '{CERTIFICACION_PDF_QUEUE}'."
-        )
-    except Exception as e:
-        logger.error(
-            f"Error al publicar en la cola PDF para db_message_id '{db_message_id}': {e}"
-        )
+    action: str
+    sub_account: str
+    sub_account_pass: str
 
 
 # --- Endpoint para Recibir SMS ---
@@ -160,6 +164,8 @@ async def receive_sms(
     action: str,
     sub_account: str,
     sub_account_pass: str,
+    client_message_id: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """
@@ -167,19 +173,80 @@ async def receive_sms(
 
     - Valida los datos de entrada.
     - Busca la información del cliente (`sender`).
+    - Aplica los límites de envío por `sub_account` y por sender; si se
+      superan responde 429 con el código de throttling del vendor (105).
     - Registra el mensaje entrante con estado 'pending'.
     - Devuelve una respuesta inmediata para desacoplar el procesamiento posterior.
+    - Es idempotente: un reintento con el mismo `client_message_id` (o
+      `Idempotency-Key`), o con el mismo contenido dentro de la ventana,
+      devuelve la respuesta original sin registrar ni encolar nada.
+
+    La consulta y el commit son bloqueantes, por lo que se
+    delegan al pool acotado de ingesta para no detener el event loop.
     """
-    message_id = str(uuid.uuid4())  # Generar un ID único para el mensaje
+    clave = idempotency.idempotency_key(
+        sub_account,
+        client_message_id or idempotency_key,
+        sender_id,
+        recipients,
+        message,
+    )
+    original = await buscar_respuesta_previa(db, clave)
+    if original is not None:
+        logger.info(f"Petición repetida de '{sender_id}'. Se devuelve la respuesta original.")
+        return original
+
+    sms_rows, outbox_rows, entries = await ejecutar_en_ingesta(
+        db,
+        preparar_sms_entrante,
+        db,
+        sender_id=sender_id,
+        recipients=recipients,
+        message=message,
+        action=action,
+        sub_account=sub_account,
+        sub_account_pass=sub_account_pass,
+    )
+
+    # 2. Registrar un SMS por destinatario en sms_incoming con status "pending"
+    #    junto con sus tareas de reenvío en el outbox, en la misma transacción.
+    response_data = {
+        'errorCode': 0,
+        'errorDescription': 'Ok',
+        'sms': [entries],
+        'messageCount': len(sms_rows),
+        'messageParts': len(sms_rows)
+    }
+    duplicada = await guardar_sms(db, sms_rows, outbox_rows, clave, response_data)
+    if duplicada is not None:
+        return duplicada
     logger.info(
-        f"Recibido nuevo SMS de '{sender_id}' con message_id: {message_id}"
+        f"{len(sms_rows)} SMS de '{sender_id}' registrados en la BBDD con estado 'pending'."
     )
 
+    # 3. Las tareas de reenvío las publica en RabbitMQ el relay del outbox
+    # 4. Devolver una respuesta
+    return response_data
+
+
+def preparar_sms_entrante(
+    db: Session,
+    sender_id: str,
+    recipients: str,
+    message: str,
+    action: str,
+    sub_account: str,
+    sub_account_pass: str,
+):
+    """
+    Parte síncrona de `receive_sms`: busca el cliente y prepara una fila de SMS
+    (y su tarea de reenvío) por destinatario. Se ejecuta en un hilo del pool de ingesta.
+    """
+    logger.info(f"Recibido nuevo SMS de '{sender_id}'")
+
     # 1. Consultar la tabla clientes para obtener los datos asociados al sender
     logger.info(f"Buscando cliente con sender: {sender_id}")
-    cliente = (
-        db.query(Cliente).filter(Cliente.sender == sender_id).first()
-    )
+    cliente = client_crud.get_client_data_cached(db, sender_id)
 
     if not cliente:
         logger.warning(
@@ -195,116 +262,284 @@ async def receive_sms(
         f"Cliente encontrado: Email='{cliente.email_cliente}', FTP='{cliente.ftp_directorio}'"
     )
 
-    # 2. Registrar inmediatamente el mensaje en sms_incoming con status "pending"
-    nuevo_sms = SmsIncoming(
-        message_id=message_id,
-        sender=sender_id,
-        receiver=recipients,
-        content=message,
-        timestamp_received=datetime.now(),
-        status="pending",  # Estado inicial
-        email_cliente=cliente.email_cliente,
-        ftp_directorio=cliente.ftp_directorio,
-        action=action,
-        sub_account=sub_account,
-        sub_account_pass=sub_account_pass
-    )
-
     try:
-        db.add(nuevo_sms)
-        db.commit()
-        db.refresh(nuevo_sms)
-        logger.info(
-            f"SMS con message_id '{message_id}' registrado en la BBDD con estado 'pending'."
+        sms_rows, outbox_rows, entries = sms_crud.build_message_rows(
+            sender_id=sender_id,
+            recipients=recipients,
+            message=message,
+            action=action,
+            sub_account=sub_account,
+            sub_account_pass=sub_account_pass,
+            cliente=cliente,
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+        )
+    if not sms_rows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No se recibió ningún destinatario válido.",
         )
+
+    # Control de admisión antes de insertar: cada destinatario cuenta como un SMS
+    espera = rate_limit.admit(sub_account, sender_id, len(sms_rows))
+    if espera:
+        logger.warning(
+            f"Límite de envío superado por '{sub_account}' / '{sender_id}'. Reintentar en {espera:.2f}s."
+        )
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail={
+                "errorCode": sms_crud.SMS_THROTTLED,
+                "errorDescription": "Throttling error",
+            },
+            headers={"Retry-After": str(math.ceil(espera))},
+        )
+    return sms_rows, outbox_rows, entries
+
+
+async def ejecutar_en_ingesta(db: Session, fn, *args, **kwargs):
+    """
+    Ejecuta `fn` en el pool acotado de ingesta y, al terminar, devuelve al pool
+    de SQLAlchemy la conexión de la sesión: ninguna petición retiene una
+    conexión mientras espera un hilo libre o su group commit.
+    """
+    def _ejecutar():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            db.close()
+
+    return await anyio.to_thread.run_sync(_ejecutar, limiter=ingress_limiter)
+
+
+async def buscar_respuesta_previa(db: Session, clave: Optional[str]):
+    """Respuesta original de una petición repetida (caché del proceso y después BBDD)."""
+    original = idempotency.get_cached_response(clave)
+    if original is not MISSING:
+        return original
+    if clave is None:
+        return None
+    return await ejecutar_en_ingesta(db, idempotency.get_stored_response, db, clave)
+
+
+async def guardar_sms(
+    db: Session,
+    sms_rows: list,
+    outbox_rows: list,
+    clave: Optional[str] = None,
+    response_data: dict = None,
+):
+    """
+    Inserta los SMS, sus tareas del outbox y la clave de idempotencia. Con el
+    group commit activo la petición espera a que su grupo sea durable sin
+    ocupar un hilo de ingesta.
+
+    Si otra petición con la misma clave se registró a la vez, no se guarda nada
+    y se devuelve la respuesta de aquella; en caso normal devuelve `None`.
+    """
+    ingest_rows = [idempotency.ingest_row(clave, response_data)] if clave else []
+    try:
+        if group_commit_writer is not None:
+            await asyncio.wrap_future(
+                group_commit_writer.submit(sms_rows, outbox_rows, ingest_rows)
+            )
+        else:
+            await ejecutar_en_ingesta(
+                db, sms_crud.insert_sms_rows, db, sms_rows, outbox_rows, ingest_rows
+            )
+    except IntegrityError as e:
+        # No se guardó nada: los SMS no cuentan para los límites de envío
+        rate_limit.release(sms_rows)
+        original = await buscar_respuesta_previa(db, clave) if clave else None
+        if original is None:
+            logger.error(f"Error al registrar {len(sms_rows)} SMS en la base de datos: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error interno al guardar el mensaje.",
+            )
+        logger.info("Petición concurrente repetida. Se devuelve la respuesta original.")
+        return original
     except Exception as e:
-        db.rollback()
-        logger.error(f"Error al registrar el SMS en la base de datos: {e}")
+        rate_limit.release(sms_rows)
+        logger.error(f"Error al registrar {len(sms_rows)} SMS en la base de datos: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error interno al guardar el mensaje.",
         )
+    idempotency.remember(clave, response_data)
+    return None
 
-    # 3. Productor RabbitMQ
-    try:
-        publish_to_resend_queue(
-            message_id=nuevo_sms.message_id,
-            email_cliente=cliente.email_cliente,
-            ftp_directorio=cliente.ftp_directorio,
-        )
-    except HTTPException as e:
-        logger.critical(
-            f"FALLO CRITICO: SMS con ID {nuevo_sms.message_id} guardado pero no encolado."
-        )
+
+# --- Endpoint para Recibir SMS en Lote ---
+@app.post("/receive_sms/batch", status_code=status.HTTP_202_ACCEPTED)
+async def receive_sms_batch(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db),
+):
+    """
+    Recibe cientos de SMS en una sola petición.
+
+    - El cuerpo es un array JSON (o `{"messages": [...]}`) o NDJSON
+      (`Content-Type: application/x-ndjson`), un `SmsInput` por elemento.
+    - Resuelve todos los senders con una única consulta `IN`.
+    - Los mensajes que superan los límites de envío se rechazan uno a uno con
+      el código de throttling (105); el resto del lote se acepta.
+    - Inserta todos los SMS y sus tareas de reenvío con un executemany y un commit.
+    - Devuelve una lista de resultados por mensaje (uno por destinatario), en el
+      mismo orden y con la forma de `/receive_sms`.
+    - Un reintento con el mismo cuerpo (y el mismo `Idempotency-Key`, si se
+      envía) dentro de la ventana devuelve la respuesta original.
+    """
+    body = await request.body()
+    clave = idempotency.batch_idempotency_key(idempotency_key, body)
+    original = await buscar_respuesta_previa(db, clave)
+    if original is not None:
+        logger.info("Lote repetido. Se devuelve la respuesta original.")
+        return original
+
+    sms_rows, outbox_rows, resultados = await ejecutar_en_ingesta(
+        db,
+        preparar_lote_sms,
+        db,
+        body,
+        request.headers.get("content-type", ""),
+    )
 
     response_data = {
         'errorCode': 0,
         'errorDescription': 'Ok',
-        'sms': [[
-            {
-                'errorCode': 0,
-                'id': nuevo_sms.message_id,
-                'originatingAddress': nuevo_sms.sender,
-                'destinationAddress': nuevo_sms.receiver,
-            }
-        ]],
-        'messageCount': 1,
-        'messageParts': 1
+        'sms': resultados,
+        'messageCount': len(sms_rows),
+        'messageParts': len(sms_rows)
     }
-    # 4. Devolver una respuesta
+    # Un executemany por tabla y un único commit
+    duplicada = await guardar_sms(db, sms_rows, outbox_rows, clave, response_data)
+    if duplicada is not None:
+        return duplicada
+    logger.info(f"Lote registrado: {len(sms_rows)} SMS aceptados de {len(resultados)}.")
     return response_data
 
 
-def respond_dlr_success(message_to_update: SmsIncoming, event: str):
-    status_dlr_server = {
-        "Delivered": 2,
-        "Expired": 3,
-        "Deleted": 4,
-        "Undeliverd": 5,
-        "Accepted": 6,
-        "Invalid": 7,
-        "Rejected": 8
-    }
-    status_dlr_response = {
-        0: "Ok",
-        1: "Invalid Credentials",
-        3: "Invalid Query String Parameters",
-        10: "Internal Server Error"
-    }
-
-    dlr_params = {
-        'username': message_to_update.sub_account,
-        'password': message_to_update.sub_account_pass,
-        'sender': message_to_update.sender,
-        'destination': message_to_update.receiver,
-        'messageId': message_to_update.message_id,
-        # Se usa un espacio normal
-        'dateReceived': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-        'description': event,
-        # Puede ser un número o un string '2'
-        'deliveryStatus': status_dlr_server.get(event.lower().capitalize())
-    }
-
+def leer_lote_sms(body: bytes, content_type: str) -> list:
+    """
+    Decodifica el cuerpo de `/receive_sms/batch`. Devuelve una lista con un
+    `SmsInput` o un `str` con el error de validación por cada mensaje.
+    """
     try:
-        # Respuesta actual Error! {"errorCode":1,"errorDescriptio>
-        response = requests.get(
-            "http://195.191.165.16:32006/HTTP/api/Vendor/DLRListener", params=dlr_params
-        )
-        if response.status_code != 200:
-            logger.error(
-                f"Error al enviar la respuesta DLR: {response.status_code} - {response.text}")
+        if "ndjson" in content_type or "jsonl" in content_type:
+            items = []
+            for line in body.decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except ValueError as e:
+                    items.append(f"Línea NDJSON inválida: {e}")
         else:
-            json_response = response.json()
-            logger.info(
-                f"Respuesta DLR enviada exitosamente para message_id: {message_to_update.message_id}")
-            if json_response.get("errorCode") == 0:
-                logger.info(f"DLR aceptado por el servidor: {json_response}")
-            else:
-                logger.error(f"DLR rechazado por el servidor: {status_dlr_response.get(json_response.get("errorCode"))} {json_response.get("errorDescription")}")
-                raise ValueError(f"DLR rechazado por el servidor: {status_dlr_response.get(json_response.get("errorCode"))} {json_response.get("errorDescription")}")
-    except requests.RequestException as e:
-        logger.error(f"Excepción al enviar la respuesta DLR: {e}")
-        raise
+            items = json.loads(body)
+            if isinstance(items, dict):
+                items = items.get("messages")
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cuerpo de la petición inválido: {e}",
+        )
+
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Se esperaba una lista de mensajes.",
+        )
+    if len(items) > BATCH_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"El lote supera el máximo de {BATCH_MAX_MESSAGES} mensajes.",
+        )
+
+    mensajes = []
+    for item in items:
+        if isinstance(item, str):
+            mensajes.append(item)
+            continue
+        try:
+            mensajes.append(SmsInput.model_validate(item))
+        except ValidationError as e:
+            errores = ", ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+            )
+            mensajes.append(f"Mensaje inválido: {errores}")
+    return mensajes
+
+
+def preparar_lote_sms(db: Session, body: bytes, content_type: str):
+    """
+    Parte síncrona de `receive_sms_batch`: decodifica el lote, resuelve los
+    senders y prepara las filas. Se ejecuta en un hilo del pool de ingesta.
+    """
+    mensajes = leer_lote_sms(body, content_type)
+    logger.info(f"Recibido lote de {len(mensajes)} SMS.")
+
+    # 1. Resolver todos los senders con una sola consulta
+    clientes = client_crud.get_clients_data_cached(
+        db, [m.sender_id for m in mensajes if isinstance(m, SmsInput)]
+    )
+
+    # 2. Preparar las filas de sms_incoming y del outbox
+    sms_rows, outbox_rows, resultados = [], [], []
+    for mensaje in mensajes:
+        if isinstance(mensaje, str):
+            resultados.append(
+                [sms_crud.sms_error_entry(sms_crud.SMS_INVALID_PARAMS, mensaje)]
+            )
+            continue
+        cliente = clientes.get(mensaje.sender_id)
+        if not cliente:
+            resultados.append(
+                [
+                    sms_crud.sms_error_entry(
+                        sms_crud.SMS_INVALID_PARAMS,
+                        f"Cliente con sender '{mensaje.sender_id}' no encontrado.",
+                        mensaje.sender_id,
+                        mensaje.recipients,
+                    )
+                ]
+            )
+            continue
+        try:
+            filas, tareas, entries = sms_crud.build_message_rows(
+                sender_id=mensaje.sender_id,
+                recipients=mensaje.recipients,
+                message=mensaje.message,
+                action=mensaje.action,
+                sub_account=mensaje.sub_account,
+                sub_account_pass=mensaje.sub_account_pass,
+                cliente=cliente,
+            )
+        except ValueError as e:
+            resultados.append(
+                [sms_crud.sms_error_entry(sms_crud.SMS_INVALID_PARAMS, str(e), mensaje.sender_id)]
+            )
+            continue
+        if filas and rate_limit.admit(mensaje.sub_account, mensaje.sender_id, len(filas)):
+            resultados.append(
+                [
+                    sms_crud.sms_error_entry(
+                        sms_crud.SMS_THROTTLED,
+                        "Throttling error",
+                        mensaje.sender_id,
+                        mensaje.recipients,
+                    )
+                ]
+            )
+            continue
+        sms_rows.extend(filas)
+        outbox_rows.extend(tareas)
+        resultados.append(entries)
+
+    return sms_rows, outbox_rows, resultados
 
 
 @app.post(
@@ -320,21 +555,35 @@ def receive_dlr_webhook(
     Este endpoint procesa los reportes de entrega (DLR) enviados por el proveedor de SMS.
 
     - **Procesamiento**: Recibe la solicitud POST y decodifica el cuerpo JSON.
+    - **Encolado**: Con `DLR_ACK_FIRST` publica el DLR validado en una cola
+      durable y responde enseguida; si RabbitMQ no está disponible sigue en línea.
     - **Conciliación**: Busca el mensaje en la base de datos usando el `msgId`.
-    - **Actualización**: Actualiza el campo `status` del mensaje con el nuevo estado `event`.
+    - **Actualización**: Hace avanzar el estado del mensaje según la tabla de
+      transiciones (`utils/sms_status.py`); los DLR repetidos o fuera de orden no escriben nada.
+    - **Reenvío**: Encola en el outbox, en la misma transacción, el DLR que
+      `worker_dlr.py` reenvía al vendor.
     """
-    print(payload)
     logger.info(f"DLR Webhook recibido para msgId: {payload.msgId}")
 
-    # --- Lógica Mínima de la IA ---
+    # Camino rápido: se guarda el DLR tal cual en una cola durable y se
+    # responde; worker_dlr_ingest.py lo aplica después en lotes.
+    if DLR_ACK_FIRST:
+        try:
+            get_publisher().publish(DLR_INGEST_QUEUE, payload.model_dump())
+            return {
+                "status": "success",
+                "message": "DLR queued",
+                "processed_msgId": payload.msgId,
+                "new_status": payload.event,
+            }
+        except Exception as e:
+            logger.warning(
+                f"No se pudo encolar el DLR de msgId {payload.msgId} ({e!r}). Se procesa en línea."
+            )
 
     # 1. Conciliación: Buscar el mensaje original en la BD usando el msgId del DLR.
-    #    Asumimos que guardaste el ID del proveedor en el campo `provider_id`.
-    message_to_update = (
-        db.query(SmsIncoming)
-        .filter(SmsIncoming.provider_id == payload.msgId)
-        .first()
-    )
+    #    Índice único sobre provider_id y caché de mensajes en vuelo.
+    message_to_update = sms_crud.get_sms_by_provider_id(db, payload.msgId)
 
     # Si no se encuentra el mensaje, es un error.
     if not message_to_update:
@@ -347,44 +596,10 @@ def receive_dlr_webhook(
             detail=f"Message with msgId '{payload.msgId}' not found.",
         )
 
-    # 2. Actualización: Cambiar el estado del mensaje con el valor del campo 'event'.
-    previous_status = message_to_update.status
-    logger.info(
-        f"Actualizando estado del mensaje {message_to_update.message_id} de '{message_to_update.status}' a '{payload.event}'"
-    )
-    message_to_update.status = payload.event
-
-    # DLR al que envia el sms
-    respond_dlr_success(message_to_update, payload.event)
-
-    # Guardar los cambios en la base de datos.
+    # 2. Actualización del estado y, en la misma transacción, las tareas de
+    #    reenvío del DLR al vendor (worker_dlr.py) y de generación del PDF.
+    enqueue_rows(db, apply_dlr(db, message_to_update, payload))
     db.commit()
-    db.refresh(message_to_update)
-
-    if (
-        message_to_update.status == "DELIVERED"
-        and previous_status != "DELIVERED"
-    ):
-        logger.info(
-            f"Mensaje {message_to_update.message_id} entregado exitosamente al destinatario, agregando a la cola de generación de PDF."
-        )
-
-        # agregar a la cola de mensaje para generar pdf
-        logger.info("Iniciando publicación a la cola de RabbitMQ para PDF...")
-        global rabbitmq_channel
-        connection_params = pika.ConnectionParameters(
-            host=RABBITMQ_HOST,
-            heartbeat=600,
-            blocked_connection_timeout=300,
-        )
-        rabbitmq_connection = pika.BlockingConnection(connection_params)
-        rabbitmq_channel = rabbitmq_connection.channel()
-        rabbitmq_channel.queue_declare(
-            queue=CERTIFICACION_PDF_QUEUE, durable=True
-        )
-        publish_to_pdf_queue(db_message_id=message_to_update.message_id)
-        if rabbitmq_connection and rabbitmq_connection.is_open:
-            rabbitmq_connection.close()
 
     # --- Respuesta Esperada del Servidor ---
     # Se devuelve una confirmación simple. Un status 200 es suficiente para que
@@ -397,6 +612,27 @@ def receive_dlr_webhook(
     }
 
 
+# --- Métricas internas del proceso ---
+@app.get("/metrics", tags=["Monitoring"])
+def read_metrics():
+    """
+    Devuelve los contadores internos de este proceso (cachés, limitadores...)
+    y el estado que los workers de reenvío comparten en el host: el circuit
+    breaker y el ritmo adaptativo de la API del proveedor.
+    """
+    breaker = get_provider_breaker()
+    provider_limiter = get_provider_limiter()
+    return {
+        "cliente_cache": client_crud.cliente_cache.stats(),
+        "group_commit": group_commit_writer.stats() if group_commit_writer else None,
+        "idempotency_cache": idempotency.recent_responses.stats(),
+        "provider_id_cache": sms_crud.provider_id_cache.stats(),
+        "rate_limit": rate_limit.stats(),
+        "provider_circuit": breaker.stats() if breaker else None,
+        "provider_rate": provider_limiter.stats() if provider_limiter else None,
+    }
+
+
 # --- Para probar, puedes añadir datos de ejemplo a la BBDD ---
 def add_example_client(db: Session):
     """Añade un cliente de ejemplo si no existe."""
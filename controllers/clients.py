@@ -27,7 +27,9 @@ def create_new_client(
         raise HTTPException(
             status_code=400, detail="Client with this sender already registered"
         )
-    return client_crud.create_client(db=db, client=client)
+    db_client = client_crud.create_client(db=db, client=client)
+    client_crud.invalidate_client_cache(client.sender)
+    return db_client
 
 @router.get("/clients/", 
             response_model=list[ClientSchema])
@@ -52,6 +54,7 @@ def delete_client(
     if current_user.role != users.UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     client = client_crud.delete_client(db, sender=sender)
+    client_crud.invalidate_client_cache(sender)
     if not client:
         raise HTTPException(
             status_code=404, detail="Client not found"
@@ -69,6 +72,7 @@ def update_client(
     if current_user.role != users.UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     client = client_crud.update_client(db, sender=sender, client_update=client_update)
+    client_crud.invalidate_client_cache(sender)
     if not client:
         raise HTTPException(
             status_code=404, detail="Client not found"
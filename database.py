@@ -38,6 +38,10 @@ def create_db_and_tables():
     Base.metadata.create_all(bind=engine)
     log.info("Tablas creadas exitosamente.")
 
+    # create_all no modifica tablas ya existentes: aplicar las migraciones
+    from utils.migrations import apply_migrations
+    apply_migrations(engine, Base.metadata)
+
 
 # 6. Requisito: Obtener una sesión segura para FastAPI
 def get_db():
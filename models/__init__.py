@@ -1 +1,4 @@
-from .users import User, UserRole
\ No newline at end of file
+from .users import User, UserRole
+from .outbox import OutboxMessage
+from .ingest import IngestRequest
+from .dlr import SmsDlrPart
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Boolean, SmallInteger, false
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func # Para obtener el timestamp por defecto
 
@@ -38,11 +38,14 @@ class SmsIncoming(Base):
     sender = Column(String(50), ForeignKey("clientes.sender"), nullable=False, index=True, comment="Remitente que envió el SMS")
     receiver = Column(String(50), nullable=False, index=True, comment="Número receptor del SMS")
     content = Column(Text, nullable=False, comment="Contenido del mensaje SMS")
-    provider_id = Column(String(100), nullable=True, comment="ID del mensaje asignado por el proveedor externo")
+    provider_id = Column(String(100), nullable=True, unique=True, index=True, comment="ID del mensaje asignado por el proveedor externo (clave de conciliación de los DLR)")
     num_parts = Column(String(10), nullable=True, comment="Número de partes en que se dividió el SMS")
     timestamp_received = Column(DateTime(timezone=True), server_default=func.now(), comment="Fecha y hora de recepción")
-    status = Column(String(20), nullable=False, default="pending", index=True, comment="Estado del procesamiento del SMS")
+    status = Column(String(20), nullable=False, default="pending", comment="Estado del procesamiento del SMS (texto, reflejo de status_code)")
+    status_code = Column(SmallInteger, nullable=False, default=0, server_default="0", index=True, comment="Estado del procesamiento (models.status.SmsStatus)")
     pdf_path = Column(String(255), nullable=True, comment="Ruta al PDF generado para este SMS")
+    send_claimed_at = Column(DateTime, nullable=True, comment="Momento en que un worker de reenvío reclamó el envío (NULL si no hay ninguno en curso)")
+    pdf_requested = Column(Boolean, nullable=False, default=False, server_default=false(), comment="La certificación PDF ya se encoló (se encola una sola vez)")
     action = Column(String(50), nullable=True, comment="Acción a realizar con el SMS")
     sub_account = Column(String(100), nullable=True, comment="Subcuenta asociada al SMS")
     sub_account_pass = Column(String(100), nullable=True, comment="Contraseña de la subcuenta asociada al SMS")
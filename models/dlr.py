@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class SmsDlrPart(Base):
+    """
+    Modelo SQLAlchemy para la tabla 'sms_dlr_parts'.
+    Estado de entrega de cada parte de un SMS concatenado, según los DLR del
+    proveedor (`numParts`/`partNum`). El estado del mensaje solo pasa a final
+    cuando todas sus partes han llegado a un estado final.
+    """
+    __tablename__ = "sms_dlr_parts"
+
+    # Columnas
+    message_id = Column(String(100), ForeignKey("sms_incoming.message_id"), primary_key=True, comment="ID del mensaje al que pertenece la parte")
+    part_num = Column(Integer, primary_key=True, comment="Número de la parte (1..num_parts)")
+    num_parts = Column(Integer, nullable=False, comment="Número total de partes del mensaje")
+    status = Column(String(20), nullable=False, comment="Último estado de entrega de la parte")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="Fecha y hora del último DLR de la parte")
+
+    def __repr__(self):
+        return f"<SmsDlrPart(message_id='{self.message_id}', part={self.part_num}/{self.num_parts}, status='{self.status}')>"
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, Text, DateTime
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class IngestRequest(Base):
+    """
+    Modelo SQLAlchemy para la tabla 'ingest_requests'.
+    Guarda la respuesta de cada petición de ingesta aceptada para que los
+    reintentos del vendor con la misma clave devuelvan la respuesta original
+    sin crear SMS ni tareas nuevas.
+    """
+    __tablename__ = "ingest_requests"
+
+    # Columnas
+    idempotency_key = Column(String(64), primary_key=True, comment="Clave de idempotencia (SHA-256)")
+    response = Column(Text, nullable=False, comment="Respuesta JSON devuelta originalmente")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True, comment="Fecha y hora de la petición original")
+
+    def __repr__(self):
+        return f"<IngestRequest(key='{self.idempotency_key}')>"
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class OutboxMessage(Base):
+    """
+    Modelo SQLAlchemy para la tabla 'outbox'.
+    Tareas pendientes de publicar en RabbitMQ. Se escriben en la misma
+    transacción que el cambio en `sms_incoming` que las origina y las publica
+    el proceso `relay_outbox.py`.
+    """
+    __tablename__ = "outbox"
+
+    # Columnas
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="Orden de publicación")
+    queue = Column(String(100), nullable=False, comment="Cola de RabbitMQ de destino")
+    payload = Column(Text, nullable=False, comment="Cuerpo JSON de la tarea")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="Fecha y hora de creación")
+    attempts = Column(Integer, nullable=False, default=0, comment="Intentos de publicación fallidos")
+    last_error = Column(Text, nullable=True, comment="Último error de publicación")
+
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, queue='{self.queue}')>"
@@ -0,0 +1,40 @@
+from enum import IntEnum
+
+
+class SmsStatus(IntEnum):
+    """
+    Estados de `sms_incoming.status_code`. El valor numérico es también la
+    precedencia: un mensaje solo avanza hacia estados de valor mayor, salvo
+    un envío reclamado que no llegó al proveedor, que vuelve de SENDING a
+    PENDING (ver `utils.sms_status.release_send`).
+    """
+    PENDING = 0
+    SENDING = 10
+    ACCEPTED = 20
+    SENT_FAILED = 30
+    DELIVERED = 40
+    UNDELIVERED = 41
+    EXPIRED = 42
+    DELETED = 43
+    REJECTED = 44
+    INVALID = 45
+
+    @property
+    def label(self) -> str:
+        """Texto que se guarda en la columna `status` (valores históricos)."""
+        return _LABELS.get(self, self.name)
+
+    @property
+    def is_terminal(self) -> bool:
+        return self >= SmsStatus.SENT_FAILED
+
+    @classmethod
+    def from_label(cls, label: str):
+        """Estado para un texto de `status` o un `event` de DLR; `None` si es desconocido."""
+        return cls.__members__.get((label or "").strip().upper())
+
+
+_LABELS = {
+    SmsStatus.PENDING: "pending",
+    SmsStatus.SENT_FAILED: "sent_failed",
+}
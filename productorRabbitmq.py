@@ -2,8 +2,11 @@ import os
 import pika
 import logging
 import json
+import queue
+import random
+import threading
+import time
 
-from fastapi import HTTPException
 from setupLog import setup_logging
 from dotenv import load_dotenv
 
@@ -15,87 +18,335 @@ logger = logging.getLogger(__name__)
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
 SMS_RESEND_QUEUE = "sms_resend_queue"
 
-# --- Variables globales para la Conexión de RabbitMQ ---
-rabbitmq_connection = None
-rabbitmq_channel = None
+CERTIFICACION_PDF_QUEUE = "Certificacion_PDF"
+DISTRIBUCION_PDF_QUEUE = "Distribucion_PDF"
+DLR_FORWARD_QUEUE = "dlr_forward_queue"
+DLR_INGEST_QUEUE = "dlr_ingest_queue"
 
+# --- Reintentos diferidos ---
+# Colas de espera por niveles: cada una tiene un TTL y devuelve los mensajes
+# caducados (dead-lettering) a la cola principal. El número de intento viaja
+# en la cabecera RETRY_HEADER.
+RETRY_HEADER = "x-intentos"
+# Jitter: cada espera se acorta aleatoriamente hasta esta fracción
+RETRY_JITTER = float(os.getenv("RETRY_JITTER", 0.2))
 
-# --- Funciones del Ciclo de Vida de FastAPI para RabbitMQ ---
-def connect_to_rabbitmq():
-    """Establece la conexión con RabbitMQ y declara la cola."""
-    global rabbitmq_connection, rabbitmq_channel
-    try:
-        logger.info(f"Conectando a RabbitMQ en {RABBITMQ_HOST}...")
-        parameters = pika.ConnectionParameters(host=RABBITMQ_HOST)
-        rabbitmq_connection = pika.BlockingConnection(parameters)
-        rabbitmq_channel = rabbitmq_connection.channel()
-
-        # Declarar la cola como 'durable' para que sobreviva a reinicios del broker
-        rabbitmq_channel.queue_declare(queue=SMS_RESEND_QUEUE, durable=True)
-        logger.info(
-            f"Conexión a RabbitMQ exitosa. Cola '{SMS_RESEND_QUEUE}' asegurada."
-        )
-    except pika.exceptions.AMQPConnectionError as e:
-        logger.error(f"Error al conectar con RabbitMQ: {e}")
-        # En un escenario real, se podrían implementar reintentos de conexión
-        raise
+# --- Colas de mensajes fallidos (DLQ) ---
+# Cada cola de trabajo tiene su `<cola>.dlq`. El motivo del fallo viaja en
+# las cabeceras para poder inspeccionar y reprocesar con tools/dlq_cli.py.
+DLQ_SUFFIX = ".dlq"
+DLQ_ERROR_CLASS_HEADER = "x-error-class"
+DLQ_ERROR_HEADER = "x-error"
+DLQ_ORIGINAL_QUEUE_HEADER = "x-cola-original"
+DLQ_FAILED_AT_HEADER = "x-fallo-en"
 
+# Número máximo de conexiones/canales de publicación por proceso
+RABBITMQ_POOL_SIZE = int(os.getenv("RABBITMQ_POOL_SIZE", 4))
+# Segundos que un hilo espera por un canal libre antes de fallar
+RABBITMQ_POOL_TIMEOUT = float(os.getenv("RABBITMQ_POOL_TIMEOUT", 5))
 
-def close_rabbitmq_connection():
-    """Cierra la conexión con RabbitMQ de forma segura."""
-    global rabbitmq_connection
-    if rabbitmq_connection and rabbitmq_connection.is_open:
-        logger.info("Cerrando la conexión con RabbitMQ...")
-        rabbitmq_connection.close()
-        logger.info("Conexión con RabbitMQ cerrada.")
+
+class PublicacionIncierta(pika.exceptions.AMQPError):
+    """
+    La conexión cayó durante el `tx_commit`: el broker pudo confirmar el lote
+    o no. Republicarlo podría duplicarlo, así que decide el llamante.
+    """
 
 
-# --- Productor de RabbitMQ ---
-def publish_to_resend_queue(
-    message_id: int, email_cliente: str, ftp_directorio: str
-):
+class _CanalPublicacion:
     """
-    Publica un mensaje en la cola SMS_Resend.
+    Conexión y canal de larga duración usados por un único hilo a la vez.
+    El canal trabaja en modo transaccional: un `tx_commit` confirma el lote
+    completo con un solo viaje de ida y vuelta al broker.
     """
-    # connection embebida 
-    connect_to_rabbitmq()
 
-    if not rabbitmq_channel or not rabbitmq_channel.is_open:
-        logger.error(
-            "No se puede publicar el mensaje: el canal de RabbitMQ no está disponible."
-        )
-        # Aquí se podría lanzar una excepción o implementar una política de reintentos
-        raise HTTPException(
-            status_code=503, detail="Servicio de mensajería no disponible."
-        )
+    def __init__(self, parameters: pika.ConnectionParameters):
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+        self.channel.tx_select()
+        self.colas_declaradas = set()
 
-    message_body = {
-        "db_message_id": message_id,  # Usamos el ID de la BBDD como identificador único interno
-        "email_cliente": email_cliente,
-        "ftp_directorio": ftp_directorio,
-    }
+    @property
+    def is_open(self) -> bool:
+        return self.connection.is_open and self.channel.is_open
 
-    try:
-        rabbitmq_channel.basic_publish(
-            exchange="",
-            routing_key=SMS_RESEND_QUEUE,
-            body=json.dumps(message_body).encode("utf-8"),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # Hacer el mensaje persistente
-            ),
-        )
-        logger.info(
-            f"Mensaje para db_message_id '{message_id}' enviado a la cola '{SMS_RESEND_QUEUE}'."
+    def esta_vivo(self) -> bool:
+        """Atiende heartbeats pendientes y comprueba que la conexión siga abierta."""
+        if not self.is_open:
+            return False
+        try:
+            self.connection.process_data_events(time_limit=0)
+        except pika.exceptions.AMQPError:
+            return False
+        return self.is_open
+
+    def publicar_lote(self, mensajes):
+        for queue_name, body, properties in mensajes:
+            if queue_name not in self.colas_declaradas:
+                self.channel.queue_declare(queue=queue_name, durable=True)
+                self.colas_declaradas.add(queue_name)
+            self.channel.basic_publish(
+                exchange="",
+                routing_key=queue_name,
+                body=body,
+                properties=properties,
+            )
+        try:
+            self.channel.tx_commit()
+        except pika.exceptions.AMQPError as e:
+            raise PublicacionIncierta(f"Sin respuesta al confirmar el lote: {e!r}") from e
+
+    def cerrar(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception as e:
+            logger.warning(f"Error al cerrar una conexión de publicación: {e}")
+
+
+class RabbitMQPublisher:
+    """
+    Publicador con un pool de conexiones y canales de larga duración.
+
+    Es thread-safe: cada hilo toma un canal libre del pool, publica y lo
+    devuelve. Si la conexión cae antes del `tx_commit`, el broker descarta la
+    transacción y el lote se reintenta una vez con una conexión nueva. Si cae
+    durante el `tx_commit` no se sabe si el lote quedó confirmado: se lanza
+    `PublicacionIncierta` sin republicar y reintenta el llamante (el relay
+    del outbox, que entrega "al menos una vez").
+    """
+
+    def __init__(
+        self,
+        host: str = RABBITMQ_HOST,
+        pool_size: int = RABBITMQ_POOL_SIZE,
+        checkout_timeout: float = RABBITMQ_POOL_TIMEOUT,
+    ):
+        self._parameters = pika.ConnectionParameters(
+            host=host,
+            heartbeat=600,
+            blocked_connection_timeout=300,
         )
-    except Exception as e:
-        logger.error(
-            f"Error al publicar mensaje en RabbitMQ para db_message_id '{message_id}': {e}"
+        self._checkout_timeout = checkout_timeout
+        self._libres = queue.LifoQueue()
+        self._cupos = threading.BoundedSemaphore(pool_size)
+
+    def _checkout(self) -> _CanalPublicacion:
+        if not self._cupos.acquire(timeout=self._checkout_timeout):
+            raise pika.exceptions.AMQPConnectionError(
+                "No hay canales de publicación libres en el pool."
+            )
+        try:
+            while True:
+                try:
+                    canal = self._libres.get_nowait()
+                except queue.Empty:
+                    logger.info(f"Abriendo conexión de publicación con RabbitMQ en {RABBITMQ_HOST}...")
+                    return _CanalPublicacion(self._parameters)
+                if canal.esta_vivo():
+                    return canal
+                canal.cerrar()
+        except Exception:
+            self._cupos.release()
+            raise
+
+    def _checkin(self, canal: _CanalPublicacion):
+        if canal.is_open:
+            self._libres.put(canal)
+        self._cupos.release()
+
+    def publish(self, queue_name: str, body, headers: dict = None):
+        """Publica un único mensaje persistente y espera su confirmación."""
+        self.publish_batch([(queue_name, body, headers)])
+
+    def publish_batch(self, mensajes):
+        """
+        Publica una lista de `(cola, cuerpo)`, `(cola, cuerpo, headers)` o
+        `(cola, cuerpo, headers, content_type)` en una única transacción. El
+        cuerpo puede ser un dict (se serializa a JSON) o bytes.
+        """
+        lote = [self._preparar(*mensaje) for mensaje in mensajes]
+        if not lote:
+            return
+        for intento in (1, 2):
+            canal = self._checkout()
+            try:
+                canal.publicar_lote(lote)
+                return
+            except PublicacionIncierta:
+                canal.cerrar()
+                raise
+            except pika.exceptions.AMQPError as e:
+                canal.cerrar()
+                if intento == 2:
+                    raise
+                logger.warning(f"Conexión de publicación caída ({e!r}). Reconectando...")
+            finally:
+                self._checkin(canal)
+
+    @staticmethod
+    def _preparar(queue_name, body, headers=None, content_type=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode("utf-8")
+        properties = pika.BasicProperties(
+            delivery_mode=2,  # Mensaje persistente
+            headers=headers,
+            content_type=content_type,
         )
-        # Este es un punto crítico: el SMS está en BBDD pero no en la cola.
-        # Se requiere una estrategia de recuperación (ej. un proceso batch que revise 'pending' sin encolar).
-        raise HTTPException(
-            status_code=500,
-            detail="Error al encolar la tarea de procesamiento.",
+        return queue_name, body, properties
+
+    def close(self):
+        while True:
+            try:
+                self._libres.get_nowait().cerrar()
+            except queue.Empty:
+                break
+
+
+def retry_queue_name(queue_name: str, delay: int) -> str:
+    return f"{queue_name}.retry.{delay}s"
+
+
+def declare_retry_queues(channel, queue_name: str, delays):
+    """
+    Declara las colas de espera de `queue_name`, una por nivel de `delays`
+    (segundos). Sin consumidores: al caducar, el broker devuelve el mensaje a
+    `queue_name` por el exchange por defecto.
+    """
+    for delay in delays:
+        channel.queue_declare(
+            queue=retry_queue_name(queue_name, delay),
+            durable=True,
+            arguments={
+                "x-message-ttl": int(delay * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            },
         )
-    finally:
-        close_rabbitmq_connection()
+
+
+def _content_type(properties):
+    # Las copias (reintentos, DLQ) conservan la codificación del original
+    return properties.content_type if properties is not None else None
+
+
+def retry_attempt(properties) -> int:
+    """Intentos ya hechos según la cabecera del mensaje (0 si no la tiene)."""
+    headers = (properties.headers if properties is not None else None) or {}
+    try:
+        return int(headers.get(RETRY_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def publish_retry(channel, queue_name: str, body: bytes, properties, attempt: int, delays):
+    """
+    Programa el reintento `attempt` (1, 2...) de un mensaje: lo publica en el
+    nivel de espera correspondiente, con backoff exponencial por niveles y
+    jitter mediante la caducidad por mensaje. Devuelve la espera en segundos.
+    Se ejecuta en el hilo de la conexión de `channel`.
+    """
+    delay = delays[min(attempt, len(delays)) - 1]
+    espera = delay * (1 - random.uniform(0, RETRY_JITTER))
+    headers = dict((properties.headers if properties is not None else None) or {})
+    headers[RETRY_HEADER] = attempt
+    channel.basic_publish(
+        exchange="",
+        routing_key=retry_queue_name(queue_name, delay),
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=2,  # Mensaje persistente
+            headers=headers,
+            content_type=_content_type(properties),
+            expiration=str(int(espera * 1000)),
+        ),
+    )
+    return espera
+
+
+def publish_parked(channel, queue_name: str, body: bytes, properties, wait: float, delays):
+    """
+    Aparca un mensaje que no se ha llegado a intentar (p. ej. con el circuit
+    breaker abierto) durante al menos `wait` segundos, sin consumir un intento:
+    usa el nivel de espera más corto que lo cubre, con jitter para que los
+    mensajes aparcados no vuelvan todos a la vez. Devuelve la espera en segundos.
+    Se ejecuta en el hilo de la conexión de `channel`.
+    """
+    delay = next((d for d in sorted(delays) if d >= wait), max(delays))
+    espera = min(delay, max(wait, min(delays)) * (1 + random.uniform(0, RETRY_JITTER)))
+    channel.basic_publish(
+        exchange="",
+        routing_key=retry_queue_name(queue_name, delay),
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=2,  # Mensaje persistente
+            headers=(properties.headers if properties is not None else None) or {},
+            content_type=_content_type(properties),
+            expiration=str(int(espera * 1000)),
+        ),
+    )
+    return espera
+
+
+def dead_letter_queue_name(queue_name: str) -> str:
+    return f"{queue_name}{DLQ_SUFFIX}"
+
+
+def declare_dead_letter_queue(channel, queue_name: str):
+    channel.queue_declare(queue=dead_letter_queue_name(queue_name), durable=True)
+
+
+def publish_dead_letter(channel, queue_name: str, body: bytes, properties, error_class: str, error):
+    """
+    Publica un mensaje fallido en la DLQ de `queue_name` conservando sus
+    cabeceras y añadiendo el motivo del fallo. Se ejecuta en el hilo de la
+    conexión de `channel`; el llamante confirma después el original.
+    """
+    headers = dict((properties.headers if properties is not None else None) or {})
+    headers.update({
+        DLQ_ERROR_CLASS_HEADER: error_class,
+        DLQ_ERROR_HEADER: str(error)[:1000],
+        DLQ_ORIGINAL_QUEUE_HEADER: queue_name,
+        DLQ_FAILED_AT_HEADER: int(time.time()),
+    })
+    channel.basic_publish(
+        exchange="",
+        routing_key=dead_letter_queue_name(queue_name),
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=2,  # Mensaje persistente
+            headers=headers,
+            content_type=_content_type(properties),
+        ),
+    )
+    logger.warning(
+        f"Mensaje enviado a '{dead_letter_queue_name(queue_name)}' ({error_class}: {error})."
+    )
+
+
+_publisher = None
+_publisher_pid = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> RabbitMQPublisher:
+    """
+    Devuelve el publicador compartido del proceso. Se recrea tras un fork
+    porque las conexiones de pika no pueden compartirse entre procesos.
+    """
+    global _publisher, _publisher_pid
+    with _publisher_lock:
+        if _publisher is None or _publisher_pid != os.getpid():
+            _publisher = RabbitMQPublisher()
+            _publisher_pid = os.getpid()
+        return _publisher
+
+
+def close_publisher():
+    """Cierra las conexiones del publicador compartido (apagado ordenado)."""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is not None and _publisher_pid == os.getpid():
+            logger.info("Cerrando las conexiones de publicación con RabbitMQ...")
+            _publisher.close()
+        _publisher = None
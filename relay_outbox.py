@@ -0,0 +1,91 @@
+import os
+import logging
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, create_db_and_tables
+from models.outbox import OutboxMessage
+from productorRabbitmq import get_publisher, close_publisher
+from utils.task_codec import encode_outbox_payload
+
+# --- Configuración de Logs ---
+from setupLog import setup_logging
+
+load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# --- Configuración del Relay ---
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 500))
+# Segundos de espera cuando el outbox está vacío
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 0.2))
+
+
+def relay_batch(db: Session) -> int:
+    """
+    Publica en RabbitMQ el siguiente lote de tareas del outbox, en orden, y
+    las elimina una vez confirmadas por el broker. Devuelve cuántas se publicaron.
+
+    La entrega es "al menos una vez": si el proceso cae entre la publicación y
+    el borrado, o si no llega la respuesta del broker al confirmar el lote
+    (`PublicacionIncierta`), el lote se vuelve a publicar en la siguiente vuelta.
+    """
+    tareas = (
+        db.query(OutboxMessage)
+        .order_by(OutboxMessage.id)
+        .limit(OUTBOX_BATCH_SIZE)
+        .all()
+    )
+    if not tareas:
+        return 0
+
+    try:
+        mensajes = []
+        for tarea in tareas:
+            body, content_type = encode_outbox_payload(tarea.queue, tarea.payload)
+            mensajes.append((tarea.queue, body, None, content_type))
+        get_publisher().publish_batch(mensajes)
+    except Exception as e:
+        logger.error(f"Error al publicar un lote de {len(tareas)} tareas del outbox: {e}")
+        for tarea in tareas:
+            tarea.attempts += 1
+            tarea.last_error = str(e)
+        db.commit()
+        raise
+
+    db.query(OutboxMessage).filter(
+        OutboxMessage.id.in_([tarea.id for tarea in tareas])
+    ).delete(synchronize_session=False)
+    db.commit()
+    logger.info(f"{len(tareas)} tareas del outbox publicadas en RabbitMQ.")
+    return len(tareas)
+
+
+def main():
+    """
+    Función principal que drena el outbox de forma continua.
+    """
+    create_db_and_tables()
+    logger.info("[*] Relay del outbox iniciado. Para salir presione CTRL+C")
+    while True:
+        db = SessionLocal()
+        try:
+            publicadas = relay_batch(db)
+            if publicadas < OUTBOX_BATCH_SIZE:
+                time.sleep(OUTBOX_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            logger.info("Deteniendo el relay del outbox...")
+            break
+        except Exception as e:
+            logger.error(f"Error en el relay del outbox: {e}. Reintentando en 5 segundos...")
+            db.rollback()
+            time.sleep(5)
+        finally:
+            db.close()
+    close_publisher()
+
+
+if __name__ == "__main__":
+    main()
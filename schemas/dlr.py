@@ -0,0 +1,22 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+# --- Modelo para la respuesta dlr ---
+class DLRWebhookPayload(BaseModel):
+    msgId: str = Field(
+        ...,
+        description="ID del mensaje del proveedor. Clave para la conciliación.",
+    )
+    event: str = Field(
+        ..., description="Estado de entrega (ej: DELIVERED, UNDELIVERED)"
+    )
+    errorCode: Optional[int] = Field(
+        None, description="Código de error, 0 si no hay error."
+    )
+    errorMessage: Optional[str] = Field(
+        None, description="Mensaje de error asociado, si aplica."
+    )
+    numParts: int
+    partNum: int
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Las pruebas se ejecutan desde la raíz del proyecto (`python -m pytest -q`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Nada de estado compartido con los workers en marcha: ni limitador ni breaker
+# del proveedor, y sus ficheros de estado en un directorio temporal
+_estado = tempfile.mkdtemp(prefix="pruebas_sms_")
+os.environ["PROVIDER_RATE_ENABLED"] = "false"
+os.environ["CIRCUIT_ENABLED"] = "false"
+os.environ["PROVIDER_RATE_STATE_FILE"] = os.path.join(_estado, "sms_provider_rate.json")
+os.environ["CIRCUIT_STATE_FILE"] = os.path.join(_estado, "sms_provider_circuit.json")
+os.environ.setdefault("DLR_URL", "http://127.0.0.1")
+
+from database import Base  # noqa: E402
+import models  # noqa: E402,F401
+from models.clients import Cliente  # noqa: E402
+
+
+@pytest.fixture
+def session_factory():
+    """Sesiones de una BBDD SQLite en memoria con todas las tablas y un cliente."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    fabrica = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = fabrica()
+    db.add(Cliente(sender="+15551234567", email_cliente="cliente@example.com", ftp_directorio="/ftp/cliente"))
+    db.commit()
+    db.close()
+    yield fabrica
+    engine.dispose()
@@ -0,0 +1,158 @@
+import hashlib
+import io
+import logging
+
+import pytest
+from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from pyhanko.sign import fields, signers
+from pyhanko.sign.timestamps.dummy_client import DummyTimeStamper
+from pyhanko_certvalidator import ValidationContext
+
+from tools.bench_signing import certificado_temporal, pdf_de_prueba
+from tools.stub_tsa import tsa_temporal
+from utils.batch_seal import (
+    BatchSealer,
+    embed_seal,
+    merkle_levels,
+    merkle_proof,
+    merkle_root_from_proof,
+    read_seal,
+    verify_sealed_pdf,
+)
+
+# pyhanko registra con su traza cada cadena de la TSA que no es de confianza
+logging.getLogger("pyhanko").setLevel(logging.ERROR)
+
+
+def hojas(n: int) -> list:
+    return [hashlib.sha256(f"pdf-{i}".encode()).digest() for i in range(n)]
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 5, 7, 9, 16, 17])
+def test_prueba_de_inclusion_de_cada_hoja(n):
+    digests = hojas(n)
+    niveles = merkle_levels(digests)
+    raiz = niveles[-1][0]
+    for i, digest in enumerate(digests):
+        assert merkle_root_from_proof(digest, merkle_proof(niveles, i)) == raiz
+
+
+@pytest.mark.parametrize("n", [3, 5, 7, 9])
+def test_prueba_alterada_no_lleva_a_la_raiz(n):
+    digests = hojas(n)
+    niveles = merkle_levels(digests)
+    raiz = niveles[-1][0]
+    # La última hoja de un árbol impar sube sin pareja: su prueba es la más corta
+    for i in (0, n - 1):
+        prueba = merkle_proof(niveles, i)
+
+        otra_hoja = hashlib.sha256(b"otro pdf").digest()
+        assert merkle_root_from_proof(otra_hoja, prueba) != raiz
+
+        hermano_alterado = [dict(paso) for paso in prueba]
+        hermano_alterado[0]["hash"] = hashlib.sha256(b"x").hexdigest()
+        assert merkle_root_from_proof(digests[i], hermano_alterado) != raiz
+
+        lado_cambiado = [dict(paso) for paso in prueba]
+        lado_cambiado[0]["side"] = "R" if lado_cambiado[0]["side"] == "L" else "L"
+        assert merkle_root_from_proof(digests[i], lado_cambiado) != raiz
+
+        assert merkle_root_from_proof(digests[i], prueba[:-1]) != raiz
+
+    # La prueba de una hoja no sirve para otra
+    assert merkle_root_from_proof(digests[1], merkle_proof(niveles, 0)) != raiz
+
+
+def test_una_hoja_no_se_confunde_con_un_nodo_interno():
+    digests = hojas(4)
+    niveles = merkle_levels(digests)
+    # Un nodo del nivel 1 presentado como hoja de un árbol más pequeño
+    assert merkle_levels([niveles[1][0], niveles[1][1]])[-1][0] != niveles[-1][0]
+
+
+def test_arbol_vacio():
+    with pytest.raises(ValueError):
+        merkle_levels([])
+
+
+# --- Sello de PDF firmados ---
+
+@pytest.fixture(scope="module")
+def tsa():
+    cert, clave = tsa_temporal()
+    return cert, DummyTimeStamper(tsa_cert=cert, tsa_key=clave)
+
+
+@pytest.fixture(scope="module")
+def pdf_signer(tmp_path_factory):
+    ruta = certificado_temporal(str(tmp_path_factory.mktemp("firma")), "pruebas")
+    signer = signers.SimpleSigner.load_pkcs12(pfx_file=ruta, passphrase=b"pruebas")
+    return signers.PdfSigner(signers.PdfSignatureMetadata(field_name="FirmaEmpresa"), signer)
+
+
+def pdf_firmado(pdf_signer, texto: str) -> bytes:
+    w = IncrementalPdfFileWriter(io.BytesIO(pdf_de_prueba() + f"%{texto}\n".encode()))
+    fields.append_signature_field(
+        w, sig_field_spec=fields.SigFieldSpec(sig_field_name="FirmaEmpresa", box=(72.25, 50, 250, 100))
+    )
+    salida = io.BytesIO()
+    pdf_signer.sign_pdf(w, output=salida)
+    return salida.getvalue()
+
+
+@pytest.fixture(scope="module")
+def lote_sellado(tsa, pdf_signer, tmp_path_factory):
+    """Tres PDF firmados (un árbol impar) sellados con una sola petición a la TSA."""
+    directorio = tmp_path_factory.mktemp("sellados")
+    rutas = []
+    for i in range(3):
+        ruta = directorio / f"certificado_{i}.pdf"
+        ruta.write_bytes(pdf_firmado(pdf_signer, f"documento {i}"))
+        rutas.append(str(ruta))
+    sealer = BatchSealer(tsa[1])
+    for ruta, sello in zip(rutas, sealer.seal(rutas)):
+        embed_seal(ruta, sello)
+    assert sealer.batches == 1 and sealer.documents == 3
+    return [open(ruta, "rb").read() for ruta in rutas]
+
+
+def contexto_de_confianza(tsa) -> ValidationContext:
+    return ValidationContext(extra_trust_roots=[tsa[0]])
+
+
+def test_pdf_sellado_se_verifica(lote_sellado, tsa):
+    for i, datos in enumerate(lote_sellado):
+        resultado = verify_sealed_pdf(datos, contexto_de_confianza(tsa))
+        assert resultado["trusted"]
+        assert (resultado["leaf_index"], resultado["batch_size"]) == (i, 3)
+    assert len({read_seal(datos)["root"] for datos in lote_sellado}) == 1
+
+
+def test_tsa_sin_confianza_falla_por_defecto(lote_sellado):
+    with pytest.raises(ValueError, match="confianza"):
+        verify_sealed_pdf(lote_sellado[0], ValidationContext())
+    resultado = verify_sealed_pdf(lote_sellado[0], ValidationContext(), require_trusted=False)
+    assert not resultado["trusted"]
+
+
+def test_pdf_firmado_alterado_no_se_verifica(lote_sellado, tsa):
+    datos = bytearray(lote_sellado[2])
+    posicion = datos.index(b"documento 2")
+    datos[posicion] ^= 0x01
+    with pytest.raises(ValueError):
+        verify_sealed_pdf(bytes(datos), contexto_de_confianza(tsa), require_trusted=False)
+
+
+def test_sello_de_otro_lote_no_se_verifica(lote_sellado, tsa, pdf_signer, tmp_path):
+    # Un PDF firmado distinto con la prueba de inclusión de otro documento
+    ruta = tmp_path / "ajeno.pdf"
+    ruta.write_bytes(pdf_firmado(pdf_signer, "documento ajeno"))
+    sello = dict(read_seal(lote_sellado[1]), signed_length=ruta.stat().st_size)
+    embed_seal(str(ruta), sello)
+    with pytest.raises(ValueError, match="raíz"):
+        verify_sealed_pdf(ruta.read_bytes(), contexto_de_confianza(tsa), require_trusted=False)
+
+
+def test_pdf_sin_sello(pdf_signer):
+    with pytest.raises(ValueError):
+        verify_sealed_pdf(pdf_firmado(pdf_signer, "sin sello"))
@@ -0,0 +1,138 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pytest
+
+from tools.stub_provider import start_stub
+from utils.batcher import KeyedBatcher
+from worker_resend import SMS_API_CONFIG, StandaloneSmsEsClient
+
+
+class Registro:
+    """`flush_fn` que guarda los lotes recibidos y devuelve cada elemento por dos."""
+
+    def __init__(self):
+        self.lotes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.lotes.append(list(items))
+        return [item * 2 for item in items]
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def arrancar(flush_fn, executor, **kwargs) -> KeyedBatcher:
+    batcher = KeyedBatcher(flush_fn, executor, **kwargs)
+    batcher.start()
+    return batcher
+
+
+def test_sale_al_llegar_al_tamano_maximo(executor):
+    registro = Registro()
+    # Con una ventana de un minuto, solo el tamaño puede hacer salir el lote
+    batcher = arrancar(registro, executor, max_items=3, max_delay_ms=60000)
+    try:
+        futures = [batcher.submit("a", i) for i in (1, 2, 3)]
+        hechos, _ = wait(futures, timeout=5)
+        assert len(hechos) == 3
+        assert [f.result() for f in futures] == [2, 4, 6]
+        assert registro.lotes == [[1, 2, 3]]
+
+        cuarto = batcher.submit("a", 4)
+        time.sleep(0.2)
+        assert not cuarto.done()
+    finally:
+        batcher.stop()
+    # stop entrega lo pendiente
+    assert cuarto.result(timeout=5) == 8
+
+
+def test_sale_al_caducar_la_ventana(executor):
+    registro = Registro()
+    batcher = arrancar(registro, executor, max_items=100, max_delay_ms=50)
+    try:
+        inicio = time.monotonic()
+        futures = [batcher.submit("a", i) for i in (1, 2)]
+        assert [f.result(timeout=5) for f in futures] == [2, 4]
+        assert time.monotonic() - inicio >= 0.04
+        assert registro.lotes == [[1, 2]]
+    finally:
+        batcher.stop()
+
+
+def test_agrupa_por_clave(executor):
+    registro = Registro()
+    batcher = arrancar(registro, executor, max_items=2, max_delay_ms=60000)
+    try:
+        futures = [batcher.submit("a", 1), batcher.submit("b", 10), batcher.submit("a", 2), batcher.submit("b", 20)]
+        assert [f.result(timeout=5) for f in futures] == [2, 20, 4, 40]
+        assert sorted(registro.lotes) == [[1, 2], [10, 20]]
+        assert batcher.stats()["batches"] == 2
+    finally:
+        batcher.stop()
+
+
+def test_un_fallo_del_lote_llega_a_todos_sus_elementos(executor):
+    def falla(items):
+        raise RuntimeError("proveedor caído")
+
+    batcher = arrancar(falla, executor, max_items=2, max_delay_ms=60000)
+    try:
+        futures = [batcher.submit("a", 1), batcher.submit("a", 2)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
+    finally:
+        batcher.stop()
+
+
+@pytest.fixture
+def proveedor():
+    servidor, url = start_stub()
+    config = dict(SMS_API_CONFIG, api_url=url, bulk_url=f"{url}/bulk", username="u", password="p")
+    client = StandaloneSmsEsClient(config)
+    yield servidor, client
+    client.close()
+    servidor.shutdown()
+
+
+def mensaje(i: int) -> dict:
+    return {"sender": "PRUEBA", "receiver": f"+3460000000{i}", "text": "Hola", "db_message_id": f"sms-{i}"}
+
+
+def test_send_sms_bulk_una_peticion_por_lote(proveedor):
+    servidor, client = proveedor
+    resultados = client.send_sms_bulk([mensaje(i) for i in range(3)])
+
+    assert servidor.requests == 1 and servidor.messages == 3
+    assert [r["status"] for r in resultados] == ["success"] * 3
+    assert len({r["data"]["msgId"] for r in resultados}) == 3
+
+
+def test_send_sms_bulk_con_un_solo_mensaje_usa_el_envio_individual(proveedor):
+    servidor, client = proveedor
+    [resultado] = client.send_sms_bulk([mensaje(1)])
+    assert resultado["status"] == "success"
+    assert servidor.requests == 1
+
+
+def test_batcher_con_envio_en_bloque(proveedor, executor):
+    servidor, client = proveedor
+    batcher = arrancar(client.send_sms_bulk, executor, max_items=4, max_delay_ms=50)
+    try:
+        # 4 SMS salen por tamaño y los 2 restantes por tiempo
+        futures = [batcher.submit(("PRUEBA", "Hola"), mensaje(i)) for i in range(6)]
+        resultados = [f.result(timeout=5) for f in futures]
+    finally:
+        batcher.stop()
+
+    assert [r["status"] for r in resultados] == ["success"] * 6
+    assert servidor.requests == 2 and servidor.messages == 6
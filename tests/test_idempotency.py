@@ -0,0 +1,28 @@
+import json
+
+from utils import idempotency
+
+
+def lote(sub_account: str) -> bytes:
+    return json.dumps([{
+        "sender_id": "+15551234567",
+        "recipients": "+34600000001",
+        "message": "Hola",
+        "action": "send",
+        "sub_account": sub_account,
+        "sub_account_pass": "clave",
+    }]).encode()
+
+
+def test_misma_clave_del_cliente_en_subcuentas_distintas():
+    clave_a = idempotency.batch_idempotency_key("pedido-1", lote("cuenta-a"))
+    clave_b = idempotency.batch_idempotency_key("pedido-1", lote("cuenta-b"))
+    assert clave_a != clave_b
+
+
+def test_reintento_del_mismo_lote():
+    assert idempotency.batch_idempotency_key("pedido-1", lote("cuenta-a")) == \
+        idempotency.batch_idempotency_key("pedido-1", lote("cuenta-a"))
+    # Sin clave del cliente se deduplica por contenido, separado de la clave explícita
+    assert idempotency.batch_idempotency_key(None, lote("cuenta-a")) != \
+        idempotency.batch_idempotency_key("pedido-1", lote("cuenta-a"))
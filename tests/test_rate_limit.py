@@ -0,0 +1,58 @@
+import pytest
+
+from utils import rate_limit
+from utils.rate_limit import TokenBucketLimiter
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    """Cubos con los valores por defecto, sin recarga durante la prueba."""
+    sub_account = TokenBucketLimiter(rate=1e-9, burst=1000)
+    sender = TokenBucketLimiter(rate=1e-9, burst=500)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "sub_account_limiter", sub_account)
+    monkeypatch.setattr(rate_limit, "sender_limiter", sender)
+    return sub_account, sender
+
+
+def tokens(limiter, key) -> float:
+    return limiter._buckets[key][0]
+
+
+def test_campana_mayor_que_la_rafaga_se_admite_con_el_cubo_lleno(limiters):
+    sub_account, sender = limiters
+    assert rate_limit.admit("cuenta", "+1555", 600) == 0
+    # El cubo queda en negativo y las siguientes peticiones esperan
+    assert tokens(sender, "+1555") == -100
+    assert rate_limit.admit("cuenta", "+1555", 1) > 0
+
+
+def test_campana_mayor_que_la_rafaga_espera_a_que_se_llene():
+    limiter = TokenBucketLimiter(rate=10, burst=500)
+    assert limiter.acquire("+1555", 100) == 0
+    espera = limiter.acquire("+1555", 600)
+    # Le faltan los 100 tokens consumidos: 10 s a 10 tokens/s
+    assert espera == pytest.approx(10, abs=0.1)
+
+
+def test_rechazo_del_sender_devuelve_los_tokens_de_la_sub_account(limiters):
+    sub_account, sender = limiters
+    assert rate_limit.admit("cuenta", "+1555", 500) == 0
+    assert rate_limit.admit("cuenta", "+1555", 10) > 0
+    assert tokens(sub_account, "cuenta") == 500
+    assert sub_account.stats()["allowed"] == 500
+
+
+def test_release_deja_los_contadores_como_antes(limiters):
+    sub_account, sender = limiters
+    # Como el endpoint de lotes: un admit por mensaje y un release del lote entero
+    filas = []
+    for receptores in (3, 1, 2):
+        assert rate_limit.admit("cuenta", "+1555", receptores) == 0
+        filas.extend({"sub_account": "cuenta", "sender": "+1555"} for _ in range(receptores))
+    assert sender.stats()["allowed"] == 6
+
+    rate_limit.release(filas)
+    for limiter, clave, rafaga in ((sub_account, "cuenta", 1000), (sender, "+1555", 500)):
+        assert limiter.stats()["allowed"] == 0
+        assert tokens(limiter, clave) == rafaga
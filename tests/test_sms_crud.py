@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from models.status import SmsStatus
+from productorRabbitmq import SMS_RESEND_QUEUE
+from utils import sms_crud
+from utils.client_crud import DatosCliente
+
+CLIENTE = DatosCliente(email_cliente="cliente@example.com", ftp_directorio="/ftp/cliente")
+
+
+def construir(recipients: str):
+    return sms_crud.build_message_rows(
+        sender_id="+15551234567",
+        recipients=recipients,
+        message="Hola",
+        action="send",
+        sub_account="cuenta",
+        sub_account_pass="clave",
+        cliente=CLIENTE,
+    )
+
+
+@pytest.mark.parametrize(
+    "recipients, validos, invalidos",
+    [
+        ("+34600000001", ["+34600000001"], []),
+        ("+34600000001,+34600000002;+34600000003", ["+34600000001", "+34600000002", "+34600000003"], []),
+        ("+34600000001\r\n+34600000002\n", ["+34600000001", "+34600000002"], []),
+        ("+34 600-000-001, (+34) 600.000.002", ["+34600000001", "+34600000002"], []),
+        ("0034600000001", ["+34600000001"], []),
+        ("+34600000001,0034600000001,+34 600 000 001", ["+34600000001"], []),
+        ("+34600000002,+34600000001,+34600000002", ["+34600000002", "+34600000001"], []),
+        ("+34600000001,abc,123", ["+34600000001"], ["abc", "123"]),
+        ("", [], []),
+        (None, [], []),
+    ],
+)
+def test_parse_recipients(recipients, validos, invalidos):
+    assert sms_crud.parse_recipients(recipients) == (validos, invalidos)
+
+
+def test_build_message_rows_una_fila_y_una_tarea_por_destinatario():
+    sms_rows, outbox_rows, entries = construir("+34600000001,0034600000002,+34 600 000 001,no-es-un-numero")
+
+    assert [row["receiver"] for row in sms_rows] == ["+34600000001", "+34600000002"]
+    assert len({row["message_id"] for row in sms_rows}) == 2
+    for row in sms_rows:
+        assert row["sender"] == "+15551234567"
+        assert row["status_code"] == int(SmsStatus.PENDING)
+        assert row["status"] == SmsStatus.PENDING.label
+        assert (row["email_cliente"], row["ftp_directorio"]) == CLIENTE
+        assert (row["sub_account"], row["sub_account_pass"]) == ("cuenta", "clave")
+
+    assert [tarea["queue"] for tarea in outbox_rows] == [SMS_RESEND_QUEUE] * 2
+    assert [json.loads(tarea["payload"])["db_message_id"] for tarea in outbox_rows] == [
+        row["message_id"] for row in sms_rows
+    ]
+
+    # Una entrada por destinatario válido y otra por cada inválido, en ese orden
+    assert [entry["errorCode"] for entry in entries] == [
+        sms_crud.SMS_OK, sms_crud.SMS_OK, sms_crud.SMS_INVALID_PARAMS,
+    ]
+    assert [entry["id"] for entry in entries[:2]] == [row["message_id"] for row in sms_rows]
+    assert entries[2]["destinationAddress"] == "no-es-un-numero"
+
+
+def test_build_message_rows_sin_destinatarios_validos():
+    sms_rows, outbox_rows, entries = construir("abc")
+    assert sms_rows == [] and outbox_rows == []
+    assert [entry["errorCode"] for entry in entries] == [sms_crud.SMS_INVALID_PARAMS]
+
+
+def test_build_message_rows_rechaza_demasiados_destinatarios(monkeypatch):
+    monkeypatch.setattr(sms_crud, "MAX_RECIPIENTS", 2)
+    construir("+34600000001,+34600000002")
+    with pytest.raises(ValueError):
+        construir("+34600000001,+34600000002,+34600000003")
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from models.clients import SmsIncoming
+from models.status import SmsStatus
+from utils import sms_status
+from utils.client_crud import DatosCliente
+from utils.sms_crud import build_sms_row
+
+CLIENTE = DatosCliente(email_cliente="cliente@example.com", ftp_directorio="/ftp/cliente")
+
+PERMITIDAS = [
+    (SmsStatus.PENDING, SmsStatus.SENDING),
+    (SmsStatus.PENDING, SmsStatus.SENT_FAILED),
+    (SmsStatus.SENDING, SmsStatus.SENT_FAILED),
+    (SmsStatus.SENDING, SmsStatus.ACCEPTED),
+    (SmsStatus.SENDING, SmsStatus.DELIVERED),
+    (SmsStatus.ACCEPTED, SmsStatus.DELIVERED),
+    (SmsStatus.ACCEPTED, SmsStatus.UNDELIVERED),
+    (SmsStatus.ACCEPTED, SmsStatus.EXPIRED),
+    (SmsStatus.ACCEPTED, SmsStatus.REJECTED),
+]
+
+PROHIBIDAS = [
+    # Un DLR no puede llegar antes del envío
+    (SmsStatus.PENDING, SmsStatus.ACCEPTED),
+    (SmsStatus.PENDING, SmsStatus.DELIVERED),
+    # Los estados finales no cambian (DLR duplicados o fuera de orden)
+    (SmsStatus.DELIVERED, SmsStatus.DELIVERED),
+    (SmsStatus.DELIVERED, SmsStatus.ACCEPTED),
+    (SmsStatus.DELIVERED, SmsStatus.UNDELIVERED),
+    (SmsStatus.UNDELIVERED, SmsStatus.DELIVERED),
+    # Ni se vuelve atrás en el envío
+    (SmsStatus.ACCEPTED, SmsStatus.ACCEPTED),
+    (SmsStatus.ACCEPTED, SmsStatus.SENDING),
+    (SmsStatus.ACCEPTED, SmsStatus.SENT_FAILED),
+    (SmsStatus.SENT_FAILED, SmsStatus.SENDING),
+    (SmsStatus.SENT_FAILED, SmsStatus.PENDING),
+]
+
+
+def crear_sms(db, estado: SmsStatus = SmsStatus.PENDING, **valores) -> str:
+    row = build_sms_row(
+        sender_id="+15551234567",
+        receiver="+34600000001",
+        message="Hola",
+        action="send",
+        sub_account="cuenta",
+        sub_account_pass="clave",
+        cliente=CLIENTE,
+    )
+    row.update(status_code=int(estado), status=estado.label, **valores)
+    db.execute(insert(SmsIncoming), [row])
+    db.commit()
+    return row["message_id"]
+
+
+def estado_de(db, message_id: str) -> SmsStatus:
+    db.expire_all()
+    return SmsStatus(db.get(SmsIncoming, message_id).status_code)
+
+
+@pytest.mark.parametrize("actual, nuevo", PERMITIDAS)
+def test_transicion_permitida(session_factory, actual, nuevo):
+    assert sms_status.can_transition(int(actual), nuevo)
+    with session_factory() as db:
+        message_id = crear_sms(db, actual)
+        assert sms_status.transition(db, message_id, nuevo, provider_id="prov-1")
+        db.commit()
+        sms = db.get(SmsIncoming, message_id)
+        db.refresh(sms)
+        assert (SmsStatus(sms.status_code), sms.status) == (nuevo, nuevo.label)
+        assert sms.provider_id == "prov-1"
+
+
+@pytest.mark.parametrize("actual, nuevo", PROHIBIDAS)
+def test_transicion_prohibida_no_escribe(session_factory, actual, nuevo):
+    assert not sms_status.can_transition(int(actual), nuevo)
+    with session_factory() as db:
+        message_id = crear_sms(db, actual)
+        assert not sms_status.transition(db, message_id, nuevo, provider_id="prov-1")
+        db.commit()
+        assert estado_de(db, message_id) == actual
+        assert db.get(SmsIncoming, message_id).provider_id is None
+
+
+def test_transition_loaded_actualiza_el_objeto(session_factory):
+    with session_factory() as db:
+        message_id = crear_sms(db, SmsStatus.SENDING)
+        sms = db.get(SmsIncoming, message_id)
+        assert sms_status.transition_loaded(db, sms, SmsStatus.ACCEPTED)
+        assert sms.status_code == int(SmsStatus.ACCEPTED)
+        # El mismo lote ve ya el estado nuevo: un ACCEPTED repetido es un no-op
+        assert not sms_status.transition_loaded(db, sms, SmsStatus.ACCEPTED)
+        assert sms_status.transition_loaded(db, sms, SmsStatus.DELIVERED)
+        db.commit()
+        assert estado_de(db, message_id) == SmsStatus.DELIVERED
+
+
+def test_transicion_de_un_mensaje_inexistente(session_factory):
+    with session_factory() as db:
+        assert not sms_status.transition(db, "no-existe", SmsStatus.SENDING)
+
+
+def test_claim_send(session_factory):
+    with session_factory() as db:
+        message_id = crear_sms(db)
+        assert sms_status.claim_send(db, message_id, stale_after=60)
+        db.commit()
+        assert estado_de(db, message_id) == SmsStatus.SENDING
+        # Otro worker no puede reclamarlo mientras el reclamo esté vigente
+        assert not sms_status.claim_send(db, message_id, stale_after=60)
+
+
+def test_claim_send_caducado_o_soltado(session_factory):
+    with session_factory() as db:
+        caducado = crear_sms(
+            db, SmsStatus.SENDING, send_claimed_at=datetime.utcnow() - timedelta(seconds=120)
+        )
+        assert sms_status.claim_send(db, caducado, stale_after=60)
+
+        soltado = crear_sms(db, SmsStatus.SENDING)
+        assert sms_status.claim_send(db, soltado, stale_after=60)
+
+        # Con provider_id el envío ya se hizo: no se vuelve a reclamar
+        enviado = crear_sms(db, SmsStatus.SENDING, provider_id="prov-1")
+        assert not sms_status.claim_send(db, enviado, stale_after=60)
+
+
+def test_release_send_vuelve_a_pending(session_factory):
+    with session_factory() as db:
+        message_id = crear_sms(db)
+        assert sms_status.claim_send(db, message_id, stale_after=60)
+        assert sms_status.release_send(db, message_id)
+        db.commit()
+        assert estado_de(db, message_id) == SmsStatus.PENDING
+        assert db.get(SmsIncoming, message_id).send_claimed_at is None
+        # El reintento lo reclama enseguida
+        assert sms_status.claim_send(db, message_id, stale_after=60)
+
+        # Un envío que ya llegó al proveedor no se suelta
+        enviado = crear_sms(db, SmsStatus.SENDING, provider_id="prov-1")
+        assert not sms_status.release_send(db, enviado)
+        db.commit()
+        assert estado_de(db, enviado) == SmsStatus.SENDING
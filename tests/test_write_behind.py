@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+import worker_resend
+from productorRabbitmq import dead_letter_queue_name, SMS_RESEND_QUEUE
+from utils.write_behind import WriteBehindBuffer
+
+
+class SesionFalsa:
+    """Sesión cuyo commit espera a `permitir` y falla si `fallar` está activo."""
+
+    def __init__(self, control):
+        self.control = control
+
+    def commit(self):
+        self.control["permitir"].wait(5)
+        if self.control["fallar"]:
+            raise RuntimeError("disco lleno")
+        self.control["commits"] += 1
+
+    def rollback(self):
+        self.control["rollbacks"] += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def control():
+    return {"permitir": threading.Event(), "fallar": False, "commits": 0, "rollbacks": 0}
+
+
+@pytest.fixture
+def buffer(control):
+    escritor = WriteBehindBuffer(lambda: SesionFalsa(control), max_updates=10, max_delay_ms=20)
+    escritor.start()
+    yield escritor
+    control["permitir"].set()
+    escritor.stop()
+
+
+def test_el_resultado_llega_despues_del_commit(buffer, control):
+    futures = [buffer.submit(lambda db, i=i: i) for i in range(3)]
+    # Sin commit no hay resultado: el worker aún no puede confirmar
+    assert not any(f.done() for f in futures)
+    control["permitir"].set()
+    assert [f.result(timeout=5) for f in futures] == [0, 1, 2]
+    assert control["commits"] == 1
+
+
+def test_un_fallo_del_commit_llega_a_cada_actualizacion(buffer, control):
+    control["fallar"] = True
+    control["permitir"].set()
+    futures = [buffer.submit(lambda db: None) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert control["commits"] == 0 and control["rollbacks"] >= 1
+
+
+class Conexion:
+    def add_callback_threadsafe(self, fn):
+        fn()
+
+
+class Canal:
+    def __init__(self):
+        self.connection = Conexion()
+        self.eventos = []
+        self.lock = threading.Lock()
+
+    def basic_ack(self, delivery_tag, **kwargs):
+        with self.lock:
+            self.eventos.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, **kwargs):
+        with self.lock:
+            self.eventos.append(("nack", delivery_tag))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        with self.lock:
+            self.eventos.append(("publish", routing_key))
+
+
+def esperar_eventos(canal, n):
+    for _ in range(500):
+        if len(canal.eventos) >= n:
+            return
+        time.sleep(0.01)
+
+
+def test_el_worker_confirma_solo_tras_el_commit(monkeypatch, buffer, control):
+    monkeypatch.setattr(worker_resend, "status_writer", buffer)
+    canal = Canal()
+    worker_resend._guardar_y_confirmar(canal, 7, b"{}", None, "sms-1", lambda db: None)
+
+    time.sleep(0.1)
+    assert canal.eventos == []
+    control["permitir"].set()
+    esperar_eventos(canal, 1)
+    assert canal.eventos == [("ack", 7)]
+
+
+def test_el_worker_manda_a_la_dlq_si_falla_el_commit(monkeypatch, buffer, control):
+    monkeypatch.setattr(worker_resend, "status_writer", buffer)
+    control["fallar"] = True
+    canal = Canal()
+    worker_resend._guardar_y_confirmar(canal, 7, b"{}", None, "sms-1", lambda db: None)
+
+    control["permitir"].set()
+    esperar_eventos(canal, 2)
+    # Nunca un ack de éxito: el mensaje se copia a la DLQ antes de confirmar el original
+    assert canal.eventos == [("publish", dead_letter_queue_name(SMS_RESEND_QUEUE)), ("ack", 7)]
@@ -0,0 +1,111 @@
+"""
+Microbenchmark del coste de firma por certificado PDF.
+
+Uso (desde la raíz del proyecto):
+
+    python -m tools.bench_signing --docs 50
+    python -m tools.bench_signing --docs 50 --pkcs12 paquete.p12 --passphrase ...
+
+Compara la firma cargando el PKCS#12 y creando el `PdfSigner` en cada
+documento (como hacía worker_pdf antes) con un `SigningContext` cargado una
+vez. Sin `--pkcs12` genera un certificado autofirmado temporal. No usa TSA,
+para medir solo el coste local de la firma.
+"""
+import argparse
+import datetime
+import io
+import os
+import tempfile
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from pyhanko.sign import fields, signers
+from reportlab.pdfgen import canvas
+
+from utils.signing import SigningContext
+
+
+def certificado_temporal(directorio: str, passphrase: str) -> str:
+    """PKCS#12 autofirmado (RSA 2048) para el benchmark."""
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark de firma")])
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre)
+        .issuer_name(nombre)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - datetime.timedelta(days=1))
+        .not_valid_after(ahora + datetime.timedelta(days=30))
+        .sign(clave, hashes.SHA256())
+    )
+    ruta = os.path.join(directorio, "bench.p12")
+    with open(ruta, "wb") as f:
+        f.write(
+            pkcs12.serialize_key_and_certificates(
+                b"bench", clave, cert, None,
+                serialization.BestAvailableEncryption(passphrase.encode("utf-8")),
+            )
+        )
+    return ruta
+
+
+def pdf_de_prueba() -> bytes:
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer)
+    c.drawString(72, 720, "Certificado de entrega de SMS (benchmark)")
+    c.save()
+    return buffer.getvalue()
+
+
+def firmar(pdf_signer, pdf: bytes):
+    w = IncrementalPdfFileWriter(io.BytesIO(pdf))
+    fields.append_signature_field(
+        w, sig_field_spec=fields.SigFieldSpec(sig_field_name="FirmaEmpresa", box=(72.25, 50, 250, 100))
+    )
+    pdf_signer.sign_pdf(w, output=io.BytesIO())
+
+
+def medir(nombre, fn, docs):
+    inicio = time.perf_counter()
+    for _ in range(docs):
+        fn()
+    total = time.perf_counter() - inicio
+    print(f"{nombre:24} {total / docs * 1000:>8.2f} ms/documento")
+    return total / docs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coste de firma por certificado PDF.")
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--pkcs12", help="PKCS#12 a usar (por defecto, uno temporal)")
+    parser.add_argument("--passphrase", default="bench")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = args.pkcs12 or certificado_temporal(directorio, args.passphrase)
+        passphrase = args.passphrase.encode("utf-8")
+        meta = signers.PdfSignatureMetadata(field_name="FirmaEmpresa")
+        pdf = pdf_de_prueba()
+
+        def por_documento():
+            signer = signers.SimpleSigner.load_pkcs12(pfx_file=ruta, passphrase=passphrase)
+            firmar(signers.PdfSigner(meta, signer), pdf)
+
+        contexto = SigningContext(ruta, args.passphrase, meta)
+
+        print(f"{args.docs} documentos firmados con '{ruta}'")
+        medir("carga del PKCS#12", lambda: signers.SimpleSigner.load_pkcs12(pfx_file=ruta, passphrase=passphrase), args.docs)
+        antes = medir("antes (por documento)", por_documento, args.docs)
+        despues = medir("SigningContext", lambda: firmar(contexto.pdf_signer(), pdf), args.docs)
+        print(f"Ahorro: {(1 - despues / antes) * 100:.0f}% por documento (certificado cargado {contexto.loads} vez/veces)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Microbenchmark del coste por envío de `StandaloneSmsEsClient`.
+
+Uso (desde la raíz del proyecto):
+
+    python -m tools.bench_sms_client --sends 2000 --threads 8
+
+Compara contra el proveedor simulado (tools/stub_provider.py) el envío con
+una conexión nueva por SMS (`requests.post`, como hacía el worker antes)
+y con el cliente del worker, que reutiliza conexiones keep-alive. El
+limitador adaptativo y el circuit breaker se desactivan para medir solo el
+coste HTTP, y sus ficheros de estado apuntan a un directorio temporal para no
+tocar nunca los de los workers en marcha.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["PROVIDER_RATE_ENABLED"] = "false"
+os.environ["CIRCUIT_ENABLED"] = "false"
+_estado_bench = tempfile.mkdtemp(prefix="bench_sms_")
+os.environ["PROVIDER_RATE_STATE_FILE"] = os.path.join(_estado_bench, "sms_provider_rate.json")
+os.environ["CIRCUIT_STATE_FILE"] = os.path.join(_estado_bench, "sms_provider_circuit.json")
+os.environ.setdefault("DLR_URL", "http://127.0.0.1")
+
+import requests
+
+from tools.stub_provider import start_stub
+from worker_resend import SMS_API_CONFIG, StandaloneSmsEsClient
+
+MENSAJE = {
+    "sender": "BENCH",
+    "receiver": "+34600000000",
+    "text": "Mensaje de prueba del benchmark",
+    "db_message_id": "bench",
+}
+
+
+def envio_sin_sesion(client: StandaloneSmsEsClient):
+    """El envío anterior: conexión nueva y doble serialización por SMS."""
+    payload = client._build_payload(MENSAJE)
+    json.dumps(payload)
+    response = requests.post(
+        client.api_url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+        timeout=20,
+    )
+    return response.status_code == 202
+
+
+def envio_con_sesion(client: StandaloneSmsEsClient):
+    return client.send_sms(MENSAJE)["status"] == "success"
+
+
+def medir(nombre, fn, client, servidor, sends, threads):
+    servidor.connections.clear()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        resultados = list(pool.map(lambda _: fn(client), range(sends)))
+    total = time.perf_counter() - inicio
+    print(
+        f"{nombre:14} {sends / total:>9.0f} envíos/s {total / sends * 1e6:>9.0f} µs/envío "
+        f"{len(servidor.connections):>6} conexiones {resultados.count(False):>4} fallos"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coste por envío del cliente de SMS.")
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia simulada del proveedor")
+    args = parser.parse_args(argv)
+
+    # El log por envío no forma parte de lo que se mide
+    logging.disable(logging.INFO)
+    servidor, url = start_stub(latency=args.latency)
+    config = dict(SMS_API_CONFIG, api_url=url, username="bench", password="bench", pool_maxsize=args.threads)
+    client = StandaloneSmsEsClient(config)
+    try:
+        print(f"{args.sends} envíos con {args.threads} hilos contra {url}")
+        medir("sin sesión", envio_sin_sesion, client, servidor, args.sends, args.threads)
+        medir("keep-alive", envio_con_sesion, client, servidor, args.sends, args.threads)
+    finally:
+        client.close()
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
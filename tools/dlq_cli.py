@@ -0,0 +1,199 @@
+"""
+Inspección y reproceso de las colas de mensajes fallidos (DLQ).
+
+Uso (desde la raíz del proyecto):
+
+    python -m tools.dlq_cli stats
+    python -m tools.dlq_cli inspect sms_resend_queue --limit 20
+    python -m tools.dlq_cli replay sms_resend_queue --error-class RetriesExhausted --rate 20
+    python -m tools.dlq_cli replay Certificacion_PDF --limit 500 --dry-run
+
+`replay` devuelve los mensajes a su cola original a un ritmo máximo de
+`--rate` mensajes por segundo, para vaciar miles de fallos tras una caída sin
+saturar al proveedor de SMS ni a la TSA.
+"""
+import argparse
+import time
+from collections import Counter
+from datetime import datetime
+
+import pika
+
+from productorRabbitmq import (
+    RABBITMQ_HOST,
+    SMS_RESEND_QUEUE,
+    CERTIFICACION_PDF_QUEUE,
+    DISTRIBUCION_PDF_QUEUE,
+    DLR_INGEST_QUEUE,
+    DLR_FORWARD_QUEUE,
+    DLQ_ERROR_CLASS_HEADER,
+    DLQ_ERROR_HEADER,
+    DLQ_ORIGINAL_QUEUE_HEADER,
+    DLQ_FAILED_AT_HEADER,
+    RETRY_HEADER,
+    dead_letter_queue_name,
+)
+from utils.rate_limit import TokenBucketLimiter
+
+PIPELINE_QUEUES = (
+    SMS_RESEND_QUEUE,
+    CERTIFICACION_PDF_QUEUE,
+    DISTRIBUCION_PDF_QUEUE,
+    DLR_INGEST_QUEUE,
+    DLR_FORWARD_QUEUE,
+)
+
+# Cabeceras añadidas al pasar por la DLQ o por los reintentos; se limpian al reprocesar
+_CABECERAS_FALLO = (
+    DLQ_ERROR_CLASS_HEADER,
+    DLQ_ERROR_HEADER,
+    DLQ_ORIGINAL_QUEUE_HEADER,
+    DLQ_FAILED_AT_HEADER,
+    RETRY_HEADER,
+)
+REPLAY_HEADER = "x-reprocesos"
+
+
+def conectar():
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    return connection, connection.channel()
+
+
+def _cabeceras(properties) -> dict:
+    return dict(properties.headers or {})
+
+
+def _texto(valor) -> str:
+    return valor.decode("utf-8", "replace") if isinstance(valor, bytes) else str(valor)
+
+
+def _coincide(headers: dict, error_class: str) -> bool:
+    return error_class is None or _texto(headers.get(DLQ_ERROR_CLASS_HEADER, "")) == error_class
+
+
+def cmd_stats(channel, args):
+    """Mensajes pendientes en cada DLQ."""
+    for queue_name in PIPELINE_QUEUES:
+        dlq = dead_letter_queue_name(queue_name)
+        try:
+            declarada = channel.queue_declare(queue=dlq, durable=True, passive=True)
+            print(f"{dlq:40} {declarada.method.message_count:>8}")
+        except pika.exceptions.ChannelClosedByBroker:
+            print(f"{dlq:40} {'(no existe)':>8}")
+            channel = channel.connection.channel()
+
+
+def cmd_inspect(channel, args):
+    """
+    Muestra hasta `--limit` mensajes sin consumirlos: se leen sin ack y vuelven
+    a la DLQ al cerrar el canal. Resume además los fallos por clase de error.
+    """
+    dlq = dead_letter_queue_name(args.queue)
+    por_clase = Counter()
+    leidos = 0
+    while leidos < args.limit:
+        method, properties, body = channel.basic_get(queue=dlq, auto_ack=False)
+        if method is None:
+            break
+        leidos += 1
+        headers = _cabeceras(properties)
+        clase = _texto(headers.get(DLQ_ERROR_CLASS_HEADER, "?"))
+        por_clase[clase] += 1
+        if not _coincide(headers, args.error_class):
+            continue
+        fallo_en = headers.get(DLQ_FAILED_AT_HEADER)
+        fecha = datetime.fromtimestamp(fallo_en).isoformat(" ", "seconds") if fallo_en else "?"
+        print(f"[{fecha}] {clase}: {_texto(headers.get(DLQ_ERROR_HEADER, ''))}")
+        print(f"    intentos={headers.get(RETRY_HEADER, 0)} cuerpo={body[:200].decode('utf-8', 'replace')}")
+
+    print(f"\n{leidos} mensajes leídos de '{dlq}':")
+    for clase, total in por_clase.most_common():
+        print(f"  {clase:30} {total:>6}")
+    # Cerrar el canal devuelve a la cola todos los mensajes leídos sin ack
+    channel.close()
+
+
+def cmd_replay(channel, args):
+    """
+    Devuelve a la cola original los mensajes de la DLQ que coinciden con el
+    filtro, a `--rate` mensajes/s. Cada mensaje se publica con confirmación
+    del broker antes de retirarlo de la DLQ; los que no coinciden se dejan.
+    """
+    dlq = dead_letter_queue_name(args.queue)
+    limiter = TokenBucketLimiter(rate=args.rate, burst=max(args.rate, 1))
+    if not args.dry_run:
+        channel.confirm_delivery()
+
+    reprocesados, saltados = 0, []
+    while args.limit is None or reprocesados < args.limit:
+        method, properties, body = channel.basic_get(queue=dlq, auto_ack=False)
+        if method is None:
+            break
+        headers = _cabeceras(properties)
+        if not _coincide(headers, args.error_class):
+            # Se retiene sin ack hasta el final para no volver a leerlo
+            saltados.append(method.delivery_tag)
+            continue
+
+        while True:
+            espera = limiter.acquire("replay")
+            if not espera:
+                break
+            time.sleep(espera)
+
+        destino = _texto(headers.get(DLQ_ORIGINAL_QUEUE_HEADER, args.queue))
+        if args.dry_run:
+            print(f"[dry-run] {_texto(headers.get(DLQ_ERROR_CLASS_HEADER, '?'))} -> {destino}: {body[:120]!r}")
+            saltados.append(method.delivery_tag)
+        else:
+            for cabecera in _CABECERAS_FALLO:
+                headers.pop(cabecera, None)
+            headers[REPLAY_HEADER] = int(headers.get(REPLAY_HEADER, 0)) + 1
+            channel.basic_publish(
+                exchange="",
+                routing_key=destino,
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # Mensaje persistente
+                    content_type=properties.content_type,
+                    headers=headers,
+                ),
+            )
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+        reprocesados += 1
+
+    for delivery_tag in saltados:
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+    accion = "se reprocesarían" if args.dry_run else "reprocesados"
+    print(f"{reprocesados} mensajes de '{dlq}' {accion}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspección y reproceso de las DLQ.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    sub.add_parser("stats", help="Mensajes en cada DLQ")
+
+    inspect = sub.add_parser("inspect", help="Muestra mensajes de una DLQ sin consumirlos")
+    inspect.add_argument("queue", choices=PIPELINE_QUEUES, help="Cola de trabajo original")
+    inspect.add_argument("--limit", type=int, default=20)
+    inspect.add_argument("--error-class", help="Mostrar solo esta clase de error")
+
+    replay = sub.add_parser("replay", help="Devuelve mensajes de una DLQ a su cola")
+    replay.add_argument("queue", choices=PIPELINE_QUEUES, help="Cola de trabajo original")
+    replay.add_argument("--error-class", help="Reprocesar solo esta clase de error")
+    replay.add_argument("--rate", type=float, default=10.0, help="Mensajes por segundo")
+    replay.add_argument("--limit", type=int, help="Máximo de mensajes a reprocesar")
+    replay.add_argument("--dry-run", action="store_true", help="Mostrar sin reprocesar")
+
+    args = parser.parse_args(argv)
+    connection, channel = conectar()
+    try:
+        {"stats": cmd_stats, "inspect": cmd_inspect, "replay": cmd_replay}[args.comando](channel, args)
+    finally:
+        if connection.is_open:
+            connection.close()
+
+
+if __name__ == "__main__":
+    main()
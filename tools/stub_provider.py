@@ -0,0 +1,113 @@
+"""
+Proveedor de SMS simulado para pruebas locales y benchmarks.
+
+Uso (desde la raíz del proyecto):
+
+    python -m tools.stub_provider --port 8099
+    python -m tools.stub_provider --port 8099 --latency 0.05 --throttle 0.1
+
+Acepta cada POST con un 202 y `{"msgId": ..., "numParts": 1}`, como la API de
+SMS.es. Con `--throttle` responde a esa fracción de envíos con un 420 y el
+código de throttling 105. Habla HTTP/1.1, así que respeta el keep-alive.
+Para usarlo con worker_resend: `API_URL_SMS_API=http://127.0.0.1:8099/sms`.
+
+Las rutas que terminan en `/bulk` simulan el envío multi-destinatario
+(`API_BULK_URL_SMS_API=http://127.0.0.1:8099/sms/bulk`): reciben `receivers` y
+devuelven un `msgId` por destinatario, con su `custom`, en `messages`.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo salen en escrituras separadas: sin TCP_NODELAY, Nagle
+    # y el ACK retardado añadirían ~40 ms a cada respuesta keep-alive
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        servidor = self.server
+        longitud = int(self.headers.get("Content-Length", 0))
+        cuerpo = self.rfile.read(longitud)
+        if servidor.latency:
+            time.sleep(servidor.latency)
+
+        destinatarios = 1
+        if servidor.throttle and random.random() < servidor.throttle:
+            estado, respuesta = 420, {"error": {"code": 105, "message": "Throttling error"}}
+        elif self.path.endswith("/bulk"):
+            receivers = json.loads(cuerpo).get("receivers", [])
+            destinatarios = len(receivers)
+            estado, respuesta = 202, {
+                "messages": [
+                    {
+                        "receiver": r.get("receiver"),
+                        "msgId": f"stub-{next(servidor.ids)}",
+                        "numParts": 1,
+                        "custom": r.get("custom", {}),
+                    }
+                    for r in receivers
+                ]
+            }
+        else:
+            estado, respuesta = 202, {"msgId": f"stub-{next(servidor.ids)}", "numParts": 1}
+        with servidor.lock:
+            servidor.requests += 1
+            servidor.messages += destinatarios
+            servidor.connections.add(self.client_address)
+
+        cuerpo = json.dumps(respuesta).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        # Sin una línea de log por petición: distorsionaría los benchmarks
+        pass
+
+
+def start_stub(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, throttle: float = 0.0):
+    """
+    Arranca el proveedor simulado en un hilo y devuelve `(servidor, url)`.
+    `servidor.requests`, `servidor.messages` y `servidor.connections` cuentan
+    peticiones, SMS y conexiones TCP distintas; se detiene con `servidor.shutdown()`.
+    """
+    servidor = ThreadingHTTPServer((host, port), StubProviderHandler)
+    servidor.daemon_threads = True
+    servidor.latency = latency
+    servidor.throttle = throttle
+    servidor.ids = itertools.count(1)
+    servidor.lock = threading.Lock()
+    servidor.requests = 0
+    servidor.messages = 0
+    servidor.connections = set()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}/sms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Proveedor de SMS simulado.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de espera por envío")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Fracción de envíos con 105")
+    args = parser.parse_args(argv)
+
+    servidor, url = start_stub(args.host, args.port, args.latency, args.throttle)
+    print(f"Proveedor simulado escuchando en {url}. Para salir presione CTRL+C")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
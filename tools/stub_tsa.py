@@ -0,0 +1,118 @@
+"""
+Autoridad de sellado de tiempo (TSA) simulada para pruebas locales.
+
+Uso (desde la raíz del proyecto):
+
+    python -m tools.stub_tsa --port 8098 --cert-out tsa.pem
+
+Responde a peticiones RFC 3161 (`application/timestamp-query`) firmando el
+sello con un certificado autofirmado generado al arrancar, que `--cert-out`
+guarda en PEM para verificar los sellos con tools/verify_seal.py. Para usarla
+con worker_pdf: `TSA_URL=http://127.0.0.1:8098/tsa` (con usuario y contraseña
+cualesquiera, al no estar en la lista de TSA conocidas).
+"""
+import argparse
+import datetime
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from asn1crypto import keys, pem, tsp
+from asn1crypto import x509 as asn1_x509
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+from pyhanko.sign.timestamps.dummy_client import DummyTimeStamper
+
+
+def tsa_temporal():
+    """Certificado autofirmado (RSA 2048, uso extendido timeStamping) y su clave."""
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "TSA simulada")])
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre)
+        .issuer_name(nombre)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - datetime.timedelta(days=1))
+        .not_valid_after(ahora + datetime.timedelta(days=30))
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.TIME_STAMPING]), critical=True)
+        .sign(clave, hashes.SHA256())
+    )
+    return (
+        asn1_x509.Certificate.load(cert.public_bytes(serialization.Encoding.DER)),
+        keys.PrivateKeyInfo.load(
+            clave.private_bytes(
+                serialization.Encoding.DER,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        ),
+    )
+
+
+class StubTsaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        servidor = self.server
+        longitud = int(self.headers.get("Content-Length", 0))
+        peticion = tsp.TimeStampReq.load(self.rfile.read(longitud))
+        cuerpo = servidor.timestamper.request_tsa_response(peticion).dump()
+        with servidor.lock:
+            servidor.requests += 1
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/timestamp-reply")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_tsa(host: str = "127.0.0.1", port: int = 0):
+    """
+    Arranca la TSA simulada en un hilo y devuelve `(servidor, url)`.
+    `servidor.tsa_cert` es el certificado con el que firma (la raíz de
+    confianza para verificar sus sellos) y `servidor.requests` cuenta los
+    sellos emitidos; se detiene con `servidor.shutdown()`.
+    """
+    tsa_cert, tsa_key = tsa_temporal()
+    servidor = ThreadingHTTPServer((host, port), StubTsaHandler)
+    servidor.daemon_threads = True
+    servidor.tsa_cert = tsa_cert
+    servidor.timestamper = DummyTimeStamper(tsa_cert=tsa_cert, tsa_key=tsa_key)
+    servidor.lock = threading.Lock()
+    servidor.requests = 0
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}/tsa"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TSA RFC 3161 simulada.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8098)
+    parser.add_argument("--cert-out", help="Fichero PEM donde guardar el certificado de la TSA")
+    args = parser.parse_args(argv)
+
+    servidor, url = start_stub_tsa(args.host, args.port)
+    if args.cert_out:
+        with open(args.cert_out, "wb") as f:
+            f.write(pem.armor("CERTIFICATE", servidor.tsa_cert.dump()))
+    print(f"TSA simulada escuchando en {url}. Para salir presione CTRL+C")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+        print(f"{servidor.requests} sellos emitidos.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Verificación del sello de lote de certificados PDF.
+
+Uso (desde la raíz del proyecto):
+
+    python -m tools.verify_seal certificados/sellados/certificado_final_<id>.pdf
+    python -m tools.verify_seal certificados/sellados/*.pdf --tsa-cert tsa.pem
+
+Para cada PDF sellado por lotes (PDF_BATCH_SEAL_ENABLED) comprueba que la
+prueba de inclusión embebida lleva de la revisión firmada a la raíz del lote
+y que el sello de tiempo de la TSA es válido para esa raíz. Con `--tsa-cert`
+se confía en esos certificados (p. ej. el de tools/stub_tsa.py) además de en
+los del sistema; con `--allow-untrusted` un sello íntegro de una TSA que no es
+de confianza se da por bueno con un aviso. Sale con código 1 si algún PDF no
+se verifica.
+"""
+import argparse
+import logging
+import sys
+
+from asn1crypto import pem
+from asn1crypto import x509 as asn1_x509
+from pyhanko_certvalidator import ValidationContext
+
+from utils.batch_seal import verify_sealed_pdf
+
+
+def cargar_certificados(rutas: list) -> list:
+    certificados = []
+    for ruta in rutas:
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        if pem.detect(datos):
+            certificados.extend(asn1_x509.Certificate.load(der) for _, _, der in pem.unarmor(datos, multiple=True))
+        else:
+            certificados.append(asn1_x509.Certificate.load(datos))
+    return certificados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica el sello de lote de certificados PDF.")
+    parser.add_argument("pdfs", nargs="+", help="PDF a verificar")
+    parser.add_argument("--tsa-cert", action="append", default=[], help="Certificado de confianza de la TSA (PEM o DER)")
+    parser.add_argument(
+        "--allow-untrusted",
+        action="store_true",
+        help="Acepta sellos íntegros de una TSA que no es de confianza",
+    )
+    args = parser.parse_args(argv)
+    # pyhanko registra cada fallo de la cadena con su traza; basta con el resumen
+    logging.getLogger("pyhanko").setLevel(logging.ERROR)
+
+    contexto = ValidationContext(extra_trust_roots=cargar_certificados(args.tsa_cert))
+    fallos = 0
+    for ruta in args.pdfs:
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        try:
+            resultado = verify_sealed_pdf(datos, contexto, require_trusted=not args.allow_untrusted)
+        except Exception as e:
+            fallos += 1
+            print(f"ERROR  {ruta}: {e}")
+            continue
+        aviso = "" if resultado["trusted"] else " [TSA sin confianza]"
+        print(
+            f"OK     {ruta}: sellado el {resultado['timestamp']:%Y-%m-%d %H:%M:%S %Z} "
+            f"(hoja {resultado['leaf_index'] + 1} de {resultado['batch_size']}){aviso}"
+        )
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
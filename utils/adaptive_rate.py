@@ -0,0 +1,179 @@
+import os
+import logging
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from utils.shared_state import SharedState
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- Limitador adaptativo (AIMD) de envíos al proveedor ---
+# Sube el ritmo de forma aditiva mientras el proveedor acepta y lo reduce a
+# la mitad cuando responde con throttling (105). Los procesos de
+# worker_resend comparten el estado a través de un fichero con flock.
+PROVIDER_RATE_ENABLED = os.getenv("PROVIDER_RATE_ENABLED", "true").lower() in ("1", "true", "yes")
+PROVIDER_RATE_INITIAL = float(os.getenv("PROVIDER_RATE_INITIAL", 20))
+PROVIDER_RATE_MIN = float(os.getenv("PROVIDER_RATE_MIN", 1))
+PROVIDER_RATE_MAX = float(os.getenv("PROVIDER_RATE_MAX", 500))
+# Mensajes/s que se añaden al ritmo por cada segundo sin throttling
+PROVIDER_RATE_INCREASE = float(os.getenv("PROVIDER_RATE_INCREASE", 1))
+# Factor multiplicativo aplicado en cada throttling
+PROVIDER_RATE_DECREASE = float(os.getenv("PROVIDER_RATE_DECREASE", 0.5))
+# Tras una reducción, los 105 de las peticiones ya en vuelo no vuelven a reducir
+PROVIDER_RATE_COOLDOWN = float(os.getenv("PROVIDER_RATE_COOLDOWN", 1))
+# Los envíos aceptados se suman al ritmo compartido como mucho cada
+# PROVIDER_RATE_SYNC_INTERVAL segundos, no uno a uno
+PROVIDER_RATE_SYNC_INTERVAL = float(os.getenv("PROVIDER_RATE_SYNC_INTERVAL", 0.5))
+PROVIDER_RATE_STATE_FILE = os.getenv(
+    "PROVIDER_RATE_STATE_FILE",
+    os.path.join(tempfile.gettempdir(), "sms_provider_rate.json"),
+)
+
+
+class AdaptiveRateLimiter:
+    """
+    Cubo de tokens cuyo ritmo se ajusta con AIMD según las respuestas del
+    proveedor. Es thread-safe y, con `state_file`, compartido entre procesos.
+
+    Para no leer y escribir el fichero en cada envío, cada proceso retira de
+    una vez todos los tokens enteros disponibles (como mucho una ráfaga) y los
+    gasta en memoria, y acumula los envíos aceptados durante `sync_interval`.
+    """
+
+    def __init__(
+        self,
+        state_file: str = None,
+        initial_rate: float = PROVIDER_RATE_INITIAL,
+        min_rate: float = PROVIDER_RATE_MIN,
+        max_rate: float = PROVIDER_RATE_MAX,
+        increase: float = PROVIDER_RATE_INCREASE,
+        decrease: float = PROVIDER_RATE_DECREASE,
+        cooldown: float = PROVIDER_RATE_COOLDOWN,
+        sync_interval: float = PROVIDER_RATE_SYNC_INTERVAL,
+    ):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.sync_interval = sync_interval
+        self._estado = SharedState(state_file, self._estado_inicial)
+        self._lock = threading.Lock()
+        self._tokens = 0  # tokens ya retirados del cubo compartido
+        self._aceptados = 0  # envíos aceptados aún sin sumar al ritmo
+        self._proxima_sync = 0.0
+
+    def _estado_inicial(self) -> dict:
+        ahora = time.time()
+        return {
+            "rate": self.initial_rate,
+            "tokens": 1.0,
+            "last_refill": ahora,
+            "last_decrease": 0.0,
+            "accepted": 0,
+            "throttled": 0,
+            "accept_rate": 0.0,
+            "window_start": ahora,
+            "window_accepted": 0,
+        }
+
+    def _recargar(self, estado: dict, ahora: float):
+        # Ráfaga máxima de una décima de segundo de envíos
+        burst = max(1.0, estado["rate"] / 10)
+        estado["tokens"] = min(burst, estado["tokens"] + (ahora - estado["last_refill"]) * estado["rate"])
+        estado["last_refill"] = ahora
+
+    def _aplicar_aceptados(self, estado: dict, ahora: float):
+        """Suma al estado compartido los envíos aceptados pendientes."""
+        self._proxima_sync = ahora + self.sync_interval
+        if not self._aceptados:
+            return
+        for _ in range(self._aceptados):
+            # Aumento aditivo: ≈ `increase` mensajes/s por segundo
+            estado["rate"] = min(self.max_rate, estado["rate"] + self.increase / estado["rate"])
+        estado["accepted"] += self._aceptados
+        estado["window_accepted"] += self._aceptados
+        self._aceptados = 0
+        transcurrido = ahora - estado["window_start"]
+        if transcurrido >= 1:
+            # Ritmo de aceptación observado (media móvil exponencial)
+            observado = estado["window_accepted"] / transcurrido
+            estado["accept_rate"] = round(0.7 * estado["accept_rate"] + 0.3 * observado, 2)
+            estado["window_start"] = ahora
+            estado["window_accepted"] = 0
+
+    def acquire(self):
+        """Espera hasta que el ritmo actual permita un envío más."""
+        while True:
+            with self._lock:
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                with self._estado.lock() as estado:
+                    ahora = time.time()
+                    self._aplicar_aceptados(estado, ahora)
+                    self._recargar(estado, ahora)
+                    if estado["tokens"] >= 1:
+                        retirados = int(estado["tokens"])
+                        estado["tokens"] -= retirados
+                        self._tokens = retirados - 1
+                        return
+                    espera = (1 - estado["tokens"]) / estado["rate"]
+            time.sleep(espera)
+
+    def on_success(self):
+        """El proveedor aceptó el envío: aumento aditivo del ritmo."""
+        with self._lock:
+            self._aceptados += 1
+            ahora = time.time()
+            if ahora < self._proxima_sync:
+                return
+            with self._estado.lock() as estado:
+                self._aplicar_aceptados(estado, ahora)
+
+    def on_throttle(self):
+        """El proveedor respondió 105: reducción multiplicativa y sin ráfaga."""
+        with self._lock, self._estado.lock() as estado:
+            ahora = time.time()
+            self._aplicar_aceptados(estado, ahora)
+            estado["throttled"] += 1
+            if ahora - estado["last_decrease"] < self.cooldown:
+                return
+            # Los tokens retirados por este proceso tampoco se gastan
+            self._tokens = 0
+            anterior = estado["rate"]
+            estado["rate"] = max(self.min_rate, anterior * self.decrease)
+            estado["tokens"] = min(estado["tokens"], 0.0)
+            estado["last_decrease"] = ahora
+        logger.warning(f"Throttling del proveedor: ritmo reducido de {anterior:.1f} a {estado['rate']:.1f} SMS/s.")
+
+    def stats(self) -> dict:
+        with self._lock, self._estado.lock() as estado:
+            self._aplicar_aceptados(estado, time.time())
+            return {
+                "rate": round(estado["rate"], 2),
+                "accept_rate": estado["accept_rate"],
+                "accepted": estado["accepted"],
+                "throttled": estado["throttled"],
+                "shared": self._estado.shared,
+            }
+
+
+_provider_limiter = None
+_provider_limiter_lock = threading.Lock()
+
+
+def get_provider_limiter():
+    """Limitador compartido de envíos al proveedor, o `None` si está desactivado."""
+    global _provider_limiter
+    if not PROVIDER_RATE_ENABLED:
+        return None
+    with _provider_limiter_lock:
+        if _provider_limiter is None:
+            _provider_limiter = AdaptiveRateLimiter(state_file=PROVIDER_RATE_STATE_FILE)
+        return _provider_limiter
@@ -0,0 +1,200 @@
+import os
+import io
+import json
+import base64
+import asyncio
+import hashlib
+import logging
+
+from asn1crypto import cms
+from dotenv import load_dotenv
+from pyhanko.pdf_utils import embed
+from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from pyhanko.pdf_utils.reader import PdfFileReader
+from pyhanko.sign.validation.generic_cms import validate_tst_signed_data
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- Sellado de tiempo por lotes ---
+# Los PDF firmados en una ventana de PDF_BATCH_SEAL_WINDOW_MS ms (hasta
+# PDF_BATCH_SEAL_MAX) se sellan con una sola petición a la TSA: se sella la
+# raíz de un árbol de Merkle cuyas hojas son los PDF firmados.
+PDF_BATCH_SEAL_ENABLED = os.getenv("PDF_BATCH_SEAL_ENABLED", "false").lower() in ("1", "true", "yes")
+PDF_BATCH_SEAL_MAX = int(os.getenv("PDF_BATCH_SEAL_MAX", 100))
+PDF_BATCH_SEAL_WINDOW_MS = float(os.getenv("PDF_BATCH_SEAL_WINDOW_MS", 5000))
+
+# Fichero embebido en cada PDF con su prueba de inclusión y el sello del lote
+SEAL_FILE_NAME = "sello_lote.json"
+SEAL_VERSION = 1
+SEAL_HASH = "sha256"
+
+
+# --- Árbol de Merkle ---
+# Hojas y nodos internos llevan prefijos distintos (como en RFC 6962), así una
+# hoja no puede hacerse pasar por un nodo interno. Un nodo sin pareja sube tal
+# cual al nivel siguiente.
+
+def _hoja(digest: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + digest).digest()
+
+
+def _nodo(izquierdo: bytes, derecho: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + izquierdo + derecho).digest()
+
+
+def merkle_levels(digests: list) -> list:
+    """Niveles del árbol, de las hojas (nivel 0) a la raíz (`[-1][0]`)."""
+    if not digests:
+        raise ValueError("Un árbol de Merkle necesita al menos una hoja.")
+    niveles = [[_hoja(d) for d in digests]]
+    while len(niveles[-1]) > 1:
+        actual = niveles[-1]
+        siguiente = [_nodo(actual[i], actual[i + 1]) for i in range(0, len(actual) - 1, 2)]
+        if len(actual) % 2:
+            siguiente.append(actual[-1])
+        niveles.append(siguiente)
+    return niveles
+
+
+def merkle_proof(niveles: list, indice: int) -> list:
+    """Hermanos de la hoja `indice` hasta la raíz, con el lado en que van."""
+    prueba = []
+    for nivel in niveles[:-1]:
+        hermano = indice ^ 1
+        if hermano < len(nivel):
+            prueba.append({"side": "L" if hermano < indice else "R", "hash": nivel[hermano].hex()})
+        indice //= 2
+    return prueba
+
+
+def merkle_root_from_proof(digest: bytes, prueba: list) -> bytes:
+    nodo = _hoja(digest)
+    for paso in prueba:
+        hermano = bytes.fromhex(paso["hash"])
+        nodo = _nodo(hermano, nodo) if paso["side"] == "L" else _nodo(nodo, hermano)
+    return nodo
+
+
+class BatchSealer:
+    """
+    Sella lotes de PDF ya firmados con un único sello de tiempo RFC 3161.
+
+    La hoja de cada PDF es el SHA-256 del fichero firmado, así que el sello de
+    la raíz prueba, como el sello de la firma PAdES, que el documento firmado
+    existía en esa fecha. `seal` sirve como `flush_fn` de un `KeyedBatcher`.
+    """
+
+    def __init__(self, timestamper):
+        self.timestamper = timestamper
+        self.batches = 0
+        self.documents = 0
+
+    def seal(self, pdf_paths: list) -> list:
+        """Sella el lote y devuelve el sello de cada PDF, en el mismo orden."""
+        hojas = []
+        for ruta in pdf_paths:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            hojas.append((hashlib.sha256(datos).digest(), len(datos)))
+        niveles = merkle_levels([digest for digest, _ in hojas])
+        raiz = niveles[-1][0]
+        token = asyncio.run(self.timestamper.async_timestamp(raiz, SEAL_HASH))
+        tst = base64.b64encode(token.dump()).decode("ascii")
+        self.batches += 1
+        self.documents += len(pdf_paths)
+        logger.info(f"Lote de {len(pdf_paths)} PDF sellado con una petición a la TSA (raíz {raiz.hex()}).")
+        return [
+            {
+                "version": SEAL_VERSION,
+                "hash": SEAL_HASH,
+                "signed_length": longitud,
+                "leaf_index": i,
+                "batch_size": len(hojas),
+                "proof": merkle_proof(niveles, i),
+                "root": raiz.hex(),
+                "tst": tst,
+            }
+            for i, (_, longitud) in enumerate(hojas)
+        ]
+
+
+def embed_seal(pdf_path: str, seal: dict):
+    """
+    Añade el sello del lote al PDF en una revisión incremental: los bytes
+    firmados no cambian, así que la firma sigue siendo válida.
+    """
+    if os.path.getsize(pdf_path) != seal["signed_length"]:
+        raise ValueError(f"'{pdf_path}' cambió desde que se selló su lote.")
+    with open(pdf_path, "r+b") as f:
+        w = IncrementalPdfFileWriter(f)
+        datos = json.dumps(seal).encode("utf-8")
+        embed.embed_file(
+            w,
+            embed.FileSpec(
+                file_spec_string=SEAL_FILE_NAME,
+                embedded_data=embed.EmbeddedFileObject.from_file_data(w, datos, mime_type="application/json"),
+                description="Prueba de inclusión y sello de tiempo del lote",
+            ),
+        )
+        w.write_in_place()
+
+
+def read_seal(pdf_bytes: bytes) -> dict:
+    """Sello del lote embebido en el PDF."""
+    reader = PdfFileReader(io.BytesIO(pdf_bytes))
+    try:
+        nombres = reader.root["/Names"]["/EmbeddedFiles"]["/Names"]
+    except KeyError:
+        nombres = []
+    for i in range(0, len(nombres), 2):
+        if str(nombres[i]) == SEAL_FILE_NAME:
+            return json.loads(nombres[i + 1]["/EF"]["/F"].data)
+    raise ValueError("El PDF no contiene un sello de lote.")
+
+
+def _fin_de_la_firma(pdf_bytes: bytes) -> int:
+    """Byte en el que termina la revisión cubierta por la última firma."""
+    reader = PdfFileReader(io.BytesIO(pdf_bytes))
+    if not reader.embedded_signatures:
+        raise ValueError("El PDF no está firmado.")
+    rango = reader.embedded_signatures[-1].sig_object["/ByteRange"]
+    return int(rango[2]) + int(rango[3])
+
+
+def verify_sealed_pdf(pdf_bytes: bytes, validation_context=None, require_trusted: bool = True) -> dict:
+    """
+    Comprueba el sello de lote de un PDF: que la hoja es la revisión firmada,
+    que la prueba de inclusión lleva a la raíz y que el sello de tiempo es
+    válido para esa raíz. Lanza `ValueError` si algo no cuadra.
+
+    La cadena del certificado de la TSA se valida con `validation_context`
+    (un `ValidationContext` de pyhanko; por defecto, las raíces del sistema).
+    Si no es de confianza también se lanza `ValueError`, salvo con
+    `require_trusted=False`, que solo lo indica en `trusted`.
+    """
+    sello = read_seal(pdf_bytes)
+    if sello.get("version") != SEAL_VERSION or sello.get("hash") != SEAL_HASH:
+        raise ValueError(f"Sello de lote no soportado: versión {sello.get('version')}, hash {sello.get('hash')}.")
+    if sello["signed_length"] != _fin_de_la_firma(pdf_bytes):
+        raise ValueError("El sello no corresponde a la revisión firmada del PDF.")
+
+    digest = hashlib.sha256(pdf_bytes[: sello["signed_length"]]).digest()
+    raiz = merkle_root_from_proof(digest, sello["proof"])
+    if raiz.hex() != sello["root"]:
+        raise ValueError("La prueba de inclusión no lleva a la raíz del lote.")
+
+    token = cms.ContentInfo.load(base64.b64decode(sello["tst"]))
+    estado = asyncio.run(validate_tst_signed_data(token["content"], validation_context, raiz))
+    if not (estado["intact"] and estado["valid"]):
+        raise ValueError("El sello de tiempo no es válido para la raíz del lote.")
+    confianza = estado["trust_problem_indic"] is None and estado["validation_path"] is not None
+    if require_trusted and not confianza:
+        raise ValueError("El certificado de la TSA no es de confianza.")
+    return {
+        "timestamp": estado["timestamp"],
+        "trusted": confianza,
+        "root": sello["root"],
+        "leaf_index": sello["leaf_index"],
+        "batch_size": sello["batch_size"],
+    }
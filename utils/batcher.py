@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedBatcher:
+    """
+    Agrupa elementos por clave durante una ventana corta y los entrega en
+    lotes a `flush_fn(items) -> resultados` (un resultado por elemento, en
+    el mismo orden). Un lote sale al llegar a `max_items` elementos o cuando
+    su elemento más antiguo lleva `max_delay_ms` esperando. Los lotes se
+    ejecutan en `executor`, así que varios pueden estar en vuelo a la vez.
+    """
+
+    def __init__(self, flush_fn, executor, max_items: int = 100, max_delay_ms: float = 50, name: str = "batcher"):
+        self._flush_fn = flush_fn
+        self._executor = executor
+        self._max_items = max_items
+        self._max_delay = max_delay_ms / 1000
+        self._name = name
+        self._grupos = {}  # clave -> (límite, [(item, future)])
+        self._cond = threading.Condition()
+        self._detener = False
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Entrega lo pendiente y detiene el hilo agrupador."""
+        if self._thread is not None:
+            with self._cond:
+                self._detener = True
+                self._cond.notify()
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, key, item) -> Future:
+        future = Future()
+        with self._cond:
+            limite, pendientes = self._grupos.setdefault(key, (time.monotonic() + self._max_delay, []))
+            pendientes.append((item, future))
+            # Un grupo nuevo trae un plazo que el hilo aún no espera
+            if len(pendientes) == 1 or len(pendientes) >= self._max_items:
+                self._cond.notify()
+        return future
+
+    def stats(self) -> dict:
+        with self._cond:
+            pendientes = sum(len(p) for _, p in self._grupos.values())
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "pending": pendientes,
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    ahora = time.monotonic()
+                    listos = [
+                        clave for clave, (limite, pendientes) in self._grupos.items()
+                        if self._detener or limite <= ahora or len(pendientes) >= self._max_items
+                    ]
+                    if listos or self._detener:
+                        break
+                    proximo = min((limite for limite, _ in self._grupos.values()), default=None)
+                    self._cond.wait(None if proximo is None else proximo - ahora)
+                lotes = []
+                for clave in listos:
+                    _, pendientes = self._grupos.pop(clave)
+                    # Un grupo mayor que el máximo se parte en varios lotes
+                    for i in range(0, len(pendientes), self._max_items):
+                        lotes.append(pendientes[i:i + self._max_items])
+                detener = self._detener and not self._grupos
+            for lote in lotes:
+                self._executor.submit(self._entregar, lote)
+            if detener:
+                return
+
+    def _entregar(self, lote: list):
+        lote = [(item, future) for item, future in lote if future.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        try:
+            resultados = self._flush_fn([item for item, _ in lote])
+        except Exception as e:
+            logger.error(f"Fallo al entregar un lote de {len(lote)} elementos ({type(e).__name__}): {e}")
+            for _, future in lote:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(lote)
+        for (_, future), resultado in zip(lote, resultados):
+            future.set_result(resultado)
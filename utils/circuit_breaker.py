@@ -0,0 +1,265 @@
+import os
+import logging
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from utils.shared_state import SharedState
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- Circuit breaker de la API del proveedor de SMS ---
+# Se abre cuando, en los últimos CIRCUIT_WINDOW segundos y con al menos
+# CIRCUIT_MIN_CALLS envíos, la proporción de errores (5xx, timeouts, red) o de
+# envíos lentos supera su umbral. Abierto no deja pasar envíos durante
+# CIRCUIT_OPEN_SECONDS; después (semiabierto) deja pasar una sonda cada
+# CIRCUIT_PROBE_INTERVAL segundos y se cierra tras CIRCUIT_PROBE_SUCCESSES
+# sondas correctas seguidas. Los procesos de worker_resend comparten el estado.
+CIRCUIT_ENABLED = os.getenv("CIRCUIT_ENABLED", "true").lower() in ("1", "true", "yes")
+CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", 30))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 20))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", 0.5))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", 5))
+CIRCUIT_SLOW_RATE = float(os.getenv("CIRCUIT_SLOW_RATE", 0.8))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+CIRCUIT_PROBE_INTERVAL = float(os.getenv("CIRCUIT_PROBE_INTERVAL", 2))
+CIRCUIT_PROBE_SUCCESSES = int(os.getenv("CIRCUIT_PROBE_SUCCESSES", 3))
+# Cada proceso cuenta sus envíos en memoria y publica sus cuentas (y lee las de
+# los demás) cada CIRCUIT_SYNC_INTERVAL segundos; los cambios de estado se
+# escriben en el fichero en el momento.
+CIRCUIT_SYNC_INTERVAL = float(os.getenv("CIRCUIT_SYNC_INTERVAL", 1))
+CIRCUIT_STATE_FILE = os.getenv(
+    "CIRCUIT_STATE_FILE",
+    os.path.join(tempfile.gettempdir(), "sms_provider_circuit.json"),
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por proporción de errores y de latencia. Es thread-safe
+    y, con `state_file`, compartido entre procesos.
+
+    Con el breaker cerrado (o abierto y sin caducar) cada envío solo toca
+    memoria: el fichero se lee y escribe al cambiar de estado, al sincronizar
+    cada `sync_interval` segundos y, con el breaker semiabierto, en las sondas.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        state_file: str = None,
+        window: int = CIRCUIT_WINDOW,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        error_rate: float = CIRCUIT_ERROR_RATE,
+        slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+        slow_rate: float = CIRCUIT_SLOW_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        probe_interval: float = CIRCUIT_PROBE_INTERVAL,
+        probe_successes: int = CIRCUIT_PROBE_SUCCESSES,
+        sync_interval: float = CIRCUIT_SYNC_INTERVAL,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probe_interval = probe_interval
+        self.probe_successes = probe_successes
+        self.sync_interval = sync_interval
+        self._estado = SharedState(state_file, self._estado_inicial)
+        # Copia en memoria del estado compartido y cuentas de este proceso
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._since = None
+        self._last_probe = 0.0
+        self._buckets = {}  # segundo -> [envíos, errores, lentos]
+        self._otros = [0, 0, 0]  # lo mismo, sumado, de los demás procesos
+        self._rejected = 0  # rechazos aún sin publicar
+        self._proxima_sync = 0.0
+
+    @staticmethod
+    def _estado_inicial() -> dict:
+        return {
+            "state": CLOSED,
+            "since": time.time(),
+            "procesos": {},  # pid -> cuentas por segundo publicadas por el proceso
+            "last_probe": 0.0,
+            "probe_ok": 0,
+            "opened": 0,
+            "rejected": 0,
+        }
+
+    def _cambiar(self, estado: dict, nuevo: str, ahora: float):
+        anterior = estado["state"]
+        estado.update(state=nuevo, since=ahora, probe_ok=0, last_probe=0.0)
+        if nuevo == OPEN:
+            estado["opened"] += 1
+            estado["procesos"] = {}
+            logger.error(f"Circuit breaker '{self.name}' abierto ({anterior} -> {nuevo}).")
+        else:
+            logger.warning(f"Circuit breaker '{self.name}': {anterior} -> {nuevo}.")
+
+    def _adoptar(self, estado: dict):
+        """Copia en memoria el estado del fichero (tras leerlo o cambiarlo)."""
+        if (estado["state"], estado["since"]) != (self._state, self._since):
+            # Las cuentas de un periodo anterior ya no cuentan
+            self._state, self._since = estado["state"], estado["since"]
+            self._buckets = {}
+        self._last_probe = estado["last_probe"]
+
+    def _vigentes(self, buckets: dict, ahora: float) -> dict:
+        limite = int(ahora) - self.window
+        return {s: cuenta for s, cuenta in buckets.items() if int(s) > limite}
+
+    def _sincronizar(self, ahora: float) -> dict:
+        """
+        Publica las cuentas y los rechazos de este proceso, recoge las de los
+        demás y adopta el estado del fichero. Se llama con `self._lock`.
+        """
+        proceso = str(os.getpid())
+        with self._estado.lock() as estado:
+            self._adoptar(estado)
+            self._buckets = self._vigentes(self._buckets, ahora)
+            procesos = {}
+            otros = [0, 0, 0]
+            for pid, buckets in estado.setdefault("procesos", {}).items():
+                buckets = self._vigentes(buckets, ahora)
+                if pid == proceso or not buckets:
+                    continue
+                procesos[pid] = buckets
+                for cuenta in buckets.values():
+                    otros = [a + b for a, b in zip(otros, cuenta)]
+            if self._buckets:
+                procesos[proceso] = self._buckets
+            estado["procesos"] = procesos
+            estado["rejected"] += self._rejected
+            self._otros = otros
+            self._rejected = 0
+        self._proxima_sync = ahora + self.sync_interval
+        return estado
+
+    def allow_request(self) -> bool:
+        """Indica si se puede intentar un envío ahora."""
+        ahora = time.time()
+        with self._lock:
+            if ahora >= self._proxima_sync:
+                self._sincronizar(ahora)
+            if self._state == CLOSED:
+                return True
+            if (self._state == OPEN and ahora - self._since < self.open_seconds) or (
+                self._state == HALF_OPEN and ahora - self._last_probe < self.probe_interval
+            ):
+                self._rejected += 1
+                return False
+
+            # Apertura caducada o sonda posible: se decide en el fichero
+            with self._estado.lock() as estado:
+                if estado["state"] == OPEN and ahora - estado["since"] >= self.open_seconds:
+                    self._cambiar(estado, HALF_OPEN, ahora)
+                if estado["state"] == CLOSED:
+                    permitido = True
+                elif estado["state"] == HALF_OPEN and ahora - estado["last_probe"] >= self.probe_interval:
+                    # Sonda: un único envío de prueba por intervalo entre todos los procesos
+                    estado["last_probe"] = ahora
+                    permitido = True
+                else:
+                    estado["rejected"] += 1
+                    permitido = False
+                self._adoptar(estado)
+            return permitido
+
+    def retry_after(self) -> float:
+        """Segundos hasta que el breaker vuelva a dejar pasar algún envío."""
+        with self._lock:
+            ahora = time.time()
+            if self._state == OPEN:
+                return max(0.0, self._since + self.open_seconds - ahora)
+            if self._state == HALF_OPEN:
+                return max(0.0, self._last_probe + self.probe_interval - ahora)
+            return 0.0
+
+    def record(self, ok: bool, duration: float):
+        """Registra el resultado de un envío intentado y su duración en segundos."""
+        lento = duration >= self.slow_call_seconds
+        with self._lock:
+            ahora = time.time()
+            if self._state == OPEN:
+                # Respuesta tardía de un envío anterior a la apertura
+                return
+            if self._state == HALF_OPEN:
+                with self._estado.lock() as estado:
+                    if estado["state"] == HALF_OPEN:
+                        if not ok or lento:
+                            self._cambiar(estado, OPEN, ahora)
+                        else:
+                            estado["probe_ok"] += 1
+                            if estado["probe_ok"] >= self.probe_successes:
+                                self._cambiar(estado, CLOSED, ahora)
+                    self._adoptar(estado)
+                return
+
+            buckets = self._vigentes(self._buckets, ahora)
+            cuenta = buckets.setdefault(str(int(ahora)), [0, 0, 0])
+            cuenta[0] += 1
+            cuenta[1] += 0 if ok else 1
+            cuenta[2] += 1 if lento else 0
+            self._buckets = buckets
+
+            # Cuentas propias al día y las de los demás procesos de la última sincronización
+            envios, errores, lentos = self._otros
+            for c in buckets.values():
+                envios, errores, lentos = envios + c[0], errores + c[1], lentos + c[2]
+            if envios < self.min_calls:
+                return
+            errores, lentos = errores / envios, lentos / envios
+            if errores >= self.error_rate or lentos >= self.slow_rate:
+                with self._estado.lock() as estado:
+                    # Si otro proceso ya cambió el estado, se adopta sin más
+                    if (estado["state"], estado["since"]) == (CLOSED, self._since):
+                        logger.error(
+                            f"Circuit breaker '{self.name}': {errores:.0%} de errores y "
+                            f"{lentos:.0%} de envíos lentos en {envios} envíos."
+                        )
+                        self._cambiar(estado, OPEN, ahora)
+                    self._adoptar(estado)
+
+    def stats(self) -> dict:
+        with self._lock:
+            estado = self._sincronizar(time.time())
+            envios, errores, lentos = self._otros
+            for c in self._buckets.values():
+                envios, errores, lentos = envios + c[0], errores + c[1], lentos + c[2]
+            return {
+                "state": estado["state"],
+                "since": round(estado["since"], 3),
+                "window_calls": envios,
+                "window_errors": errores,
+                "window_slow": lentos,
+                "opened": estado["opened"],
+                "rejected": estado["rejected"],
+                "shared": self._estado.shared,
+            }
+
+
+_provider_breaker = None
+_provider_breaker_lock = threading.Lock()
+
+
+def get_provider_breaker():
+    """Circuit breaker compartido de la API del proveedor, o `None` si está desactivado."""
+    global _provider_breaker
+    if not CIRCUIT_ENABLED:
+        return None
+    with _provider_breaker_lock:
+        if _provider_breaker is None:
+            _provider_breaker = CircuitBreaker("sms_provider", state_file=CIRCUIT_STATE_FILE)
+        return _provider_breaker
@@ -1,6 +1,26 @@
+import os
+from typing import NamedTuple, Optional
+
 from sqlalchemy.orm import Session
 from models.clients import Cliente
 from schemas.client import Client as ClientSchema
+from utils.cache import TTLCache, MISSING
+
+# --- Caché de clientes por sender ---
+# Un puñado de senders genera casi todo el tráfico de /receive_sms, así que
+# sus datos se cachean en memoria. Las búsquedas negativas se cachean menos
+# tiempo para que un cliente recién creado en otro proceso se vea pronto.
+CLIENTE_CACHE_MAXSIZE = int(os.getenv("CLIENTE_CACHE_MAXSIZE", 2048))
+CLIENTE_CACHE_TTL = float(os.getenv("CLIENTE_CACHE_TTL", 300))
+CLIENTE_CACHE_NEGATIVE_TTL = float(os.getenv("CLIENTE_CACHE_NEGATIVE_TTL", 10))
+
+cliente_cache = TTLCache(maxsize=CLIENTE_CACHE_MAXSIZE, ttl=CLIENTE_CACHE_TTL)
+
+
+class DatosCliente(NamedTuple):
+    email_cliente: str
+    ftp_directorio: str
+
 
 def create_client(db: Session, client: ClientSchema):
     db_client = Cliente(
@@ -16,6 +36,51 @@ def create_client(db: Session, client: ClientSchema):
 def get_client_by_sender(db: Session, sender: str):
     return db.query(Cliente).filter(Cliente.sender == sender).first()
 
+def get_client_data_cached(db: Session, sender: str) -> Optional[DatosCliente]:
+    """Datos del cliente para `sender` pasando por la caché; `None` si no existe."""
+    datos = cliente_cache.get(sender)
+    if datos is not MISSING:
+        return datos
+    client = get_client_by_sender(db, sender)
+    if client:
+        datos = DatosCliente(client.email_cliente, client.ftp_directorio)
+        cliente_cache.set(sender, datos)
+    else:
+        datos = None
+        cliente_cache.set(sender, None, ttl=CLIENTE_CACHE_NEGATIVE_TTL)
+    return datos
+
+def get_clients_data_cached(db: Session, senders) -> dict:
+    """
+    Resuelve varios senders a la vez: los que no están en caché se buscan con
+    una única consulta `IN`. Devuelve `{sender: DatosCliente | None}`.
+    """
+    resultado = {}
+    pendientes = []
+    for sender in set(senders):
+        datos = cliente_cache.get(sender)
+        if datos is MISSING:
+            pendientes.append(sender)
+        else:
+            resultado[sender] = datos
+    if pendientes:
+        encontrados = (
+            db.query(Cliente.sender, Cliente.email_cliente, Cliente.ftp_directorio)
+            .filter(Cliente.sender.in_(pendientes))
+            .all()
+        )
+        for sender, email_cliente, ftp_directorio in encontrados:
+            resultado[sender] = DatosCliente(email_cliente, ftp_directorio)
+            cliente_cache.set(sender, resultado[sender])
+        for sender in pendientes:
+            if sender not in resultado:
+                resultado[sender] = None
+                cliente_cache.set(sender, None, ttl=CLIENTE_CACHE_NEGATIVE_TTL)
+    return resultado
+
+def invalidate_client_cache(sender: str):
+    cliente_cache.invalidate(sender)
+
 def read_clients(db: Session, skip: int = 0, limit: int = 100):
     return db.query(Cliente).offset(skip).limit(limit).all()
 
@@ -0,0 +1,177 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import false, update
+from sqlalchemy.orm import Session
+
+from models.clients import SmsIncoming
+from models.dlr import SmsDlrPart
+from models.status import SmsStatus
+from productorRabbitmq import CERTIFICACION_PDF_QUEUE, DLR_FORWARD_QUEUE
+from schemas.dlr import DLRWebhookPayload
+from utils.outbox import enqueue_rows, outbox_row
+from utils.sms_status import transition_loaded
+
+logger = logging.getLogger(__name__)
+
+# Códigos de estado de entrega que espera el DLRListener del vendor
+STATUS_DLR_SERVER = {
+    "Delivered": 2,
+    "Expired": 3,
+    "Deleted": 4,
+    "Undeliverd": 5,
+    "Accepted": 6,
+    "Invalid": 7,
+    "Rejected": 8
+}
+
+# Códigos de error de la respuesta del DLRListener
+STATUS_DLR_RESPONSE = {
+    0: "Ok",
+    1: "Invalid Credentials",
+    3: "Invalid Query String Parameters",
+    10: "Internal Server Error"
+}
+
+
+def build_dlr_params(message: SmsIncoming, event: str) -> dict:
+    """
+    Parámetros del DLR que se reenvía al vendor. Se construyen al recibir el
+    DLR del proveedor, así que `dateReceived` no depende de cuándo se reenvíe.
+    """
+    return {
+        'username': message.sub_account,
+        'password': message.sub_account_pass,
+        'sender': message.sender,
+        'destination': message.receiver,
+        'messageId': message.message_id,
+        # Se usa un espacio normal
+        'dateReceived': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+        'description': event,
+        # Puede ser un número o un string '2'
+        'deliveryStatus': STATUS_DLR_SERVER.get(event.lower().capitalize())
+    }
+
+
+def load_parts(db: Session, message_ids) -> dict:
+    """Partes ya registradas, `{message_id: {part_num: SmsDlrPart}}`, con una consulta."""
+    partes = {}
+    if message_ids:
+        for parte in db.query(SmsDlrPart).filter(SmsDlrPart.message_id.in_(set(message_ids))):
+            partes.setdefault(parte.message_id, {})[parte.part_num] = parte
+    return partes
+
+
+def _estado_agregado(partes: dict, num_parts: int):
+    """
+    Estado final del mensaje si todas sus partes están en un estado final
+    (DELIVERED solo si lo están todas), o `None` si aún faltan partes.
+    """
+    estados = [SmsStatus.from_label(partes[n].status) for n in range(1, num_parts + 1) if n in partes]
+    if len(estados) < num_parts or not all(e is not None and e.is_terminal for e in estados):
+        return None
+    return next((e for e in estados if e != SmsStatus.DELIVERED), SmsStatus.DELIVERED)
+
+
+def claim_pdf(db: Session, message_id: str) -> bool:
+    """
+    Marca la certificación PDF del mensaje como encolada. Es un UPDATE
+    condicional: solo una transacción puede ganarlo, aunque lleguen a la vez
+    DLR repetidos por procesos distintos.
+    """
+    result = db.execute(
+        update(SmsIncoming)
+        .where(SmsIncoming.message_id == message_id, SmsIncoming.pdf_requested == false())
+        .values(pdf_requested=True)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def apply_dlr(db: Session, message: SmsIncoming, payload: DLRWebhookPayload, partes: dict = None) -> list:
+    """
+    Registra el DLR de una parte y hace avanzar el estado del mensaje según
+    `utils.sms_status.TRANSITIONS`. Devuelve las filas del outbox que genera:
+    el reenvío del DLR al vendor cuando el estado cambia y, una sola vez, la certificación PDF cuando el mensaje
+    queda entregado. No hace commit.
+
+    En un SMS concatenado el estado solo pasa a final cuando todas las partes
+    han llegado a un estado final. `partes` son las ya cargadas con `load_parts`.
+    """
+    # Un mensaje en estado final ya no cambia: los DLR tardíos o repetidos se
+    # descartan sin escribir nada.
+    if SmsStatus(message.status_code).is_terminal:
+        logger.info(f"DLR tardío para el mensaje ya finalizado {message.message_id}. Se ignora.")
+        return []
+    evento = SmsStatus.from_label(payload.event)
+    if evento is None:
+        logger.warning(f"Evento de DLR desconocido '{payload.event}' para el mensaje {message.message_id}. Se ignora.")
+        return []
+
+    num_parts = max(payload.numParts, 1)
+    if num_parts == 1:
+        nuevo_estado = evento
+    else:
+        if partes is None:
+            partes = load_parts(db, [message.message_id]).get(message.message_id, {})
+        parte = partes.get(payload.partNum)
+        if parte is None:
+            parte = SmsDlrPart(message_id=message.message_id, part_num=payload.partNum)
+            db.add(parte)
+            partes[payload.partNum] = parte
+        parte.num_parts = num_parts
+        parte.status = evento.name
+        logger.info(
+            f"DLR de la parte {payload.partNum}/{num_parts} del mensaje {message.message_id}: '{evento.name}'"
+        )
+        nuevo_estado = _estado_agregado(partes, num_parts)
+        if nuevo_estado is None:
+            if evento.is_terminal:
+                return []
+            # Estados intermedios (ACCEPTED...) mientras no haya uno final
+            nuevo_estado = evento
+
+    # Transición monotónica con un UPDATE condicional; si no procede es un no-op
+    if not transition_loaded(db, message, nuevo_estado):
+        return []
+    logger.info(f"Estado del mensaje {message.message_id} actualizado a '{nuevo_estado.label}'")
+    tareas = [outbox_row(DLR_FORWARD_QUEUE, build_dlr_params(message, nuevo_estado.name))]
+
+    if nuevo_estado == SmsStatus.DELIVERED and claim_pdf(db, message.message_id):
+        logger.info(
+            f"Mensaje {message.message_id} entregado exitosamente al destinatario, agregando a la cola de generación de PDF."
+        )
+        tareas.append(outbox_row(CERTIFICACION_PDF_QUEUE, {"db_message_id": message.message_id}))
+    return tareas
+
+
+def apply_dlr_batch(db: Session, payloads: list) -> list:
+    """
+    Aplica un lote de DLR con una consulta `IN` por provider_id, otra para las
+    partes ya registradas y un único executemany en el outbox. No hace commit.
+    Devuelve los msgId que no corresponden a ningún mensaje.
+    """
+    provider_ids = {payload.msgId for payload in payloads}
+    mensajes = {
+        sms.provider_id: sms
+        for sms in db.query(SmsIncoming).filter(SmsIncoming.provider_id.in_(provider_ids))
+    }
+    partes = load_parts(
+        db,
+        [
+            mensajes[payload.msgId].message_id
+            for payload in payloads
+            if payload.numParts > 1 and payload.msgId in mensajes
+        ],
+    )
+
+    tareas, no_encontrados = [], []
+    # En orden de llegada: las partes de un mismo mensaje se aplican en secuencia
+    for payload in payloads:
+        sms = mensajes.get(payload.msgId)
+        if sms is None:
+            no_encontrados.append(payload.msgId)
+            continue
+        tareas.extend(apply_dlr(db, sms, payload, partes.setdefault(sms.message_id, {})))
+    enqueue_rows(db, tareas)
+    return no_encontrados
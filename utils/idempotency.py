@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from models.ingest import IngestRequest
+from utils.cache import TTLCache, MISSING
+
+# --- Configuración de idempotencia ---
+# Ventana durante la que una petición repetida devuelve la respuesta original.
+IDEMPOTENCY_WINDOW_SECONDS = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", 300))
+# Sin clave del cliente, deduplicar por hash de (sender, recipients, message, sub_account)
+IDEMPOTENCY_HASH_ENABLED = os.getenv("IDEMPOTENCY_HASH_ENABLED", "true").lower() in ("1", "true", "yes")
+IDEMPOTENCY_CACHE_MAXSIZE = int(os.getenv("IDEMPOTENCY_CACHE_MAXSIZE", 10000))
+
+# Claves recientes de este proceso: un reintento inmediato no toca la BBDD
+recent_responses = TTLCache(
+    maxsize=IDEMPOTENCY_CACHE_MAXSIZE, ttl=IDEMPOTENCY_WINDOW_SECONDS
+)
+
+
+def idempotency_key(sub_account: str, client_key: Optional[str], *contenido) -> Optional[str]:
+    """
+    Clave de idempotencia de una petición: la clave del cliente (acotada a su
+    subcuenta) o, si no la envía, un hash del contenido de la petición.
+    """
+    if client_key:
+        partes = ("client", sub_account or "", client_key)
+    elif IDEMPOTENCY_HASH_ENABLED:
+        partes = ("content", sub_account or "", *contenido)
+    else:
+        return None
+    return hashlib.sha256("\x1f".join(map(str, partes)).encode("utf-8")).hexdigest()
+
+
+def batch_idempotency_key(client_key: Optional[str], body: bytes) -> Optional[str]:
+    """
+    Clave de idempotencia de `/receive_sms/batch`. Un lote puede mezclar
+    subcuentas, así que la clave del cliente se acota al hash del cuerpo (que
+    incluye las subcuentas y sus credenciales): dos clientes con el mismo
+    `Idempotency-Key` no reciben la respuesta del otro.
+    """
+    digest = hashlib.sha256(body).hexdigest()
+    return idempotency_key(f"batch:{digest}", client_key, digest)
+
+
+def get_cached_response(key: Optional[str]):
+    """Respuesta original desde la caché del proceso, o `MISSING`."""
+    if key is None:
+        return MISSING
+    return recent_responses.get(key)
+
+
+def get_stored_response(db: Session, key: Optional[str]) -> Optional[dict]:
+    """Respuesta original guardada en la BBDD si sigue dentro de la ventana; si no, `None`."""
+    if key is None:
+        return None
+    previa = db.get(IngestRequest, key)
+    if previa is None:
+        return None
+    limite = datetime.now() - timedelta(seconds=IDEMPOTENCY_WINDOW_SECONDS)
+    if previa.created_at is not None and previa.created_at.replace(tzinfo=None) < limite:
+        # Fuera de la ventana: la clave queda libre para la nueva petición
+        db.delete(previa)
+        db.commit()
+        return None
+    response = json.loads(previa.response)
+    recent_responses.set(key, response)
+    return response
+
+
+def ingest_row(key: str, response: dict) -> dict:
+    return {
+        "idempotency_key": key,
+        "response": json.dumps(response),
+        "created_at": datetime.now(),
+    }
+
+
+def remember(key: Optional[str], response: dict):
+    if key is not None:
+        recent_responses.set(key, response)
+
+
+def purge_expired(db: Session) -> int:
+    """Elimina las claves fuera de la ventana. Devuelve cuántas se borraron."""
+    limite = datetime.now() - timedelta(seconds=IDEMPOTENCY_WINDOW_SECONDS)
+    borradas = (
+        db.query(IngestRequest)
+        .filter(IngestRequest.created_at < limite)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return borradas
@@ -0,0 +1,69 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.schema import CreateColumn
+
+logger = logging.getLogger(__name__)
+
+
+def apply_migrations(engine, metadata):
+    """
+    Migraciones idempotentes para bases de datos creadas con versiones
+    anteriores de los modelos. `create_all` crea las tablas nuevas, pero no
+    añade a las tablas existentes las columnas ni los índices declarados después.
+    Se ejecuta en cada arranque; lo ya aplicado no se vuelve a tocar.
+    """
+    inspector = inspect(engine)
+    tablas = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in tablas:
+            continue
+        _add_missing_columns(engine, inspector, table)
+        _add_missing_indexes(engine, inspector, table)
+
+
+def _add_missing_columns(engine, inspector, table):
+    # Las columnas nuevas deben ser anulables o tener un server_default
+    existentes = {col["name"] for col in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existentes:
+            continue
+        definicion = CreateColumn(column).compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definicion}"))
+            rellenar = _BACKFILLS.get((table.name, column.name))
+            if rellenar is not None:
+                rellenar(conn)
+        logger.info(f"Migración aplicada: columna '{column.name}' añadida a '{table.name}'.")
+
+
+def _backfill_status_code(conn):
+    """Traduce el `status` en texto de las filas existentes a `status_code`."""
+    from models.status import SmsStatus
+
+    for estado in SmsStatus:
+        conn.execute(
+            text("UPDATE sms_incoming SET status_code = :code WHERE UPPER(status) = :label"),
+            {"code": int(estado), "label": estado.name},
+        )
+
+
+# Datos que hay que rellenar al añadir una columna a una tabla existente
+_BACKFILLS = {
+    ("sms_incoming", "status_code"): _backfill_status_code,
+}
+
+
+def _add_missing_indexes(engine, inspector, table):
+    existentes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name in existentes:
+            continue
+        try:
+            index.create(bind=engine)
+            logger.info(f"Migración aplicada: índice '{index.name}' creado en '{table.name}'.")
+        except (IntegrityError, OperationalError) as e:
+            # Un índice único no se puede crear si ya hay duplicados: se
+            # avisa y se sigue arrancando, los datos deben limpiarse a mano.
+            logger.error(f"No se pudo crear el índice '{index.name}' en '{table.name}': {e}")
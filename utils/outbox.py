@@ -0,0 +1,49 @@
+import os
+import json
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models.outbox import OutboxMessage
+from utils.task_codec import TASK_SCHEMA_VERSION
+
+# Tareas de reenvío "completas": llevan los datos del SMS para que
+# worker_resend no tenga que leerlo de la BBDD antes de enviarlo.
+RESEND_FAT_MESSAGES = os.getenv("RESEND_FAT_MESSAGES", "true").lower() in ("1", "true", "yes")
+
+
+def enqueue_task(db: Session, queue_name: str, body: dict):
+    """
+    Añade una tarea al outbox. No hace commit: la tarea se confirma junto con
+    el resto de cambios de la sesión y la publica después `relay_outbox.py`.
+    """
+    db.add(OutboxMessage(queue=queue_name, payload=json.dumps(body)))
+
+
+def enqueue_rows(db: Session, rows: list):
+    """Inserta en bloque (un solo executemany) filas creadas con `outbox_row`."""
+    if rows:
+        db.execute(insert(OutboxMessage), rows)
+
+
+def outbox_row(queue_name: str, body: dict) -> dict:
+    return {"queue": queue_name, "payload": json.dumps(body), "attempts": 0}
+
+
+def resend_task(
+    message_id: str,
+    email_cliente: str,
+    ftp_directorio: str,
+    sender: str = None,
+    receiver: str = None,
+    text: str = None,
+) -> dict:
+    task = {
+        "db_message_id": message_id,
+        "email_cliente": email_cliente,
+        "ftp_directorio": ftp_directorio,
+    }
+    if RESEND_FAT_MESSAGES and sender is not None:
+        task.update(v=TASK_SCHEMA_VERSION, sender=sender, receiver=receiver, text=text)
+    return task
+
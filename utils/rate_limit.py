@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Control de admisión en la ingesta ---
+# Cubos de tokens por sub_account y por sender: RATE en SMS por segundo y
+# BURST como ráfaga máxima. Un valor de RATE <= 0 desactiva ese límite.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+SUB_ACCOUNT_RATE = float(os.getenv("SUB_ACCOUNT_RATE", 100))
+SUB_ACCOUNT_BURST = float(os.getenv("SUB_ACCOUNT_BURST", 1000))
+SENDER_RATE = float(os.getenv("SENDER_RATE", 50))
+SENDER_BURST = float(os.getenv("SENDER_BURST", 500))
+# Máximo de cubos en memoria; se descartan los menos usados (vuelven llenos).
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))
+
+
+class TokenBucketLimiter:
+    """
+    Conjunto de cubos de tokens en memoria, uno por clave. Es thread-safe y
+    lleva contadores de SMS admitidos y rechazados para exponerlos como métricas.
+    """
+
+    def __init__(self, rate: float, burst: float, maxsize: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.maxsize = maxsize
+        # clave -> [tokens, instante de la última recarga]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    def _recargar(self, key, ahora: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, ahora]
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (ahora - bucket[1]) * self.rate)
+            bucket[1] = ahora
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, key, cost: float = 1) -> float:
+        """
+        Consume `cost` tokens del cubo de `key`. Devuelve 0 si se admite o los
+        segundos que faltan para poder admitirlo.
+
+        Una petición mayor que la ráfaga (una campaña de miles de destinatarios)
+        se admite con el cubo lleno y lo deja en negativo: las siguientes
+        esperan a que se recupere, así que el ritmo medio se respeta igual.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._recargar(key, time.monotonic())
+            necesarios = min(cost, self.burst)
+            if bucket[0] >= necesarios:
+                bucket[0] -= cost
+                self.allowed += cost
+                return 0.0
+            self.throttled += cost
+            return (necesarios - bucket[0]) / self.rate
+
+    def refund(self, key, cost: float = 1):
+        """Devuelve tokens consumidos por SMS que al final no se admitieron."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+            self.allowed -= cost
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.allowed + self.throttled
+            return {
+                "allowed": self.allowed,
+                "throttled": self.throttled,
+                "throttle_ratio": round(self.throttled / total, 4) if total else 0.0,
+                "rate": self.rate,
+                "burst": self.burst,
+                "keys": len(self._buckets),
+            }
+
+
+sub_account_limiter = TokenBucketLimiter(SUB_ACCOUNT_RATE, SUB_ACCOUNT_BURST, RATE_LIMIT_MAX_KEYS)
+sender_limiter = TokenBucketLimiter(SENDER_RATE, SENDER_BURST, RATE_LIMIT_MAX_KEYS)
+
+
+def admit(sub_account: str, sender: str, cost: int = 1) -> float:
+    """
+    Comprueba los límites de la sub_account y del sender para `cost` SMS (uno
+    por destinatario). Devuelve 0 si se admite o los segundos de espera
+    sugeridos; un rechazo no consume tokens de ninguno de los dos cubos.
+    """
+    if not RATE_LIMIT_ENABLED or cost <= 0:
+        return 0.0
+    espera = sub_account_limiter.acquire(sub_account, cost)
+    if espera:
+        return espera
+    espera = sender_limiter.acquire(sender, cost)
+    if espera:
+        sub_account_limiter.refund(sub_account, cost)
+    return espera
+
+
+def release(sms_rows: list):
+    """
+    Devuelve a los cubos los tokens de SMS admitidos que al final no se
+    guardaron (p. ej. porque falló el insert).
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    for (sub_account, sender), cost in Counter(
+        (row["sub_account"], row["sender"]) for row in sms_rows
+    ).items():
+        sub_account_limiter.refund(sub_account, cost)
+        sender_limiter.refund(sender, cost)
+
+
+def stats() -> dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "sub_account": sub_account_limiter.stats(),
+        "sender": sender_limiter.stats(),
+    }
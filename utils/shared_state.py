@@ -0,0 +1,56 @@
+import json
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+
+    FLOCK_AVAILABLE = True
+except ImportError:
+    # Sin flock (Windows) el estado no se comparte entre procesos
+    FLOCK_AVAILABLE = False
+
+
+class SharedState:
+    """
+    Diccionario JSON pequeño compartido por los hilos de un proceso y, si se
+    indica `path` y hay flock, por todos los procesos del host que usen el
+    mismo fichero. Sin fichero el estado vive solo en memoria.
+    """
+
+    def __init__(self, path: str, initial):
+        """
+        :param path: Fichero del estado, o `None` para no compartirlo.
+        :param initial: Función que devuelve el estado inicial.
+        """
+        self.path = path if FLOCK_AVAILABLE else None
+        self.initial = initial
+        self._lock = threading.Lock()
+        self._memoria = initial()
+
+    @property
+    def shared(self) -> bool:
+        return self.path is not None
+
+    @contextmanager
+    def lock(self):
+        """Estado bloqueado en exclusiva; los cambios se guardan al salir."""
+        with self._lock:
+            if self.path is None:
+                yield self._memoria
+                return
+            with open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        estado = json.loads(f.read() or "null") or self.initial()
+                    except ValueError:
+                        estado = self.initial()
+                    yield estado
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(estado))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,63 @@
+import os
+import logging
+import threading
+
+from pyhanko.sign import signers
+
+logger = logging.getLogger(__name__)
+
+
+class SigningContext:
+    """
+    Firmante PKCS#12, metadatos y sellador de tiempo de un worker. Descifrar
+    el PKCS#12 y parsear la clave y la cadena es caro, así que se hace una vez
+    y el `PdfSigner` resultante se reutiliza para todos los documentos.
+
+    Si el fichero del certificado cambia en disco (mtime o tamaño), se recarga
+    antes de la siguiente firma. Si la recarga falla (p. ej. el fichero se está
+    copiando) se sigue firmando con el certificado anterior y se reintenta en
+    la siguiente firma.
+    """
+
+    def __init__(self, pkcs12_path: str, passphrase: str, signature_meta, timestamper=None):
+        self.pkcs12_path = pkcs12_path
+        self._passphrase = passphrase.encode("utf-8") if passphrase else None
+        self.signature_meta = signature_meta
+        self.timestamper = timestamper
+        self._lock = threading.Lock()
+        self._pdf_signer = None
+        self._firma_fichero = None
+        self.loads = 0
+        self._cargar(self._leer_firma_fichero())
+
+    def _leer_firma_fichero(self):
+        stat = os.stat(self.pkcs12_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _cargar(self, firma_fichero):
+        signer = signers.SimpleSigner.load_pkcs12(
+            pfx_file=self.pkcs12_path, passphrase=self._passphrase
+        )
+        if signer is None:
+            # pyhanko devuelve None (y lo registra) si no puede leer el PKCS#12
+            raise ValueError(f"No se pudo cargar el certificado '{self.pkcs12_path}'.")
+        self._pdf_signer = signers.PdfSigner(
+            self.signature_meta, signer, timestamper=self.timestamper
+        )
+        self._firma_fichero = firma_fichero
+        self.loads += 1
+        logger.info(f"Certificado de firma cargado desde '{self.pkcs12_path}'.")
+
+    def pdf_signer(self) -> signers.PdfSigner:
+        """`PdfSigner` listo para firmar; recarga el certificado si cambió en disco."""
+        with self._lock:
+            try:
+                firma_fichero = self._leer_firma_fichero()
+                if firma_fichero != self._firma_fichero:
+                    self._cargar(firma_fichero)
+            except Exception as e:
+                logger.error(
+                    f"No se pudo recargar el certificado '{self.pkcs12_path}': {e}. "
+                    "Se sigue usando el anterior."
+                )
+            return self._pdf_signer
@@ -0,0 +1,207 @@
+import os
+import re
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models.clients import SmsIncoming
+from models.ingest import IngestRequest
+from models.status import SmsStatus
+from utils.cache import TTLCache, MISSING
+from utils.client_crud import DatosCliente
+from utils.outbox import enqueue_rows, outbox_row, resend_task
+from productorRabbitmq import SMS_RESEND_QUEUE
+
+# Códigos de error por mensaje en las respuestas de ingesta (mismos que usa el vendor)
+SMS_OK = 0
+SMS_INVALID_PARAMS = 3
+SMS_INTERNAL_ERROR = 10
+SMS_THROTTLED = 105
+
+# Máximo de destinatarios aceptados en un único mensaje (campañas)
+MAX_RECIPIENTS = int(os.getenv("MAX_RECIPIENTS", 10000))
+
+# --- Conciliación de DLR por provider_id ---
+# Correspondencia provider_id -> message_id de los mensajes en vuelo, llena
+# con la primera consulta de cada provider_id en el proceso que recibe los
+# DLR. El proveedor envía un DLR por parte del mensaje, así que las partes
+# siguientes se resuelven por clave primaria sin consultar el índice.
+PROVIDER_ID_CACHE_MAXSIZE = int(os.getenv("PROVIDER_ID_CACHE_MAXSIZE", 100000))
+PROVIDER_ID_CACHE_TTL = float(os.getenv("PROVIDER_ID_CACHE_TTL", 86400))
+
+provider_id_cache = TTLCache(maxsize=PROVIDER_ID_CACHE_MAXSIZE, ttl=PROVIDER_ID_CACHE_TTL)
+
+_SEPARADORES_DESTINATARIOS = re.compile(r"[,;\r\n]+")
+_CARACTERES_DECORATIVOS = re.compile(r"[\s().\-/]")
+_NUMERO_VALIDO = re.compile(r"^\+?\d{6,15}$")
+
+
+def new_message_id() -> str:
+    return str(uuid.uuid4())
+
+
+def build_sms_row(
+    sender_id: str,
+    receiver: str,
+    message: str,
+    action: str,
+    sub_account: str,
+    sub_account_pass: str,
+    cliente: DatosCliente,
+    message_id: str = None,
+) -> dict:
+    """Fila de `sms_incoming` lista para un insert en bloque, con estado 'pending'."""
+    return {
+        "message_id": message_id or new_message_id(),
+        "sender": sender_id,
+        "receiver": receiver,
+        "content": message,
+        "timestamp_received": datetime.now(),
+        "status": SmsStatus.PENDING.label,
+        "status_code": int(SmsStatus.PENDING),
+        "email_cliente": cliente.email_cliente,
+        "ftp_directorio": cliente.ftp_directorio,
+        "action": action,
+        "sub_account": sub_account,
+        "sub_account_pass": sub_account_pass,
+    }
+
+
+def parse_recipients(recipients: str):
+    """
+    Separa la lista de destinatarios (comas, punto y coma o saltos de línea),
+    quita separadores decorativos (espacios, guiones, paréntesis), convierte el prefijo `00` en `+` y elimina
+    duplicados manteniendo el orden. Devuelve `(validos, invalidos)`.
+    """
+    validos, invalidos, vistos = [], [], set()
+    for original in _SEPARADORES_DESTINATARIOS.split(recipients or ""):
+        if not original:
+            continue
+        numero = _CARACTERES_DECORATIVOS.sub("", original)
+        if numero.startswith("00"):
+            numero = "+" + numero[2:]
+        if not _NUMERO_VALIDO.match(numero):
+            invalidos.append(original)
+        elif numero not in vistos:
+            vistos.add(numero)
+            validos.append(numero)
+    return validos, invalidos
+
+
+def build_message_rows(
+    sender_id: str,
+    recipients: str,
+    message: str,
+    action: str,
+    sub_account: str,
+    sub_account_pass: str,
+    cliente: DatosCliente,
+):
+    """
+    Expande un mensaje en una fila de `sms_incoming` (y su tarea de reenvío)
+    por destinatario. Devuelve `(sms_rows, outbox_rows, entries)`, donde
+    `entries` tiene una entrada de respuesta por destinatario, válido o no.
+    """
+    validos, invalidos = parse_recipients(recipients)
+    if len(validos) > MAX_RECIPIENTS:
+        raise ValueError(f"El mensaje supera el máximo de {MAX_RECIPIENTS} destinatarios.")
+
+    sms_rows, outbox_rows, entries = [], [], []
+    for receiver in validos:
+        row = build_sms_row(
+            sender_id=sender_id,
+            receiver=receiver,
+            message=message,
+            action=action,
+            sub_account=sub_account,
+            sub_account_pass=sub_account_pass,
+            cliente=cliente,
+        )
+        sms_rows.append(row)
+        outbox_rows.append(
+            outbox_row(
+                SMS_RESEND_QUEUE,
+                resend_task(
+                    row["message_id"],
+                    cliente.email_cliente,
+                    cliente.ftp_directorio,
+                    sender=row["sender"],
+                    receiver=row["receiver"],
+                    text=row["content"],
+                ),
+            )
+        )
+        entries.append(sms_entry(row))
+    for receiver in invalidos:
+        entries.append(
+            sms_error_entry(SMS_INVALID_PARAMS, "Destinatario inválido.", sender_id, receiver)
+        )
+    return sms_rows, outbox_rows, entries
+
+
+def insert_sms_rows(db: Session, sms_rows: list, outbox_rows: list, ingest_rows: list = None):
+    """
+    Inserta los SMS, sus tareas del outbox y las claves de idempotencia con
+    un executemany por tabla y un único commit.
+    """
+    try:
+        if ingest_rows:
+            db.execute(insert(IngestRequest), ingest_rows)
+        if sms_rows:
+            db.execute(insert(SmsIncoming), sms_rows)
+        enqueue_rows(db, outbox_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def sms_entry(row: dict) -> dict:
+    """Entrada de la lista `sms` de la respuesta para un mensaje aceptado."""
+    return {
+        "errorCode": SMS_OK,
+        "id": row["message_id"],
+        "originatingAddress": row["sender"],
+        "destinationAddress": row["receiver"],
+    }
+
+
+def sms_error_entry(error_code: int, description: str, sender_id: str = None, receiver: str = None) -> dict:
+    return {
+        "errorCode": error_code,
+        "errorDescription": description,
+        "id": None,
+        "originatingAddress": sender_id,
+        "destinationAddress": receiver,
+    }
+
+
+def remember_provider_id(provider_id: str, message_id: str):
+    """Registra el provider_id asignado a un mensaje enviado al proveedor."""
+    if provider_id:
+        provider_id_cache.set(provider_id, message_id)
+
+
+def get_sms_by_provider_id(db: Session, provider_id: str):
+    """
+    `SmsIncoming` con ese provider_id, o `None`. Usa primero la caché de
+    mensajes en vuelo (búsqueda por clave primaria) y si no el índice de
+    provider_id. Una BBDD antigua puede tener provider_id repetidos: se
+    devuelve el primero en lugar de fallar.
+    """
+    message_id = provider_id_cache.get(provider_id)
+    if message_id is not MISSING:
+        sms = db.get(SmsIncoming, message_id)
+        if sms is not None and sms.provider_id == provider_id:
+            return sms
+        provider_id_cache.invalidate(provider_id)
+    sms = (
+        db.query(SmsIncoming)
+        .filter(SmsIncoming.provider_id == provider_id)
+        .first()
+    )
+    if sms is not None:
+        remember_provider_id(provider_id, sms.message_id)
+    return sms
@@ -0,0 +1,166 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models.clients import SmsIncoming
+from models.status import SmsStatus
+
+logger = logging.getLogger(__name__)
+
+# --- Tabla de transiciones permitidas ---
+# Estado destino -> estados desde los que se puede llegar. Todo lo demás
+# (DLR duplicados, tardíos o fuera de orden) es un no-op: ni escritura ni
+# tareas derivadas.
+_FINALES_DLR = (
+    SmsStatus.DELIVERED,
+    SmsStatus.UNDELIVERED,
+    SmsStatus.EXPIRED,
+    SmsStatus.DELETED,
+    SmsStatus.REJECTED,
+    SmsStatus.INVALID,
+)
+
+TRANSITIONS = {
+    SmsStatus.SENDING: frozenset({SmsStatus.PENDING}),
+    # Desde SENDING: el worker de reenvío reclama el mensaje antes de llamar al proveedor
+    SmsStatus.SENT_FAILED: frozenset({SmsStatus.PENDING, SmsStatus.SENDING}),
+    SmsStatus.ACCEPTED: frozenset({SmsStatus.SENDING}),
+    **{
+        final: frozenset({SmsStatus.SENDING, SmsStatus.ACCEPTED})
+        for final in _FINALES_DLR
+    },
+}
+
+
+def can_transition(current: int, new: SmsStatus) -> bool:
+    return current in TRANSITIONS.get(new, ())
+
+
+def transition(db: Session, message_id: str, new: SmsStatus, **values) -> bool:
+    """
+    Lleva el mensaje a `new` con un único UPDATE condicional
+    (`WHERE status_code IN (...)`), sin leer antes la fila. `values` son otras
+    columnas a escribir en la misma sentencia. Devuelve `False` si la
+    transición no estaba permitida (no se escribió nada). No hace commit.
+    """
+    origenes = TRANSITIONS.get(new)
+    if not origenes:
+        return False
+    result = db.execute(
+        update(SmsIncoming)
+        .where(
+            SmsIncoming.message_id == message_id,
+            SmsIncoming.status_code.in_([int(s) for s in origenes]),
+        )
+        .values(status_code=int(new), status=new.label, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def transition_loaded(db: Session, message: SmsIncoming, new: SmsStatus, **values) -> bool:
+    """
+    Como `transition` para un mensaje ya cargado en la sesión: si la tabla no
+    permite el cambio no toca la BBDD, y si lo aplica actualiza el objeto para
+    que los eventos siguientes del mismo lote vean el estado nuevo.
+    """
+    if not can_transition(message.status_code, new):
+        logger.info(
+            f"Transición ignorada para el mensaje {message.message_id}: "
+            f"'{message.status}' -> '{new.label}'."
+        )
+        return False
+    if not transition(db, message.message_id, new, **values):
+        return False
+    set_committed_value(message, "status_code", int(new))
+    set_committed_value(message, "status", new.label)
+    for campo, valor in values.items():
+        set_committed_value(message, campo, valor)
+    return True
+
+
+# --- Reclamo del envío ---
+# worker_resend marca el mensaje como SENDING (con `send_claimed_at`) antes de
+# llamar al proveedor, para que una tarea duplicada no lo envíe otra vez. El
+# envío queda reclamado mientras no tenga provider_id: si el worker cae a mitad
+# de envío, el reclamo caduca a los `stale_after` s. Un envío que no llegó al
+# proveedor (reintento, DLQ) se suelta y vuelve a PENDING: es la única vuelta
+# atrás de la tabla, y solo para mensajes que nunca salieron.
+
+def claim_send(db: Session, message_id: str, stale_after: float) -> bool:
+    """
+    Reclama el envío del mensaje con un único UPDATE condicional: desde
+    PENDING, o desde un SENDING sin provider_id cuyo reclamo caducó (o sin
+    reclamo, de antes de que existiera). Devuelve `False` si otro worker lo
+    tiene o ya se envió. No hace commit.
+    """
+    ahora = datetime.utcnow()
+    result = db.execute(
+        update(SmsIncoming)
+        .where(
+            SmsIncoming.message_id == message_id,
+            or_(
+                SmsIncoming.status_code == int(SmsStatus.PENDING),
+                and_(
+                    SmsIncoming.status_code == int(SmsStatus.SENDING),
+                    SmsIncoming.provider_id.is_(None),
+                    or_(
+                        SmsIncoming.send_claimed_at.is_(None),
+                        SmsIncoming.send_claimed_at < ahora - timedelta(seconds=stale_after),
+                    ),
+                ),
+            ),
+        )
+        .values(
+            status_code=int(SmsStatus.SENDING),
+            status=SmsStatus.SENDING.label,
+            send_claimed_at=ahora,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def record_send(db: Session, message_id: str, **values) -> bool:
+    """
+    Guarda el resultado de un envío reclamado (provider_id, num_parts...) y
+    cierra el reclamo. Devuelve `False` si el mensaje ya no estaba reclamado
+    sin provider_id. No hace commit.
+    """
+    result = db.execute(
+        update(SmsIncoming)
+        .where(
+            SmsIncoming.message_id == message_id,
+            SmsIncoming.status_code == int(SmsStatus.SENDING),
+            SmsIncoming.provider_id.is_(None),
+        )
+        .values(send_claimed_at=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_send(db: Session, message_id: str) -> bool:
+    """
+    Suelta el reclamo de un envío que no llegó al proveedor (reintento,
+    proveedor caído, DLQ): el mensaje vuelve a PENDING para que el reintento
+    o un reproceso desde la DLQ pueda reclamarlo enseguida. No hace commit.
+    """
+    result = db.execute(
+        update(SmsIncoming)
+        .where(
+            SmsIncoming.message_id == message_id,
+            SmsIncoming.status_code == int(SmsStatus.SENDING),
+            SmsIncoming.provider_id.is_(None),
+        )
+        .values(
+            status_code=int(SmsStatus.PENDING),
+            status=SmsStatus.PENDING.label,
+            send_claimed_at=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
@@ -0,0 +1,58 @@
+import os
+import json
+
+from dotenv import load_dotenv
+
+from productorRabbitmq import SMS_RESEND_QUEUE
+
+try:
+    import msgpack
+except ImportError:
+    # Sin msgpack las tareas viajan en JSON
+    msgpack = None
+
+load_dotenv()
+
+# --- Codificación de las tareas publicadas en RabbitMQ ---
+# Versión del esquema de las tareas de reenvío: la 1 (sin campo "v") solo
+# lleva ids; la 2 incluye además remitente, destinatario y texto del SMS.
+TASK_SCHEMA_VERSION = 2
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+# "msgpack" (si está instalado) o "json"
+TASK_ENCODING = os.getenv("TASK_ENCODING", "msgpack").lower()
+# Colas cuyos consumidores entienden msgpack; el resto recibe siempre JSON
+COMPACT_QUEUES = frozenset({SMS_RESEND_QUEUE})
+
+
+def compact_encoding_enabled() -> bool:
+    return TASK_ENCODING == "msgpack" and msgpack is not None
+
+
+def encode_outbox_payload(queue_name: str, payload: str):
+    """
+    Cuerpo y content-type con que se publica una tarea del outbox (guardada
+    como JSON). Las tareas de COMPACT_QUEUES se recodifican a msgpack.
+    """
+    if queue_name in COMPACT_QUEUES and compact_encoding_enabled():
+        return msgpack.packb(json.loads(payload), use_bin_type=True), MSGPACK_CONTENT_TYPE
+    return payload.encode("utf-8"), JSON_CONTENT_TYPE
+
+
+def decode_task(body: bytes, content_type: str = None) -> dict:
+    """
+    Decodifica el cuerpo de una tarea según su content-type (JSON si no lo
+    tiene). Lanza `ValueError` si no es válido o no es un objeto.
+    """
+    if content_type == MSGPACK_CONTENT_TYPE:
+        if msgpack is None:
+            raise ValueError("Tarea en msgpack, pero msgpack no está instalado.")
+        try:
+            task = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(f"msgpack inválido: {e}") from e
+    else:
+        task = json.loads(body)
+    if not isinstance(task, dict):
+        raise ValueError("La tarea no es un objeto.")
+    return task
@@ -0,0 +1,149 @@
+import os
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- Escritura diferida (write-behind) de los workers ---
+# Las actualizaciones de estado se agrupan en una transacción cada
+# WRITE_BEHIND_MAX_UPDATES actualizaciones o WRITE_BEHIND_MAX_DELAY_MS ms.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_UPDATES = int(os.getenv("WRITE_BEHIND_MAX_UPDATES", 200))
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", 20))
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """
+    Búfer de escritura diferida para los workers.
+
+    Cada actualización es una función `fn(db)` que escribe en la sesión sin
+    hacer commit. `submit` devuelve un `Future` que se resuelve con lo que
+    devuelva `fn` cuando su transacción es durable: el worker confirma el
+    mensaje de RabbitMQ en ese momento, así que un fallo antes del commit
+    provoca una redelivery igual que antes. Sin `start()` las actualizaciones
+    se escriben en el acto, una transacción por actualización.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        max_updates: int = WRITE_BEHIND_MAX_UPDATES,
+        max_delay_ms: float = WRITE_BEHIND_MAX_DELAY_MS,
+        name: str = "write-behind",
+    ):
+        self._session_factory = session_factory
+        self._max_updates = max_updates
+        self._max_delay = max_delay_ms / 1000
+        self._name = name
+        self._pendientes = queue.Queue()
+        self._thread = None
+        self.flushes = 0
+        self.updates_written = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Escritura diferida activa: hasta {self._max_updates} actualizaciones o "
+            f"{self._max_delay * 1000:.0f} ms por transacción."
+        )
+
+    def stop(self):
+        """Escribe lo pendiente y detiene el hilo escritor."""
+        if self._thread is not None:
+            self._pendientes.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        if self._thread is None:
+            self._flush_uno((fn, future))
+        else:
+            self._pendientes.put((fn, future))
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "flushes": self.flushes,
+            "updates_written": self.updates_written,
+            "pending": self._pendientes.qsize(),
+        }
+
+    def _run(self):
+        while True:
+            item = self._pendientes.get()
+            if item is _STOP:
+                return
+            lote = [item]
+            deadline = time.monotonic() + self._max_delay
+            detener = False
+            while len(lote) < self._max_updates:
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._pendientes.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    detener = True
+                    break
+                lote.append(item)
+            self._flush(lote)
+            if detener:
+                return
+
+    def _flush(self, lote: list):
+        lote = [item for item in lote if item[1].set_running_or_notify_cancel()]
+        if not lote:
+            return
+        if len(lote) == 1:
+            self._flush_uno(lote[0], running=True)
+            return
+        db = self._session_factory()
+        try:
+            resultados = [fn(db) for fn, _ in lote]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # Una actualización inválida no debe tumbar al resto del lote:
+            # se reintenta cada una en su propia transacción.
+            logger.warning(
+                f"Fallo la escritura diferida de {len(lote)} actualizaciones ({type(e).__name__}). Reintentando por separado."
+            )
+            for item in lote:
+                self._flush_uno(item, running=True)
+            return
+        finally:
+            db.close()
+        self.flushes += 1
+        self.updates_written += len(lote)
+        for (_, future), resultado in zip(lote, resultados):
+            future.set_result(resultado)
+
+    def _flush_uno(self, item, running: bool = False):
+        fn, future = item
+        if not running and not future.set_running_or_notify_cancel():
+            return
+        db = self._session_factory()
+        try:
+            resultado = fn(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            future.set_exception(e)
+            return
+        finally:
+            db.close()
+        self.flushes += 1
+        self.updates_written += 1
+        future.set_result(resultado)
@@ -32,8 +32,12 @@ setup_logging()
 logger = logging.getLogger(__name__)
 
 # --- Configuración del Worker (ahora se lee desde .env) ---
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-DISTRIBUCION_PDF_QUEUE = "Distribucion_PDF"
+from productorRabbitmq import (
+    RABBITMQ_HOST,
+    DISTRIBUCION_PDF_QUEUE,
+    declare_dead_letter_queue,
+    publish_dead_letter,
+)
 
 # --- Configuración de Email (SMTP) ---
 SMTP_HOST = os.getenv("SMTP_HOST")
@@ -171,23 +175,31 @@ def upload_sftp(local_path, remote_dir):
         raise
 
 
-# --- Función Principal del Worker y `main` (Sin cambios en su lógica interna) ---
+# --- Función Principal del Worker y `main` ---
 
 
 def callback(ch, method, properties, body):
-    # (El código de esta función es idéntico al anterior)
     logger.info(f"Mensaje de distribución recibido: {body.decode()}")
-    task_data = json.loads(body)
-    final_pdf_path = task_data.get("final_pdf_path")
-    recipient_email = task_data.get("recipient_email")
-    remote_dir = task_data.get("remote_dir")
-    sms_id = task_data.get("sms_id")
+    try:
+        task_data = json.loads(body)
+        final_pdf_path = task_data.get("final_pdf_path")
+        recipient_email = task_data.get("recipient_email")
+        remote_dir = task_data.get("remote_dir")
+        sms_id = task_data.get("sms_id")
+    except (ValueError, AttributeError):
+        task_data = final_pdf_path = recipient_email = remote_dir = sms_id = None
     if not all([final_pdf_path, recipient_email, remote_dir]):
         logger.error(f"Mensaje inválido recibido: {task_data}")
+        publish_dead_letter(
+            ch, DISTRIBUCION_PDF_QUEUE, body, properties, "InvalidMessage", "Faltan campos de la tarea"
+        )
         ch.basic_ack(delivery_tag=method.delivery_tag)
         return
     if not os.path.exists(final_pdf_path):
         logger.error(f"El archivo PDF '{final_pdf_path}' no fue encontrado.")
+        publish_dead_letter(
+            ch, DISTRIBUCION_PDF_QUEUE, body, properties, "PdfNotFound", final_pdf_path
+        )
         ch.basic_ack(delivery_tag=method.delivery_tag)
         return
     try:
@@ -198,8 +210,11 @@ def callback(ch, method, properties, body):
         logger.critical(
             f"FALLO DE ENTREGA para certificado '{final_pdf_path}': {delivery_error}"
         )
-    finally:
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        # Al DLQ con el motivo, para reprocesarlo con tools/dlq_cli.py
+        publish_dead_letter(
+            ch, DISTRIBUCION_PDF_QUEUE, body, properties, type(delivery_error).__name__, delivery_error
+        )
+    ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
 def main():
@@ -210,6 +225,7 @@ def main():
             )
             channel = connection.channel()
             channel.queue_declare(queue=DISTRIBUCION_PDF_QUEUE, durable=True)
+            declare_dead_letter_queue(channel, DISTRIBUCION_PDF_QUEUE)
             channel.basic_qos(prefetch_count=1)
             channel.basic_consume(
                 queue=DISTRIBUCION_PDF_QUEUE, on_message_callback=callback
@@ -0,0 +1,233 @@
+import pika
+import json
+import logging
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+load_dotenv()
+
+# --- Configuración de Logs ---
+from setupLog import setup_logging
+
+# --- Configuración ---
+from productorRabbitmq import (
+    RABBITMQ_HOST,
+    DLR_FORWARD_QUEUE,
+    declare_dead_letter_queue,
+    declare_retry_queues,
+    publish_dead_letter,
+    publish_retry,
+    retry_attempt,
+)
+from utils.dlr import STATUS_DLR_RESPONSE
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# --- Configuración del reenvío de DLR al vendor ---
+DLR_LISTENER_URL = os.getenv(
+    "DLR_LISTENER_URL", "http://195.191.165.16:32006/HTTP/api/Vendor/DLRListener"
+)
+# Reenvíos simultáneos (hilos y conexiones keep-alive al DLRListener)
+DLR_FORWARD_CONCURRENCY = int(os.getenv("DLR_FORWARD_CONCURRENCY", 8))
+DLR_FORWARD_CONNECT_TIMEOUT = float(os.getenv("DLR_FORWARD_CONNECT_TIMEOUT", 3))
+DLR_FORWARD_READ_TIMEOUT = float(os.getenv("DLR_FORWARD_READ_TIMEOUT", 10))
+# Reintentos ante errores de red o 5xx, con espera exponencial (0.5s, 1s, 2s...)
+DLR_FORWARD_MAX_RETRIES = int(os.getenv("DLR_FORWARD_MAX_RETRIES", 3))
+DLR_FORWARD_BACKOFF = float(os.getenv("DLR_FORWARD_BACKOFF", 0.5))
+# Agotados esos reintentos, el DLR espera en colas de espera (segundos por
+# nivel) sin ocupar un hilo y, tras DLR_FORWARD_MAX_ATTEMPTS, va a la DLQ.
+DLR_FORWARD_RETRY_DELAYS = [
+    int(d) for d in os.getenv("DLR_FORWARD_RETRY_DELAYS", "5,30,120,600").split(",")
+]
+DLR_FORWARD_MAX_ATTEMPTS = int(os.getenv("DLR_FORWARD_MAX_ATTEMPTS", 8))
+
+
+class DLRRechazado(Exception):
+    """El DLRListener respondió, pero rechazó el DLR: reintentarlo no sirve."""
+
+
+def build_http_session() -> requests.Session:
+    """
+    Sesión HTTP compartida por todos los hilos: reutiliza las conexiones
+    keep-alive y reintenta con backoff los fallos transitorios.
+    """
+    retry = Retry(
+        total=DLR_FORWARD_MAX_RETRIES,
+        backoff_factor=DLR_FORWARD_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=DLR_FORWARD_CONCURRENCY, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def forward_dlr(session: requests.Session, dlr_params: dict):
+    """
+    Reenvía un DLR al DLRListener del vendor. Lanza `requests.RequestException`
+    si no se pudo entregar y `DLRRechazado` si el vendor lo rechazó.
+    """
+    message_id = dlr_params.get("messageId")
+    response = session.get(
+        DLR_LISTENER_URL,
+        params=dlr_params,
+        timeout=(DLR_FORWARD_CONNECT_TIMEOUT, DLR_FORWARD_READ_TIMEOUT),
+    )
+    if response.status_code != 200:
+        # Tras agotar los reintentos, un 429 o un 5xx se trata como fallo transitorio
+        if response.status_code == 429 or response.status_code >= 500:
+            raise requests.HTTPError(
+                f"{response.status_code} - {response.text}", response=response
+            )
+        raise DLRRechazado(f"{response.status_code} - {response.text}")
+
+    json_response = response.json()
+    logger.info(f"Respuesta DLR enviada exitosamente para message_id: {message_id}")
+    if json_response.get("errorCode") == 0:
+        logger.info(f"DLR aceptado por el servidor: {json_response}")
+    else:
+        error_description = STATUS_DLR_RESPONSE.get(json_response.get("errorCode"))
+        raise DLRRechazado(f"{error_description} {json_response.get('errorDescription')}")
+
+
+def reintentar(connection, ch, delivery_tag, body, properties, message_id, error):
+    """
+    Programa el DLR en una cola de espera y confirma el original o, agotados
+    los intentos, lo manda a la DLQ. Publicar y confirmar se hacen en el hilo
+    de la conexión, en ese orden: si el worker cae entre ambos, el DLR se
+    duplica pero no se pierde.
+    """
+    intento = retry_attempt(properties) + 1
+    if intento >= DLR_FORWARD_MAX_ATTEMPTS:
+        logger.error(
+            f"El DLR de message_id {message_id} agotó sus {DLR_FORWARD_MAX_ATTEMPTS} intentos: {error}"
+        )
+        a_la_dlq(connection, ch, delivery_tag, body, properties, "RetriesExhausted", error)
+        return
+
+    def _en_hilo_conexion():
+        espera = publish_retry(
+            ch, DLR_FORWARD_QUEUE, body, properties, intento, DLR_FORWARD_RETRY_DELAYS
+        )
+        ch.basic_ack(delivery_tag=delivery_tag)
+        logger.warning(
+            f"Reintento {intento} del DLR de message_id {message_id} programado en {espera:.1f}s: {error}"
+        )
+
+    connection.add_callback_threadsafe(_en_hilo_conexion)
+
+
+def a_la_dlq(connection, ch, delivery_tag, body, properties, error_class, error):
+    """Envía el DLR a la DLQ de la cola de reenvío y confirma el original."""
+    def _en_hilo_conexion():
+        publish_dead_letter(ch, DLR_FORWARD_QUEUE, body, properties, error_class, error)
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    connection.add_callback_threadsafe(_en_hilo_conexion)
+
+
+def process_message(session, connection, ch, delivery_tag, body, properties=None):
+    """
+    Procesa un DLR en un hilo del pool. El ack/nack se devuelve al hilo de la
+    conexión, porque los canales de pika no son thread-safe.
+    """
+    def responder(fn, **kwargs):
+        connection.add_callback_threadsafe(partial(fn, delivery_tag=delivery_tag, **kwargs))
+
+    try:
+        dlr_params = json.loads(body)
+    except ValueError:
+        logger.error("Mensaje inválido en la cola de DLR. Descartando.")
+        responder(ch.basic_ack)
+        return
+
+    message_id = dlr_params.get("messageId")
+    try:
+        forward_dlr(session, dlr_params)
+        responder(ch.basic_ack)
+    except DLRRechazado as e:
+        logger.error(f"DLR rechazado por el servidor para message_id {message_id}: {e}")
+        # Una respuesta controlada del vendor no se reintenta
+        responder(ch.basic_ack)
+    except requests.RequestException as e:
+        logger.error(
+            f"No se pudo reenviar el DLR de message_id {message_id} tras {DLR_FORWARD_MAX_RETRIES} reintentos: {e}"
+        )
+        reintentar(connection, ch, delivery_tag, body, properties, message_id, e)
+    except Exception as e:
+        logger.error(f"Error inesperado reenviando el DLR de message_id {message_id}: {e}")
+        # A la DLQ con el motivo, para reprocesarlo con tools/dlq_cli.py
+        a_la_dlq(connection, ch, delivery_tag, body, properties, type(e).__name__, e)
+
+
+def main():
+    """
+    Función principal que inicia la conexión y el consumo de mensajes.
+    """
+    connection = None
+    session = build_http_session()
+    executor = ThreadPoolExecutor(
+        max_workers=DLR_FORWARD_CONCURRENCY, thread_name_prefix="dlr"
+    )
+    while True:
+        try:
+            logger.info("Iniciando worker de reenvío de DLR...")
+            connection_params = pika.ConnectionParameters(
+                host=RABBITMQ_HOST,
+                heartbeat=600,
+                blocked_connection_timeout=300,
+            )
+            connection = pika.BlockingConnection(connection_params)
+            channel = connection.channel()
+
+            channel.queue_declare(queue=DLR_FORWARD_QUEUE, durable=True)
+            declare_retry_queues(channel, DLR_FORWARD_QUEUE, DLR_FORWARD_RETRY_DELAYS)
+            declare_dead_letter_queue(channel, DLR_FORWARD_QUEUE)
+            # Tantos mensajes sin confirmar como hilos: la concurrencia queda acotada
+            channel.basic_qos(prefetch_count=DLR_FORWARD_CONCURRENCY)
+
+            def callback(ch, method, properties, body, conn=connection):
+                executor.submit(
+                    process_message, session, conn, ch, method.delivery_tag, body, properties
+                )
+
+            channel.basic_consume(queue=DLR_FORWARD_QUEUE, on_message_callback=callback)
+
+            logger.info(
+                f"[*] Esperando mensajes en la cola '{DLR_FORWARD_QUEUE}'. Para salir presione CTRL+C"
+            )
+            channel.start_consuming()
+
+        except pika.exceptions.AMQPConnectionError as e:
+            logger.error(
+                f"Error de conexión con RabbitMQ: {e}. Reintentando en 5 segundos..."
+            )
+            time.sleep(5)
+        except KeyboardInterrupt:
+            logger.info("Deteniendo el worker...")
+            executor.shutdown(wait=True)
+            if connection and connection.is_open:
+                connection.close()
+            session.close()
+            break
+        except Exception as e:
+            logger.error(
+                f"Ocurrió un error inesperado en el worker: {e}. Reiniciando..."
+            )
+            time.sleep(5)
+
+
+if __name__ == "__main__":
+    main()
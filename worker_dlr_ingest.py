@@ -0,0 +1,198 @@
+import pika
+import json
+import logging
+import time
+import os
+
+from pydantic import ValidationError
+from dotenv import load_dotenv
+load_dotenv()
+
+# --- Configuración de Logs ---
+from setupLog import setup_logging
+
+# --- Configuración ---
+from productorRabbitmq import (
+    RABBITMQ_HOST,
+    DLR_INGEST_QUEUE,
+    declare_dead_letter_queue,
+    declare_retry_queues,
+    publish_dead_letter,
+    publish_retry,
+    retry_attempt,
+)
+from schemas.dlr import DLRWebhookPayload
+from utils.dlr import apply_dlr_batch
+
+from database import SessionLocal
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# --- Configuración de los lotes ---
+# Se aplica un lote al llegar a DLR_BATCH_SIZE DLR o cuando el más antiguo
+# lleva DLR_BATCH_MAX_DELAY segundos esperando.
+DLR_BATCH_SIZE = int(os.getenv("DLR_BATCH_SIZE", 500))
+DLR_BATCH_MAX_DELAY = float(os.getenv("DLR_BATCH_MAX_DELAY", 0.05))
+
+# --- DLR de mensajes aún desconocidos ---
+# Un DLR puede llegar antes de que se guarde el provider_id de su mensaje
+# (p. ej. con la escritura diferida de worker_resend). Se reintenta en las
+# colas de espera (segundos por nivel) y, agotados los intentos, va a la DLQ.
+DLR_UNKNOWN_RETRY_DELAYS = [
+    int(d) for d in os.getenv("DLR_UNKNOWN_RETRY_DELAYS", "2,10,60,300").split(",")
+]
+DLR_UNKNOWN_MAX_ATTEMPTS = int(os.getenv("DLR_UNKNOWN_MAX_ATTEMPTS", 6))
+
+
+def leer_dlr(body: bytes):
+    """`DLRWebhookPayload` del mensaje, o `None` si no es válido."""
+    try:
+        return DLRWebhookPayload.model_validate(json.loads(body))
+    except (ValueError, ValidationError) as e:
+        logger.error(f"DLR inválido en la cola '{DLR_INGEST_QUEUE}': {e}. Descartando.")
+        return None
+
+
+def aplicar_lote(payloads: list) -> set:
+    """
+    Aplica un lote de DLR con una consulta y un commit. Devuelve los msgId
+    que aún no corresponden a ningún mensaje.
+    """
+    db = SessionLocal()
+    try:
+        no_encontrados = apply_dlr_batch(db, payloads)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"Lote de {len(payloads)} DLR aplicado.")
+    return set(no_encontrados)
+
+
+def reintentar_desconocido(channel, payload, body, properties):
+    """
+    Programa de nuevo un DLR cuyo msgId aún no existe o, agotados los
+    intentos, lo manda a la DLQ. El llamante confirma después el original.
+    """
+    intento = retry_attempt(properties) + 1
+    if intento >= DLR_UNKNOWN_MAX_ATTEMPTS:
+        logger.error(
+            f"No se encontró ningún mensaje con provider_id (msgId) {payload.msgId} "
+            f"tras {DLR_UNKNOWN_MAX_ATTEMPTS} intentos."
+        )
+        publish_dead_letter(
+            channel, DLR_INGEST_QUEUE, body, properties, "UnknownMsgId",
+            f"Sin mensaje con provider_id {payload.msgId}",
+        )
+        return
+    espera = publish_retry(
+        channel, DLR_INGEST_QUEUE, body, properties, intento, DLR_UNKNOWN_RETRY_DELAYS
+    )
+    logger.warning(
+        f"No se encontró ningún mensaje con provider_id (msgId) {payload.msgId}. "
+        f"Reintento {intento} en {espera:.1f}s."
+    )
+
+
+def procesar_lote(channel, lote: list):
+    """
+    Aplica los DLR de `lote` (lista de `(delivery_tag, payload, body,
+    properties)`) y confirma todo con un único ack múltiple. Los DLR de
+    mensajes aún desconocidos se reprograman antes del ack. Si el lote falla
+    se aplica DLR a DLR para que uno defectuoso no bloquee al resto.
+    """
+    validos = [payload for _, payload, _, _ in lote if payload is not None]
+    ultimo_tag = lote[-1][0]
+    try:
+        no_encontrados = aplicar_lote(validos) if validos else set()
+    except Exception as e:
+        logger.error(f"Error aplicando un lote de {len(validos)} DLR ({e}). Reintentando por separado.")
+    else:
+        for _, payload, body, properties in lote:
+            if payload is not None and payload.msgId in no_encontrados:
+                reintentar_desconocido(channel, payload, body, properties)
+        channel.basic_ack(delivery_tag=ultimo_tag, multiple=True)
+        return
+
+    for delivery_tag, payload, body, properties in lote:
+        if payload is None:
+            channel.basic_ack(delivery_tag=delivery_tag)
+            continue
+        try:
+            if aplicar_lote([payload]):
+                reintentar_desconocido(channel, payload, body, properties)
+        except Exception as e:
+            logger.error(f"Error inesperado aplicando el DLR de msgId {payload.msgId}: {e}")
+            # A la DLQ con el motivo, para reprocesarlo con tools/dlq_cli.py
+            publish_dead_letter(channel, DLR_INGEST_QUEUE, body, properties, type(e).__name__, e)
+        channel.basic_ack(delivery_tag=delivery_tag)
+
+
+def consumir(channel):
+    """Agrupa los DLR en lotes por tamaño o por tiempo y los aplica."""
+    lote, limite = [], None
+    for method, properties, body in channel.consume(
+        DLR_INGEST_QUEUE, inactivity_timeout=DLR_BATCH_MAX_DELAY
+    ):
+        if method is not None:
+            if not lote:
+                limite = time.monotonic() + DLR_BATCH_MAX_DELAY
+            lote.append((method.delivery_tag, leer_dlr(body), body, properties))
+        if lote and (
+            method is None
+            or len(lote) >= DLR_BATCH_SIZE
+            or time.monotonic() >= limite
+        ):
+            procesar_lote(channel, lote)
+            lote = []
+
+
+def main():
+    """
+    Función principal que inicia la conexión y el consumo de mensajes.
+    """
+    connection = None
+    while True:
+        try:
+            logger.info("Iniciando worker de ingesta de DLR...")
+            connection_params = pika.ConnectionParameters(
+                host=RABBITMQ_HOST,
+                heartbeat=600,
+                blocked_connection_timeout=300,
+            )
+            connection = pika.BlockingConnection(connection_params)
+            channel = connection.channel()
+
+            channel.queue_declare(queue=DLR_INGEST_QUEUE, durable=True)
+            declare_retry_queues(channel, DLR_INGEST_QUEUE, DLR_UNKNOWN_RETRY_DELAYS)
+            declare_dead_letter_queue(channel, DLR_INGEST_QUEUE)
+            # El broker entrega hasta un lote completo sin esperar acks
+            channel.basic_qos(prefetch_count=DLR_BATCH_SIZE)
+
+            logger.info(
+                f"[*] Esperando mensajes en la cola '{DLR_INGEST_QUEUE}'. Para salir presione CTRL+C"
+            )
+            consumir(channel)
+
+        except pika.exceptions.AMQPConnectionError as e:
+            logger.error(
+                f"Error de conexión con RabbitMQ: {e}. Reintentando en 5 segundos..."
+            )
+            time.sleep(5)
+        except KeyboardInterrupt:
+            logger.info("Deteniendo el worker...")
+            if connection and connection.is_open:
+                connection.close()
+            break
+        except Exception as e:
+            logger.error(
+                f"Ocurrió un error inesperado en el worker: {e}. Reiniciando..."
+            )
+            time.sleep(5)
+
+
+if __name__ == "__main__":
+    main()
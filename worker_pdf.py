@@ -4,7 +4,9 @@ import logging
 import time
 import os
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
@@ -30,8 +32,9 @@ from pyhanko.sign.fields import (
 from dotenv import load_dotenv
 
 # Importaciones de la configuración de la base de datos y modelos
-from database import get_db
+from database import get_db, SessionLocal
 from models.clients import SmsIncoming
+from models.status import SmsStatus
 
 # --- Configuración de Logs ---
 from setupLog import setup_logging
@@ -39,6 +42,21 @@ from setupLog import setup_logging
 # --- Configuración del Worker ---
 from productorRabbitmq import (
     RABBITMQ_HOST,
+    CERTIFICACION_PDF_QUEUE,
+    DISTRIBUCION_PDF_QUEUE,
+    declare_dead_letter_queue,
+    publish_dead_letter,
+)
+from utils.outbox import enqueue_task
+from utils.write_behind import WRITE_BEHIND_ENABLED, WriteBehindBuffer
+from utils.signing import SigningContext
+from utils.batcher import KeyedBatcher
+from utils.batch_seal import (
+    PDF_BATCH_SEAL_ENABLED,
+    PDF_BATCH_SEAL_MAX,
+    PDF_BATCH_SEAL_WINDOW_MS,
+    BatchSealer,
+    embed_seal,
 )
 
 load_dotenv()
@@ -58,8 +76,6 @@ COMPANY_CIF = os.getenv("COMPANY_CIF")
 COMPANY_ADDRESS = os.getenv("COMPANY_ADDRESS")
 
 # --- Configuración de RabbitMQ ---
-CERTIFICACION_PDF_QUEUE = "Certificacion_PDF"
-DISTRIBUCION_PDF_QUEUE = "Distribucion_PDF"
 PDF_OUTPUT_DIR = "certificados/tmp"  # Directorio para guardar los PDFs
 # Directorio para guardar los PDFs sellados
 PDF_FINAL_DIR = "certificados/sellados"
@@ -88,6 +104,51 @@ if TSA_URL not in TSA_WHITE  and (
 setup_logging()
 logger = logging.getLogger(__name__)
 
+
+def _crear_timestamper() -> HTTPTimeStamper:
+    if TSA_URL in TSA_WHITE:
+        return HTTPTimeStamper(url=TSA_URL)
+    return HTTPTimeStamper(
+        url=TSA_URL,
+        auth=(
+            tsa_username_firmaprofesional,
+            tsa_password_firmaprofesional,
+        ),
+    )
+
+
+# --- Escritura diferida ---
+# `pdf_path` y la tarea de distribución se guardan por lotes; cada mensaje se
+# confirma a RabbitMQ cuando su lote es durable.
+result_writer = WriteBehindBuffer(SessionLocal, name="pdf-result-writer")
+
+# --- Sellado de tiempo por lotes ---
+# Con PDF_BATCH_SEAL_ENABLED los PDF se firman sin sello propio y los de cada
+# ventana se sellan juntos con una sola petición a la TSA; cada PDF recibe
+# después su prueba de inclusión y el sello del lote.
+seal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-seal")
+seal_batcher = (
+    KeyedBatcher(
+        BatchSealer(_crear_timestamper()).seal,
+        seal_executor,
+        max_items=PDF_BATCH_SEAL_MAX,
+        max_delay_ms=PDF_BATCH_SEAL_WINDOW_MS,
+        name="pdf-seal-batcher",
+    )
+    if PDF_BATCH_SEAL_ENABLED
+    else None
+)
+
+# Mensajes sin confirmar: el que se procesa, los que esperan el commit y, con
+# el sellado por lotes, los que esperan a que se selle su lote
+PDF_PREFETCH = int(
+    os.getenv(
+        "PDF_PREFETCH",
+        (10 if WRITE_BEHIND_ENABLED else 1)
+        + (PDF_BATCH_SEAL_MAX if seal_batcher is not None else 0),
+    )
+)
+
 # Crear el directorio de salida si no existe
 os.makedirs(PDF_OUTPUT_DIR, exist_ok=True)
 os.makedirs(PDF_FINAL_DIR, exist_ok=True)
@@ -423,34 +484,44 @@ def create_certification_pdf_custom(sms_data: SmsIncoming):
         raise
 
 
+_signing_context = None
+
+
+def get_signing_context() -> SigningContext:
+    """
+    Contexto de firma del worker: el PKCS#12 se descifra una vez y se recarga
+    solo si el fichero cambia en disco.
+    """
+    global _signing_context
+    if _signing_context is None:
+        # Creamos el objeto firmante, combinando los metadatos, el certificado y el sello de tiempo.
+        # Con el sellado por lotes la firma no lleva sello propio: lo añade el lote.
+        timestamper = None if PDF_BATCH_SEAL_ENABLED else _crear_timestamper()
+        meta = signers.PdfSignatureMetadata(
+            field_name=os.getenv("CERT_NAME", "FirmaEmpresa"),
+            reason=os.getenv("CERT_REASON", "Certificación de entrega de comunicación"),
+            location=os.getenv("CERT_LOCATION", "Servidor Central"),
+        )
+        try:
+            _signing_context = SigningContext(PKCS12_PATH, PKCS12_PASSPHRASE, meta, timestamper)
+        except Exception as e:
+            logger.error(f"¡ERROR CRÍTICO! No se pudo cargar el certificado: {e}")
+            raise
+    return _signing_context
+
+
 def sign_and_store_pdf(temp_pdf_path: str, sms_id: str) -> str:
     """
     Aplica una firma digital PAdES-B-LT y guarda el PDF en la ubicación final.
+    Con el sellado por lotes la firma se hace sin sello de tiempo; el sello
+    del lote se añade después con `embed_seal`.
     """
     logger.info(f"Iniciando firma digital para '{temp_pdf_path}'.")
 
-    # 1. Cargar el certificado
-    try:
-        signer = signers.SimpleSigner.load_pkcs12(
-            pfx_file=PKCS12_PATH,
-            passphrase=(
-                PKCS12_PASSPHRASE.encode("utf-8")
-                if PKCS12_PASSPHRASE
-                else None
-            ),
-        )
-    except Exception as e:
-        logger.error(f"¡ERROR CRÍTICO! No se pudo cargar el certificado: {e}")
-        raise
+    # 1. Certificado, metadatos y sellador de tiempo, cargados una vez por worker
+    pdf_signer = get_signing_context().pdf_signer()
 
-    # 2. Definir los metadatos de la firma que usaremos
-    meta = signers.PdfSignatureMetadata(
-        field_name=os.getenv("CERT_NAME", "FirmaEmpresa"),
-        reason=os.getenv("CERT_REASON", "Certificación de entrega de comunicación"),
-        location=os.getenv("CERT_LOCATION", "Servidor Central"),
-    )
-
-    # 3. Preparar el archivo de salida
+    # 2. Preparar el archivo de salida
     final_pdf_path = os.path.join(
         PDF_FINAL_DIR, f"certificado_final_{sms_id}.pdf"
     )
@@ -475,21 +546,6 @@ def sign_and_store_pdf(temp_pdf_path: str, sms_id: str) -> str:
             ),
         )
 
-        # Creamos el objeto firmante, combinando los metadatos, el certificado y el sello de tiempo
-        timestamper = (
-            HTTPTimeStamper(url=TSA_URL)
-            if TSA_URL == "http://timestamp.digicert.com" or TSA_URL == "http://tsa.firmaprofesional.com"
-            else HTTPTimeStamper(
-                url=TSA_URL,
-                auth=(
-                    tsa_username_firmaprofesional,
-                    tsa_password_firmaprofesional,
-                ),
-            )
-        )
-
-        pdf_signer = signers.PdfSigner(meta, signer, timestamper=timestamper)
-
         # Finalmente, firmamos el PDF modificado (w) y escribimos el resultado en el archivo de salida (doc_out)
         pdf_signer.sign_pdf(w, output=doc_out)
 
@@ -499,35 +555,111 @@ def sign_and_store_pdf(temp_pdf_path: str, sms_id: str) -> str:
     return final_pdf_path
 
 
+def _guardar_resultado(db: Session, message_id: str, pdf_path: str, distribution_task: dict):
+    """
+    La ruta del PDF sellado y la tarea de distribución se guardan en la
+    misma transacción; el relay del outbox la publica después.
+    """
+    db.execute(
+        update(SmsIncoming)
+        .where(SmsIncoming.message_id == message_id)
+        .values(pdf_path=pdf_path)
+        .execution_options(synchronize_session=False)
+    )
+    enqueue_task(db, DISTRIBUCION_PDF_QUEUE, distribution_task)
+
+
+def _confirmar_al_guardar(ch, delivery_tag, body, properties, db_message_id, future):
+    """
+    Callback del búfer: confirma el mensaje cuando su resultado es durable, o
+    lo manda a la DLQ si no se pudo guardar. Se ejecuta en el hilo escritor, así
+    que las operaciones del canal se devuelven al hilo de la conexión.
+    """
+    def _en_hilo_conexion():
+        error = future.exception()
+        if error is None:
+            logger.info(
+                f"Proceso de certificación y sellado para SMS id '{db_message_id}' completado."
+            )
+        else:
+            logger.error(
+                f"No se pudo guardar el certificado del mensaje id '{db_message_id}': {error}"
+            )
+            publish_dead_letter(
+                ch, CERTIFICACION_PDF_QUEUE, body, properties, type(error).__name__, error
+            )
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    ch.connection.add_callback_threadsafe(_en_hilo_conexion)
+
+
+def _registrar_resultado(ch, delivery_tag, body, properties, db_message_id, message_id, pdf_path, distribution_task):
+    """
+    Guarda el resultado en el búfer de escritura diferida; el ack llega con el commit.
+    """
+    result_writer.submit(
+        lambda db_lote: _guardar_resultado(db_lote, message_id, pdf_path, distribution_task)
+    ).add_done_callback(
+        lambda future: _confirmar_al_guardar(
+            ch, delivery_tag, body, properties, db_message_id, future
+        )
+    )
+    logger.info(
+        f"Tarea de distribución para '{pdf_path}' registrada para la cola '{DISTRIBUCION_PDF_QUEUE}'."
+    )
+
+
+def _tras_sellado(ch, delivery_tag, body, properties, db_message_id, message_id, pdf_path, distribution_task, future):
+    """
+    Callback del sellado por lotes: embebe el sello del lote en el PDF y
+    registra el resultado. Se ejecuta en el hilo de sellado.
+    """
+    try:
+        embed_seal(pdf_path, future.result())
+    except Exception as e:
+        logger.error(
+            f"No se pudo sellar el certificado del mensaje id '{db_message_id}': {e}"
+        )
+
+        def _a_la_dlq(error=e):
+            publish_dead_letter(ch, CERTIFICACION_PDF_QUEUE, body, properties, type(error).__name__, error)
+            ch.basic_ack(delivery_tag=delivery_tag)
+
+        ch.connection.add_callback_threadsafe(_a_la_dlq)
+        return
+    _registrar_resultado(
+        ch, delivery_tag, body, properties, db_message_id, message_id, pdf_path, distribution_task
+    )
+
+
 def callback(ch, method, properties, body):
     """
     Función que se ejecuta por cada mensaje consumido de la
     cola de certificación.
     """
     logger.info(f"Mensaje de certificación recibido: {body.decode()}")
-    db: Session = next(get_db())
-    task_data = json.loads(body)
-    db_message_id = task_data.get("db_message_id")
+    try:
+        db_message_id = json.loads(body).get("db_message_id")
+    except (ValueError, AttributeError):
+        db_message_id = None
     temp_pdf_path = None
 
-    # conexión con rabbitmq y procesamiento del mensaje
-    connection_pub = pika.BlockingConnection(
-        pika.ConnectionParameters(host=RABBITMQ_HOST)
-    )
-    channel_pub = connection_pub.channel()
-    channel_pub.queue_declare(queue=DISTRIBUCION_PDF_QUEUE, durable=True)
-
     if not db_message_id:
-        logger.error("Mensaje inválido, falta 'db_message_id'. Descartando.")
+        logger.error("Mensaje inválido, falta 'db_message_id'.")
+        publish_dead_letter(
+            ch, CERTIFICACION_PDF_QUEUE, body, properties, "InvalidMessage", "Falta 'db_message_id'"
+        )
         ch.basic_ack(delivery_tag=method.delivery_tag)
         return
 
+    db: Session = next(get_db())
+
     try:
         sms = (
             db.query(SmsIncoming)
             .filter(
                 SmsIncoming.message_id == db_message_id,
-                SmsIncoming.status == "DELIVERED",
+                SmsIncoming.status_code == SmsStatus.DELIVERED,
             )
             .first()
         )
@@ -552,42 +684,33 @@ def callback(ch, method, properties, body):
             "remote_dir": sms.ftp_directorio,
         }
 
-        channel_pub.basic_publish(
-            exchange="",
-            routing_key=DISTRIBUCION_PDF_QUEUE,
-            body=json.dumps(distribution_task),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-            ),
-        )
-
-        logger.info(
-            f"Tarea de distribución para '{stamped_pdf_path}' enviada a la cola '{DISTRIBUCION_PDF_QUEUE}'."
-        )
-
         # --- Lógica de éxito ---
-        # (Opcional) Aquí se podría actualizar la BBDD con la ruta del PDF sellado
-        sms.pdf_path = stamped_pdf_path
-        db.commit()
-
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        logger.info(
-            f"Proceso de certificación y sellado para SMS id '{db_message_id}' completado."
-        )
+        args = (
+            ch, method.delivery_tag, body, properties, db_message_id,
+            sms.message_id, stamped_pdf_path, distribution_task,
+        )
+        if seal_batcher is not None:
+            # El resultado se registra cuando se sella el lote del PDF
+            seal_batcher.submit("sello", stamped_pdf_path).add_done_callback(
+                lambda future: _tras_sellado(*args, future)
+            )
+        else:
+            _registrar_resultado(*args)
 
     except Exception as e:
         logger.error(
             f"Fallo CRÍTICO en el flujo de certificación para el mensaje id '{db_message_id}': {e}"
         )
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        db.rollback()
+        # Al DLQ con el motivo, para reprocesarlo con tools/dlq_cli.py
+        publish_dead_letter(ch, CERTIFICACION_PDF_QUEUE, body, properties, type(e).__name__, e)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
     finally:
         # Limpieza: eliminar el archivo PDF temporal después del proceso
         if temp_pdf_path and os.path.exists(temp_pdf_path):
             os.remove(temp_pdf_path)
             logger.info(f"Archivo temporal '{temp_pdf_path}' eliminado.")
         db.close()
-        if connection_pub and connection_pub.is_open:
-            connection_pub.close()
 
 
 def main():
@@ -595,6 +718,12 @@ def main():
     Función principal que inicia la conexión y el consumo de mensajes.
     """
     connection = None
+    # El certificado se carga al arrancar: un error aparece antes del primer mensaje
+    get_signing_context()
+    if WRITE_BEHIND_ENABLED:
+        result_writer.start()
+    if seal_batcher is not None:
+        seal_batcher.start()
     while True:
         try:
             logger.info("Iniciando worker de certificación PDF...")
@@ -607,7 +736,8 @@ def main():
             channel = connection.channel()
 
             channel.queue_declare(queue=CERTIFICACION_PDF_QUEUE, durable=True)
-            channel.basic_qos(prefetch_count=1)
+            declare_dead_letter_queue(channel, CERTIFICACION_PDF_QUEUE)
+            channel.basic_qos(prefetch_count=PDF_PREFETCH)
             channel.basic_consume(
                 queue=CERTIFICACION_PDF_QUEUE, on_message_callback=callback
             )
@@ -624,7 +754,14 @@ def main():
             time.sleep(5)
         except KeyboardInterrupt:
             logger.info("Deteniendo el worker...")
+            # Sella los lotes pendientes antes de vaciar el búfer de escritura
+            if seal_batcher is not None:
+                seal_batcher.stop()
+            seal_executor.shutdown(wait=True)
+            result_writer.stop()
             if connection and connection.is_open:
+                # Envía los acks de la última escritura antes de cerrar
+                connection.process_data_events(time_limit=0)
                 connection.close()
             break
         except Exception as e:
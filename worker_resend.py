@@ -3,14 +3,27 @@ import json
 import logging
 import time
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
 
 import requests
+from requests.adapters import HTTPAdapter
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 load_dotenv()
 
 # Asegúrate de que este worker pueda acceder a estos archivos.
 from models.clients import SmsIncoming
+from models.status import SmsStatus
+from utils.adaptive_rate import get_provider_limiter
+from utils.circuit_breaker import get_provider_breaker
+from utils.sms_status import claim_send, record_send, release_send, transition
+from utils.cache import TTLCache, MISSING
+from utils.task_codec import decode_task
+from utils.write_behind import WRITE_BEHIND_ENABLED, WriteBehindBuffer
+from utils.batcher import KeyedBatcher
 
 # --- Configuración de Logs ---
 from setupLog import setup_logging
@@ -19,11 +32,16 @@ from setupLog import setup_logging
 from productorRabbitmq import (
     RABBITMQ_HOST,
     SMS_RESEND_QUEUE,
-    rabbitmq_connection,
-    rabbitmq_channel,
+    CERTIFICACION_PDF_QUEUE,
+    declare_dead_letter_queue,
+    declare_retry_queues,
+    publish_dead_letter,
+    publish_parked,
+    publish_retry,
+    retry_attempt,
 )
 
-from database import get_db
+from database import get_db, SessionLocal
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -31,6 +49,8 @@ logger = logging.getLogger(__name__)
 # --- Configuración para sms api ---
 SMS_API_CONFIG = {
     "api_url": os.getenv("API_URL_SMS_API"),  # Reemplazar con la URL real
+    # Envío multi-destinatario; sin URL cada SMS se envía por separado
+    "bulk_url": os.getenv("API_BULK_URL_SMS_API"),
     "username": os.getenv("USERNAME_SMS_API"),  # Reemplazar
     "password": os.getenv("PASSWORD_SMS_API"),  # Reemplazar
     "dlr_mask": 19,
@@ -42,22 +62,116 @@ SMS_API_CONFIG = {
 }
 
 RC_THROTTLING_ERROR = 105  # Código de error específico de la API
+SMS_API_CONNECT_TIMEOUT = float(os.getenv("SMS_API_CONNECT_TIMEOUT", 3))
+SMS_API_READ_TIMEOUT = float(os.getenv("SMS_API_READ_TIMEOUT", 20))
+
+# --- Concurrencia del envío ---
+# Envíos al proveedor en vuelo por proceso; el prefetch se ajusta al mismo valor.
+RESEND_CONCURRENCY = int(os.getenv("RESEND_CONCURRENCY", 8))
+executor = ThreadPoolExecutor(max_workers=RESEND_CONCURRENCY, thread_name_prefix="resend")
+# message_id de los SMS que se están enviando en este proceso
+_en_vuelo = set()
+_en_vuelo_lock = threading.Lock()
+
+# --- Reintentos diferidos ---
+# Niveles de espera (segundos) para los fallos transitorios del proveedor:
+# el intento n espera en el nivel n (el último se repite) sin ocupar un hilo.
+RESEND_RETRY_DELAYS = [
+    int(d) for d in os.getenv("RESEND_RETRY_DELAYS", "1,5,30,120,600").split(",")
+]
+RESEND_MAX_ATTEMPTS = int(os.getenv("RESEND_MAX_ATTEMPTS", 8))
+
+# --- Reclamo del envío ---
+# Antes de llamar al proveedor el SMS se marca SENDING en la BBDD, así una
+# tarea duplicada en otro proceso no lo envía dos veces. Un reclamo sin
+# provider_id caduca a los RESEND_CLAIM_TIMEOUT s (worker caído a mitad de envío).
+RESEND_CLAIM_TIMEOUT = float(os.getenv("RESEND_CLAIM_TIMEOUT", 120))
+
+# --- Envío en bloque ---
+# Con API_BULK_URL_SMS_API, los SMS con el mismo remitente, texto y dcs que
+# llegan en una ventana de RESEND_BULK_WINDOW_MS ms se envían en una única
+# petición multi-destinatario de hasta RESEND_BULK_MAX destinatarios.
+RESEND_BULK_MAX = int(os.getenv("RESEND_BULK_MAX", 100))
+RESEND_BULK_WINDOW_MS = float(os.getenv("RESEND_BULK_WINDOW_MS", 50))
+
+# --- Tareas completas (con los datos del SMS) ---
+# Los message_id enviados con éxito se recuerdan para descartar, sin tocar la
+# BBDD, las redeliveries que lleguen a este proceso; el reclamo del envío en la
+# BBDD cubre las que lleguen a otro proceso o tras un reinicio.
+RESEND_SENT_CACHE_MAXSIZE = int(os.getenv("RESEND_SENT_CACHE_MAXSIZE", 100000))
+RESEND_SENT_CACHE_TTL = float(os.getenv("RESEND_SENT_CACHE_TTL", 3600))
+_enviados = TTLCache(maxsize=RESEND_SENT_CACHE_MAXSIZE, ttl=RESEND_SENT_CACHE_TTL)
+
+# --- Escritura diferida del estado ---
+# Los cambios de estado se agrupan en una transacción por lote y cada mensaje
+# se confirma a RabbitMQ cuando su cambio ya es durable.
+status_writer = WriteBehindBuffer(SessionLocal, name="resend-status-writer")
+
+bulk_batcher = (
+    KeyedBatcher(
+        lambda mensajes: get_sms_client().send_sms_bulk(mensajes),
+        executor,
+        max_items=RESEND_BULK_MAX,
+        max_delay_ms=RESEND_BULK_WINDOW_MS,
+        name="resend-bulk",
+    )
+    if SMS_API_CONFIG["bulk_url"]
+    else None
+)
 
-CERTIFICACION_PDF_QUEUE = (
-    "Certificacion_PDF"  # Cola a la que se publican las nuevas tareas
+# Mensajes sin confirmar: los que están en vuelo, los que esperan el commit
+# y, con el envío en bloque, los que esperan a que salga su lote
+RESEND_PREFETCH = int(
+    os.getenv(
+        "RESEND_PREFETCH",
+        RESEND_CONCURRENCY * (2 if WRITE_BEHIND_ENABLED else 1)
+        + (RESEND_BULK_MAX if bulk_batcher is not None else 0),
+    )
 )
 
+# --- Variables globales para la conexión de consumo ---
+rabbitmq_connection = None
+rabbitmq_channel = None
+
+class _PayloadParaLog:
+    """
+    Representación del payload para los logs: solo se serializa si el nivel
+    de log lo requiere, y sin contraseña, texto ni número completo.
+    """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        redactado = dict(self.payload)
+        redactado["auth"] = {"username": self.payload["auth"]["username"], "password": "********"}
+        if "receivers" in self.payload:
+            redactado["receivers"] = f"<{len(self.payload['receivers'])} destinatarios>"
+        else:
+            redactado["receiver"] = "***" + self.payload["receiver"][-3:]
+        redactado["text"] = f"<{len(self.payload['text'])} caracteres>"
+        return json.dumps(redactado)
+
+
 class StandaloneSmsEsClient:
     """
     Cliente de API para interactuar con el servicio de SMS.es.
     Esta versión está adaptada para ser usada fuera de Odoo.
+    Se crea una vez por worker y lo comparten sus hilos: la sesión HTTP
+    mantiene conexiones keep-alive y evita DNS, TCP y TLS en cada envío.
     """
-    def __init__(self, config):
+    def __init__(self, config, rate_limiter=None, circuit_breaker=None):
         """
         Inicializa el cliente con un diccionario de configuración.
         :param config: Diccionario con los parámetros de la API.
+        :param rate_limiter: Limitador adaptativo de envíos; por defecto el
+            compartido por todos los procesos (`PROVIDER_RATE_*`).
+        :param circuit_breaker: Circuit breaker de la API; por defecto el
+            compartido por todos los procesos (`CIRCUIT_*`).
         """
         self.api_url = config.get("api_url")
+        self.bulk_url = config.get("bulk_url")
         self.username = config.get("username")
         self.password = config.get("password")
         self.dlr_mask = config.get("dlr_mask", 19)
@@ -66,10 +180,34 @@ class StandaloneSmsEsClient:
         self.use_flash = config.get("use_flash", False)
         self.use_validate_period = config.get("use_validate_period", True)
         self.validate_period_minutes = config.get("validate_period_minutes", 1440)
+        self.timeout = (
+            config.get("connect_timeout", SMS_API_CONNECT_TIMEOUT),
+            config.get("read_timeout", SMS_API_READ_TIMEOUT),
+        )
 
         if not all([self.api_url, self.username, self.password]):
             raise ValueError("La configuración de la API de SMS (URL, usuario, contraseña) no está completa.")
 
+        self.rate_limiter = rate_limiter or get_provider_limiter()
+        self.circuit_breaker = circuit_breaker or get_provider_breaker()
+        self.session = self._build_session(config.get("pool_maxsize", RESEND_CONCURRENCY))
+
+    @staticmethod
+    def _build_session(pool_maxsize):
+        """
+        Sesión con un pool de tantas conexiones como envíos en vuelo. Sin
+        reintentos de urllib3: los fallos se reprograman en las colas de espera.
+        """
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        session = requests.Session()
+        session.headers.update({"Content-Type": "application/json; charset=utf-8"})
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
     def _build_payload(self, message_data):
         """Construye el payload para la API de SMS."""
         payload = {
@@ -92,190 +230,511 @@ class StandaloneSmsEsClient:
         payload["dcs"] = self.dcs
         return payload
 
-    def send_sms(self, message_data, max_retries=3):
+    def _build_bulk_payload(self, messages):
+        """Payload multi-destinatario para SMS con el mismo remitente y texto."""
+        payload = self._build_payload(messages[0])
+        del payload["receiver"], payload["custom"]
+        payload["receivers"] = [
+            {
+                "receiver": m["receiver"].lstrip("+"),
+                "custom": {"db_message_id": m["db_message_id"]},
+            }
+            for m in messages
+        ]
+        return payload
+
+    def _post(self, url, body):
+        """
+        POST al proveedor pasando por el circuit breaker y el limitador. Con el
+        breaker abierto devuelve el resultado `parked` en lugar de la respuesta.
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow_request():
+            return {
+                "status": "parked",
+                "retry_after": breaker.retry_after(),
+                "error": {"code": -1, "message": "Circuit breaker abierto"},
+            }
+
+        if self.rate_limiter is not None:
+            # Espera al ritmo que el proveedor está aceptando ahora mismo
+            self.rate_limiter.acquire()
+
+        inicio = time.monotonic()
+        try:
+            response = self.session.post(url, data=body, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            if breaker is not None:
+                breaker.record(False, time.monotonic() - inicio)
+            logger.error("Error de conexión con la API de SMS: %s.", e)
+            return {"status": "retry", "error": {"code": -1, "message": str(e)}}
+
+        if breaker is not None:
+            # 420 (rechazo o throttling) es una respuesta sana del proveedor
+            breaker.record(response.status_code < 500, time.monotonic() - inicio)
+        return response
+
+    def _resultado_error(self, response):
+        """Resultado para una respuesta distinta de 202."""
+        if response.status_code == 420:
+            error_data = response.json().get("error", {})
+            if error_data.get("code") == RC_THROTTLING_ERROR:
+                logger.info("Error de throttling (105).")
+                if self.rate_limiter is not None:
+                    self.rate_limiter.on_throttle()
+                return {"status": "retry", "error": error_data}
+            logger.warning("SMS rechazado (420) por la API: %s", response.text)
+            return {"status": "failed", "error": error_data}
+
+        elif 500 <= response.status_code < 600:
+            logger.error("Error del servidor de la API (%s).", response.status_code)
+            return {"status": "retry", "error": {"code": response.status_code, "message": response.text}}
+
+        logger.error("Respuesta inesperada de la API. Código: %s, Respuesta: %s", response.status_code, response.text)
+        return {"status": "failed", "error": {"code": response.status_code, "message": response.text}}
+
+    def send_sms(self, message_data):
         """
-        Envía un SMS, gestionando la construcción del payload y la lógica de reintentos.
+        Envía un SMS con un único intento. No espera entre reintentos: un fallo
+        transitorio (throttling, 5xx o error de red) devuelve `status: retry`
+        y el worker reprograma el mensaje en una cola de reintento. Con el
+        circuit breaker abierto no se intenta: devuelve `status: parked` y los
+        segundos que faltan para volver a intentarlo (`retry_after`).
         """
         try:
             payload = self._build_payload(message_data)
-            payload_for_log = payload.copy()
-            # Ocultar contraseña en logs
-            # if payload_for_log.get("auth"):
-            #     payload_for_log['auth']['password'] = '********'
-            logger.info("Enviando SMS. Payload: %s", json.dumps(payload_for_log))
+            # Única serialización: el log solo se formatea si está activo
+            body = json.dumps(payload).encode("utf-8")
+            logger.info("Enviando SMS. Payload: %s", _PayloadParaLog(payload))
         except Exception as e:
             logger.error("Error construyendo el payload del SMS: %s", e)
             return {"status": "failed", "error": {"code": -1, "message": f"Error de payload: {e}"}}
 
-        attempts = 0
-        while attempts < max_retries:
-            attempts += 1
-            try:
-                headers = {"Content-Type": "application/json; charset=utf-8"}
-                print(payload)
-                response = requests.post(
-                    self.api_url,
-                    data=json.dumps(payload).encode("utf-8"),
-                    headers=headers,
-                    timeout=20,
-                )
+        response = self._post(self.api_url, body)
+        if isinstance(response, dict):
+            return response
 
-                if response.status_code == 202:
-                    logger.info("SMS aceptado por la API. Respuesta: %s", response.text)
-                    return {"status": "success", "data": response.json()} #{"status": "success", "data": {"msgid": "9856", "numParts": 1}}
-                
-                elif response.status_code == 420:
-                    error_data = response.json().get("error", {})
-                    if error_data.get("code") == RC_THROTTLING_ERROR:
-                        logger.info("Error de throttling (105). Reintentando en 1 segundo...")
-                        time.sleep(1)
-                        continue
-                    else:
-                        logger.warning("SMS rechazado (420) por la API: %s", response.text)
-                        return {"status": "failed", "error": error_data}
-                
-                elif 500 <= response.status_code < 600:
-                    logger.error(f"Error del servidor de la API ({response.status_code}). Reintentando en 1 minuto...")
-                    time.sleep(60)
-                    continue
-                
-                else:
-                    logger.error(f"Respuesta inesperada de la API. Código: {response.status_code}, Respuesta: {response.text}")
-                    return {"status": "failed", "error": {"code": response.status_code, "message": response.text}}
-
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error de conexión con la API de SMS: {e}. Reintentando en 1 minuto...")
-                if attempts < max_retries:
-                    time.sleep(60)
-                continue
-        
-        logger.error(f"El envío del SMS ha fallado después de {max_retries} intentos.")
-        return {"status": "failed", "error": {"code": -1, "message": f"Falló después de {max_retries} reintentos."}}
+        if response.status_code == 202:
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success()
+            logger.info("SMS aceptado por la API. Respuesta: %s", response.text)
+            return {"status": "success", "data": response.json()} #{"status": "success", "data": {"msgid": "9856", "numParts": 1}}
+        return self._resultado_error(response)
+
+    def send_sms_bulk(self, messages):
+        """
+        Envía en una sola petición multi-destinatario (`bulk_url`) varios SMS
+        con el mismo remitente, texto y dcs. Devuelve un resultado por mensaje,
+        en el mismo orden y con el formato de `send_sms`: el proveedor devuelve
+        un `msgId` por destinatario con su `custom`, y así se asocia cada uno a
+        su `SmsIncoming`. Sin `bulk_url`, o con un único SMS, envía uno a uno.
+        """
+        if not self.bulk_url or len(messages) == 1:
+            return [self.send_sms(m) for m in messages]
+
+        try:
+            payload = self._build_bulk_payload(messages)
+            body = json.dumps(payload).encode("utf-8")
+            logger.info("Enviando %s SMS en bloque. Payload: %s", len(messages), _PayloadParaLog(payload))
+        except Exception as e:
+            logger.error("Error construyendo el payload del envío en bloque: %s", e)
+            return [{"status": "failed", "error": {"code": -1, "message": f"Error de payload: {e}"}}] * len(messages)
+
+        response = self._post(self.bulk_url, body)
+        if isinstance(response, dict):
+            return [response] * len(messages)
+        if response.status_code != 202:
+            return [self._resultado_error(response)] * len(messages)
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_success()
+        por_id = {
+            str(item.get("custom", {}).get("db_message_id")): item
+            for item in response.json().get("messages", [])
+        }
+        resultados = []
+        for m in messages:
+            item = por_id.get(str(m["db_message_id"]))
+            if item is None:
+                resultados.append({"status": "failed", "error": {"code": -1, "message": "Sin respuesta del proveedor para este destinatario"}})
+            elif item.get("error"):
+                # El throttling de un destinatario se reintenta como en el envío individual
+                reintentar = item["error"].get("code") == RC_THROTTLING_ERROR
+                resultados.append({"status": "retry" if reintentar else "failed", "error": item["error"]})
+            else:
+                resultados.append({"status": "success", "data": {"msgId": item.get("msgId"), "numParts": item.get("numParts")}})
+        logger.info("Envío en bloque de %s SMS aceptado por la API.", len(messages))
+        return resultados
+
+
+_sms_client = None
+_sms_client_lock = threading.Lock()
+
+
+def get_sms_client() -> StandaloneSmsEsClient:
+    """Cliente del worker, creado en el primer envío y reutilizado después."""
+    global _sms_client
+    with _sms_client_lock:
+        if _sms_client is None:
+            _sms_client = StandaloneSmsEsClient(SMS_API_CONFIG)
+        return _sms_client
 
 
-def publish_to_pdf_queue(db_message_id: int):
+def callback(ch, method, properties, body):
     """
-    Publica un mensaje en la cola Certificacion_PDF.
+    Función que se ejecuta por cada mensaje consumido. El envío se hace en el
+    pool de hilos para tener hasta RESEND_CONCURRENCY envíos en vuelo.
     """
-    if not rabbitmq_channel or not rabbitmq_channel.is_open:
+    executor.submit(process_message, ch, method.delivery_tag, body, properties)
+
+
+def _responder(ch, fn, delivery_tag, **kwargs):
+    """
+    Ejecuta el ack/nack en el hilo de la conexión: los canales de pika no son
+    thread-safe, así que desde el pool solo se puede programar la llamada.
+    """
+    ch.connection.add_callback_threadsafe(partial(fn, delivery_tag=delivery_tag, **kwargs))
+
+
+def _a_dlq(ch, delivery_tag, body, properties, error_class, error):
+    """Envía el mensaje a la DLQ de la cola de reenvío y confirma el original."""
+    def _en_hilo_conexion():
+        publish_dead_letter(ch, SMS_RESEND_QUEUE, body, properties, error_class, error)
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    ch.connection.add_callback_threadsafe(_en_hilo_conexion)
+
+
+def _reintentar(ch, delivery_tag, body, properties, db_message_id, error):
+    """
+    Programa el reenvío del mensaje en una cola de espera y confirma el
+    original. Publicar y confirmar se hacen en el hilo de la conexión, en ese
+    orden: si el worker cae entre ambos, el mensaje se duplica pero no se pierde.
+    Agotados los intentos, el mensaje va a la DLQ. Quien llama ya soltó el
+    reclamo, así que el SMS vuelve a 'pending' y puede reprocesarse con
+    tools/dlq_cli.py.
+    """
+    intento = retry_attempt(properties) + 1
+    if intento >= RESEND_MAX_ATTEMPTS:
         logger.error(
-            "El canal de RabbitMQ no está disponible para publicar en la cola PDF."
+            f"El SMS '{db_message_id}' agotó sus {RESEND_MAX_ATTEMPTS} intentos: {error}."
         )
-        # Esto es un error crítico, el estado se actualizó pero la siguiente tarea no se encoló.
-        # Requiere monitoreo y posible intervención manual o un proceso de conciliación.
+        _a_dlq(ch, delivery_tag, body, properties, "RetriesExhausted", error)
         return
 
-    message_body = {"db_message_id": db_message_id}
-    try:
-        rabbitmq_channel.basic_publish(
-            exchange="",
-            routing_key=CERTIFICACION_PDF_QUEUE,
-            body=json.dumps(message_body).encode("utf-8"),
-            properties=pika.BasicProperties(
-                delivery_mode=2
-            ),  # Mensaje persistente
+    def _en_hilo_conexion():
+        espera = publish_retry(
+            ch, SMS_RESEND_QUEUE, body, properties, intento, RESEND_RETRY_DELAYS
         )
+        ch.basic_ack(delivery_tag=delivery_tag)
         logger.info(
-            f"Tarea para db_message_id '{db_message_id}' encolada en '{CERTIFICACION_PDF_QUEUE}'."
+            f"Reintento {intento} del SMS '{db_message_id}' programado en {espera:.1f}s."
+        )
+
+    ch.connection.add_callback_threadsafe(_en_hilo_conexion)
+
+
+def _aparcar(ch, delivery_tag, body, properties, db_message_id, espera_minima,
+             motivo="circuit breaker del proveedor abierto"):
+    """Devuelve el mensaje a una cola de espera sin contar un intento y confirma el original."""
+    def _en_hilo_conexion():
+        espera = publish_parked(
+            ch, SMS_RESEND_QUEUE, body, properties, espera_minima, RESEND_RETRY_DELAYS
         )
+        ch.basic_ack(delivery_tag=delivery_tag)
+        logger.info(
+            f"SMS '{db_message_id}' aparcado {espera:.1f}s: {motivo}."
+        )
+
+    ch.connection.add_callback_threadsafe(_en_hilo_conexion)
+
+
+def _datos_de_la_tarea(task: dict):
+    """Datos de envío de una tarea completa (esquema v2+), o `None` si hay que leer la BBDD."""
+    if task.get("v", 1) < 2 or not all(task.get(campo) for campo in ("sender", "receiver", "text")):
+        return None
+    return {
+        "sender": task["sender"],
+        "receiver": task["receiver"],
+        "text": task["text"],
+        "db_message_id": task["db_message_id"],
+    }
+
+
+def _reclamar(db_message_id: str):
+    """
+    Reclama el envío del SMS a través del búfer de escritura diferida y espera
+    a que el reclamo sea durable antes de enviar: los reclamos de los hilos del
+    pool comparten transacción con el resto de cambios de estado. Devuelve
+    `("reclamado", 0)`, `("en_curso", segundos)` si otro worker lo tiene
+    reclamado (hasta que caduque su reclamo), `("procesado", 0)` o `("no_existe", 0)`.
+    """
+    def _reclamo(db: Session):
+        if claim_send(db, db_message_id, RESEND_CLAIM_TIMEOUT):
+            return "reclamado", 0
+        sms = (
+            db.query(SmsIncoming.status_code, SmsIncoming.provider_id, SmsIncoming.send_claimed_at)
+            .filter(SmsIncoming.message_id == db_message_id)
+            .first()
+        )
+        if sms is None:
+            return "no_existe", 0
+        if sms.status_code == SmsStatus.SENDING and sms.provider_id is None and sms.send_claimed_at is not None:
+            caduca = sms.send_claimed_at + timedelta(seconds=RESEND_CLAIM_TIMEOUT) - datetime.utcnow()
+            return "en_curso", max(caduca.total_seconds(), 1)
+        return "procesado", 0
+
+    return status_writer.submit(_reclamo).result()
+
+
+def _soltar_reclamo(db_message_id: str):
+    """
+    Suelta el reclamo de un envío que no llegó al proveedor, para que su
+    reintento pueda reclamarlo. Se encola en el búfer de escritura diferida
+    sin esperar: el reintento sale con retardo y, si la escritura falla, el
+    reclamo caduca solo.
+    """
+    def _soltado(future):
+        if future.exception() is not None:
+            logger.warning(
+                f"No se pudo soltar el reclamo del SMS '{db_message_id}' ({future.exception()}). "
+                f"Caducará en {RESEND_CLAIM_TIMEOUT:.0f}s."
+            )
+
+    status_writer.submit(lambda db: release_send(db, db_message_id)).add_done_callback(_soltado)
+
+
+def _liberar(db_message_id):
+    with _en_vuelo_lock:
+        _en_vuelo.discard(db_message_id)
+
+
+def _guardar_y_confirmar(ch, delivery_tag, body, properties, db_message_id, escribir, al_guardar=None):
+    """
+    Encola `escribir(db)` en el búfer de escritura diferida y confirma el
+    mensaje cuando su commit es durable (a la DLQ si falla). El SMS sigue
+    "en vuelo" hasta entonces, para que un duplicado no se reenvíe.
+    """
+    def _guardado(future):
+        try:
+            try:
+                resultado = future.result()
+            except Exception as e:
+                logger.error(f"No se pudo guardar el estado del SMS '{db_message_id}': {e}")
+                _a_dlq(ch, delivery_tag, body, properties, type(e).__name__, e)
+                return
+            if al_guardar is not None:
+                al_guardar(resultado)
+            _responder(ch, ch.basic_ack, delivery_tag)
+        finally:
+            _liberar(db_message_id)
+
+    status_writer.submit(escribir).add_done_callback(_guardado)
+
+
+def _tras_envio(ch, delivery_tag, body, properties, db_message_id, result) -> bool:
+    """
+    Actúa según el resultado del envío: guarda el estado, reprograma o aparca
+    el mensaje. Devuelve `True` si el SMS queda "en vuelo" hasta que se guarde
+    su estado (lo libera entonces `_guardar_y_confirmar`).
+    """
+    response_data = result.get("data", {}) \
+        if result["status"] == "success" else {}
+
+    logger.info(f"Respuesta del endpoint externo: {response_data}")
+
+    # 2. Si la respuesta indica "DELIVERED", actualizar BBDD
+    if result["status"] == "success":
+        logger.info(
+            f"El mensaje '{db_message_id}' fue aceptado por la API para su entrega"
+        )
+        provider_id = response_data.get("msgId")
+        _enviados.set(db_message_id, True)
+        num_parts = response_data.get("numParts")
+
+        def _actualizado(aplicado):
+            if aplicado:
+                logger.info(
+                    f"Estado del mensaje '{db_message_id}' actualizado 'SENDING' en la BBDD."
+                )
+            else:
+                logger.warning(
+                    f"El SMS '{db_message_id}' cambió de estado durante el envío. No se actualiza."
+                )
+
+        # UPDATE condicional: solo si el envío sigue reclamado y sin provider_id.
+        # El mensaje se confirma cuando el cambio es durable.
+        _guardar_y_confirmar(
+            ch, delivery_tag, body, properties, db_message_id,
+            lambda db_lote: record_send(
+                db_lote,
+                db_message_id,
+                provider_id=provider_id,
+                num_parts=num_parts,
+            ),
+            _actualizado,
+        )
+        return True
+    elif result["status"] == "parked":
+        # Proveedor caído: se aparca sin gastar un intento ni ocupar el hilo
+        _soltar_reclamo(db_message_id)
+        _aparcar(ch, delivery_tag, body, properties, db_message_id, result["retry_after"])
+        return False
+    elif result["status"] == "retry":
+        # Fallo transitorio: se reintenta más tarde sin bloquear este hilo
+        logger.warning(
+            f"Fallo transitorio enviando el SMS '{db_message_id}': {result.get('error')}."
+        )
+        _soltar_reclamo(db_message_id)
+        _reintentar(ch, delivery_tag, body, properties, db_message_id, result.get("error"))
+        return False
+    else:
+        error_info = result.get("error", {})
+        logger.warning(
+            f"La entrega falló para el mensaje '{db_message_id}'. Razón: {error_info}. Marcando como fallido."
+        )
+        # Se hace ACK porque el fallo fue una respuesta controlada del endpoint,
+        # no un error del sistema: el SMS queda 'sent_failed' y no se reintenta.
+        _guardar_y_confirmar(
+            ch, delivery_tag, body, properties, db_message_id,
+            lambda db_lote: transition(db_lote, db_message_id, SmsStatus.SENT_FAILED, send_claimed_at=None),
+        )
+        return True
+
+
+def _tras_envio_en_bloque(ch, delivery_tag, body, properties, db_message_id, future):
+    """Callback del envío en bloque: se ejecuta en el hilo que envió el lote."""
+    diferido = False
+    try:
+        diferido = _tras_envio(ch, delivery_tag, body, properties, db_message_id, future.result())
     except Exception as e:
         logger.error(
-            f"Error al publicar en la cola PDF para db_message_id '{db_message_id}': {e}"
+            f"Error inesperado procesando el mensaje id '{db_message_id}': {e}"
         )
+        if future.exception() is not None:
+            # El lote no llegó a enviarse
+            _soltar_reclamo(db_message_id)
+        _a_dlq(ch, delivery_tag, body, properties, type(e).__name__, e)
+    finally:
+        if not diferido:
+            _liberar(db_message_id)
 
 
-def callback(ch, method, properties, body):
+def process_message(ch, delivery_tag, body, properties=None):
     """
-    Función que se ejecuta por cada mensaje consumido.
+    Reenvía al proveedor el SMS de una tarea. Se ejecuta en un hilo del pool.
     """
-    logger.info(f"Mensaje recibido: {body.decode()}")
-    db: Session = next(get_db())
-    task_data = json.loads(body)
-    db_message_id = task_data.get("db_message_id")
+    try:
+        task = decode_task(body, properties.content_type if properties is not None else None)
+        db_message_id = task.get("db_message_id")
+    except ValueError:
+        task, db_message_id = None, None
+    logger.info(f"Tarea recibida para SMS id '{db_message_id}'.")
 
     if not db_message_id:
-        logger.error("Mensaje inválido, falta 'db_message_id'. Descartando.")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        logger.error("Mensaje inválido, falta 'db_message_id'.")
+        _a_dlq(ch, delivery_tag, body, properties, "InvalidMessage", "Falta 'db_message_id'")
+        return
+
+    # Una tarea duplicada puede llegar mientras la original sigue en vuelo
+    # en otro hilo: no debe enviarse dos veces.
+    with _en_vuelo_lock:
+        duplicada = db_message_id in _en_vuelo
+        _en_vuelo.add(db_message_id)
+    if duplicada:
+        logger.warning(f"El SMS '{db_message_id}' ya se está enviando. Descartando duplicado.")
+        _responder(ch, ch.basic_ack, delivery_tag)
         return
 
+    db: Session = next(get_db())
+    # Con la escritura diferida, el SMS se libera al guardarse su estado
+    diferido = False
+    # Reclamado y aún sin llamar al proveedor: un error lo devuelve a 'pending'
+    reclamado = False
     try:
-        # Buscar el SMS en la base de datos
-        sms = (
-            db.query(SmsIncoming)
-            .filter(SmsIncoming.message_id == db_message_id)
-            .first()
-        )
+        # Una tarea completa trae los datos del SMS: no hace falta leerlo
+        message_data = _datos_de_la_tarea(task)
+        if message_data is not None and _enviados.get(db_message_id) is not MISSING:
+            logger.warning(f"El SMS '{db_message_id}' ya fue enviado. Descartando duplicado.")
+            _responder(ch, ch.basic_ack, delivery_tag)
+            return
 
-        if not sms:
+        # El relay del outbox entrega "al menos una vez": el envío se reclama en
+        # la BBDD antes de llamar al proveedor, así un duplicado que llegue a
+        # otro proceso (o tras un reinicio) no se reenvía.
+        estado, espera = _reclamar(db_message_id)
+        if estado == "en_curso":
+            # Otro worker lo está enviando; si cayó, su reclamo habrá caducado al volver
+            _aparcar(
+                ch, delivery_tag, body, properties, db_message_id, espera,
+                motivo="otro worker tiene reclamado su envío",
+            )
+            return
+        if estado == "no_existe":
             logger.error(
                 f"No se encontró el SMS con id '{db_message_id}' en la BBDD. Descartando mensaje."
             )
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            _responder(ch, ch.basic_ack, delivery_tag)
             return
+        if estado == "procesado":
+            logger.warning(f"El SMS '{db_message_id}' ya fue procesado. Descartando duplicado.")
+            _responder(ch, ch.basic_ack, delivery_tag)
+            return
+        reclamado = True
+
+        if message_data is None:
+            # Tarea antigua (v1): los datos del SMS se leen de la BBDD
+            sms = (
+                db.query(SmsIncoming)
+                .filter(SmsIncoming.message_id == db_message_id)
+                .first()
+            )
+            message_data = {
+                "sender": sms.sender,
+                "receiver": sms.receiver,
+                "text": sms.content,
+                "db_message_id": sms.message_id,
+            }
 
         logger.info(
-            f"Procesando reenvío para SMS id '{db_message_id}' al sender '{sms.sender}'."
+            f"Procesando reenvío para SMS id '{db_message_id}' al sender '{message_data['sender']}'."
         )
 
         # 1. Utilizar 'requests' para reenviar el mensaje
-        sms_client = StandaloneSmsEsClient(SMS_API_CONFIG)
-        message_data = {
-            "sender": sms.sender,
-            "receiver": sms.receiver,
-            "text": sms.content,
-            "db_message_id": sms.message_id,
-        }
-        result = sms_client.send_sms(message_data)
-        response_data = result.get("data", {}) \
-            if result["status"] == "success" else {}
-        
-        logger.info(f"Respuesta del endpoint externo: {response_data}")
-        
-        # 2. Si la respuesta indica "DELIVERED", actualizar BBDD
-        if result["status"] == "success":
-            logger.info(
-                f"El mensaje '{db_message_id}' fue aceptado por la API para su entrega"
-            )
-            sms.status = "SENDING"
-            sms.provider_id = response_data.get("msgId")
-            sms.num_parts = response_data.get("numParts")
-            db.commit()
-            logger.info(
-                f"Estado del mensaje '{db_message_id}' actualizado 'SENDING' en la BBDD."
-            )
-
-            # 3. Encolar nueva tarea en "Certificación_PDF"
-            #publish_to_pdf_queue(db_message_id=sms.message_id)
-
-            # Confirmar que el mensaje fue procesado exitosamente
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-        else:
-            error_info = result.get("error", {})
-            logger.warning(
-                f"La entrega falló para el mensaje '{db_message_id}'. Razón: {error_info}. Marcando como fallido."
+        if bulk_batcher is not None:
+            # Envío en bloque: el resultado llega cuando sale el lote, sin ocupar este hilo
+            clave = (message_data["sender"], message_data["text"], get_sms_client().dcs)
+            bulk_batcher.submit(clave, message_data).add_done_callback(
+                lambda future: _tras_envio_en_bloque(
+                    ch, delivery_tag, body, properties, db_message_id, future
+                )
             )
-            sms.status = "sent_failed"
-            db.commit()
-            # Se hace ACK porque el fallo fue una respuesta controlada del endpoint, no un error del sistema.
-            # No se debe reintentar indefinidamente. Para reintentos, se necesitaría un sistema de 'dead-letter queue'.
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            diferido = True
+            return
+        reclamado = False
+        result = get_sms_client().send_sms(message_data)
+        diferido = _tras_envio(ch, delivery_tag, body, properties, db_message_id, result)
 
     except requests.exceptions.RequestException as e:
         logger.error(
             f"Error de red al contactar el endpoint externo para SMS id '{db_message_id}': {e}"
         )
-        # NO hacemos ACK. El mensaje será re-entregado por RabbitMQ para un nuevo intento.
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        # Se reprograma en una cola de espera en lugar de re-encolarlo al instante.
+        _soltar_reclamo(db_message_id)
+        _reintentar(ch, delivery_tag, body, properties, db_message_id, e)
     except Exception as e:
         logger.error(
             f"Error inesperado procesando el mensaje id '{db_message_id}': {e}"
         )
         db.rollback()
-        # NO hacemos ACK, pero evitamos re-encolarlo para prevenir bucles de envenenamiento.
-        # Idealmente, esto iría a una 'dead-letter-queue'.
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        if reclamado:
+            _soltar_reclamo(db_message_id)
+        # No se re-encola para evitar bucles de envenenamiento: va a la DLQ.
+        _a_dlq(ch, delivery_tag, body, properties, type(e).__name__, e)
     finally:
         db.close()
+        if not diferido:
+            _liberar(db_message_id)
 
 
 def main():
@@ -283,6 +742,10 @@ def main():
     Función principal que inicia la conexión y el consumo de mensajes.
     """
     global rabbitmq_connection, rabbitmq_channel
+    if WRITE_BEHIND_ENABLED:
+        status_writer.start()
+    if bulk_batcher is not None:
+        bulk_batcher.start()
     while True:
         try:
             logger.info("Iniciando worker de reenvío de SMS...")
@@ -301,9 +764,11 @@ def main():
             rabbitmq_channel.queue_declare(
                 queue=CERTIFICACION_PDF_QUEUE, durable=True
             )
+            declare_retry_queues(rabbitmq_channel, SMS_RESEND_QUEUE, RESEND_RETRY_DELAYS)
+            declare_dead_letter_queue(rabbitmq_channel, SMS_RESEND_QUEUE)
 
-            # Procesar un mensaje a la vez
-            rabbitmq_channel.basic_qos(prefetch_count=1)
+            # Envíos en vuelo más los que esperan a que su estado se guarde
+            rabbitmq_channel.basic_qos(prefetch_count=RESEND_PREFETCH)
             rabbitmq_channel.basic_consume(
                 queue=SMS_RESEND_QUEUE, on_message_callback=callback
             )
@@ -320,7 +785,15 @@ def main():
             time.sleep(5)
         except KeyboardInterrupt:
             logger.info("Deteniendo el worker...")
+            if bulk_batcher is not None:
+                bulk_batcher.stop()
+            executor.shutdown(wait=True)
+            status_writer.stop()
+            if _sms_client is not None:
+                _sms_client.close()
             if rabbitmq_connection and rabbitmq_connection.is_open:
+                # Envía los acks de la última escritura antes de cerrar
+                rabbitmq_connection.process_data_events(time_limit=0)
                 rabbitmq_connection.close()
             break
         except Exception as e: